@@ -0,0 +1,278 @@
+"""
+Runs the detector configurations behind results.json over the test set.
+
+Every (configuration, image) pair runs in parallel with its own detector.
+For each configuration the output records accuracy (per image, micro and
+macro), wall time, per-stage latency percentiles, LLM call count and latency,
+and bytes uploaded.
+
+    # live provider, responses recorded into the cache
+    python -m src.benchmarks.configurations --llm live --model gpt-4o
+    # offline, replaying recorded responses (fails on a miss)
+    python -m src.benchmarks.configurations --llm replay --model gpt-4o
+    # offline, canned responses with simulated latency, for throughput only
+    python -m src.benchmarks.configurations --llm stub --stub-latency 0.5
+    # injected slow calls and errors (python -m src.benchmarks.stub_server)
+    python -m src.benchmarks.configurations --llm live --model openai/stub \
+        --api-url http://127.0.0.1:8765/v1 --cache-dir /tmp/stub-cache --hedge --deadline 30
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.benchmarks.llm import InstrumentedLLM, StubLLM
+from src.edge_validator import BatchEdgeEvaluator, EdgeValidator
+from src.tracing import tracer
+from src.utils.path import from_root
+
+
+class Configuration:
+    def __init__(self, name: str, mermaid: bool, should_crop: bool, with_nodes: bool, joint: bool = False):
+        self.name = name
+        self.mermaid = mermaid
+        self.should_crop = should_crop
+        self.with_nodes = with_nodes
+        # Nodes and edges from one call per crop instead of two
+        self.joint = joint
+
+
+CONFIGURATIONS = {config.name: config for config in [
+    Configuration("mermaid_no_crop", True, False, False),
+    Configuration("mermaid_crop", True, True, False),
+    Configuration("mermaid_with_nodes_no_crop", True, False, True),
+    Configuration("mermaid_with_nodes_crop", True, True, True),
+    Configuration("no_crop", False, False, False),
+    Configuration("crop", False, True, False),
+    Configuration("with_nodes_no_crop", False, False, True),
+    Configuration("with_nodes_crop", False, True, True),
+    Configuration("mermaid_joint_no_crop", True, False, True, joint=True),
+    Configuration("mermaid_joint_crop", True, True, True, joint=True),
+    Configuration("joint_no_crop", False, False, True, joint=True),
+    Configuration("joint_crop", False, True, True, joint=True),
+]}
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def at(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {"count": len(ordered), "p50": at(0.5), "p90": at(0.9), "p99": at(0.99), "max": ordered[-1]}
+
+
+def dataset(images_dir: Path, json_dir: Path) -> List[Tuple[str, str]]:
+    pairs = []
+    for image in sorted(images_dir.iterdir(), key=lambda path: (len(path.stem), path.stem)):
+        truth = json_dir / f"{image.stem}.json"
+        if truth.exists():
+            pairs.append((str(image), str(truth)))
+    return pairs
+
+
+class Runner:
+    def __init__(self, make_llm: Callable[[], Any], max_workers: int, boxes: Any = None,
+                 soft_scores: bool = False, resolve_entities: bool = False):
+        self.make_llm = make_llm
+        self.max_workers = max_workers
+        # Optional BoxConsolidator applied to the YOLO boxes of crop configurations
+        self.boxes = boxes
+        # Also score with LocalEdgeValidator, which credits near-miss labels
+        self.soft_scores = soft_scores
+        # Merge near-duplicate nodes of overlapping crops in get_graph()
+        self.resolve_entities = resolve_entities
+        # The YOLO model is shared and not thread-safe
+        self.yolo_lock = threading.Lock()
+
+    def make_detector(self, config: Configuration, llm: Any):
+        yolo = None
+        if config.should_crop:
+            from src.model_registry import registry
+            from src.yolo.yolo import Yolo
+            yolo = Yolo(registry.get("yolo"))
+
+        if config.mermaid:
+            from src.mermaid_detector import MermaidDetector
+            from src.mermaid_to_json import MermaidToJSON
+            return MermaidDetector(llm, yolo, MermaidToJSON(llm), self.max_workers, boxes=self.boxes,
+                                   resolve_entities=self.resolve_entities)
+
+        from src.llm_detector import Detector
+        return Detector(llm, yolo, self.max_workers, boxes=self.boxes,
+                        resolve_entities=self.resolve_entities)
+
+    def run_image(self, config: Configuration, image: str, truth: str) -> dict:
+        llm = InstrumentedLLM(self.make_llm())
+        detector = self.make_detector(config, llm)
+        stages: Dict[str, float] = {}
+
+        def timed(stage: str, fn: Callable[[], Any]) -> Any:
+            start = time.perf_counter()
+            result = fn()
+            stages[stage] = time.perf_counter() - start
+            return result
+
+        if config.should_crop:
+            with self.yolo_lock:
+                timed("initiate_image", lambda: detector.initiate_image(image, True))
+        else:
+            timed("initiate_image", lambda: detector.initiate_image(image, False))
+        if config.joint:
+            timed("detect_graph", detector.detect_diagram if config.mermaid else detector.detect_graph)
+        else:
+            if config.with_nodes:
+                timed("detect_nodes", detector.detect_nodes)
+            timed("detect_edges", detector.detect_edges)
+        if config.mermaid:
+            timed("convert_edges", detector.convert_edges)
+        graph = timed("get_graph", detector.get_graph)
+
+        removed = detector.box_report["crops_removed"] if detector.box_report else 0
+        calls_per_crop = 1 if config.joint else 1 + config.with_nodes
+        return {
+            "image": Path(image).stem,
+            "true_edges": EdgeValidator.from_json_file(truth, []).true_edges,
+            "predicted_edges": graph.edges,
+            "crops": len(detector.graph_images),
+            "stages": stages,
+            "llm_latencies": llm.latencies,
+            "bytes_uploaded": llm.bytes_uploaded,
+            "calls_saved": removed * calls_per_crop,
+        }
+
+    def run(self, configs: List[Configuration], pairs: List[Tuple[str, str]], workers: int,
+            output_dir: Path) -> Dict[str, dict]:
+        tasks = [(config, image, truth) for config in configs for image, truth in pairs]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda task: self.run_image(*task), tasks))
+        wall_time = time.perf_counter() - start
+
+        report: Dict[str, dict] = {"_run": {"wall_time": wall_time, "tasks": len(tasks)}}
+        for config in configs:
+            runs = [result for (task_config, _, _), result in zip(tasks, results)
+                    if task_config is config]
+            with BatchEdgeEvaluator(config.name, str(output_dir / f"{config.name}.jsonl"),
+                                    self.soft_scores) as evaluator:
+                for result in runs:
+                    evaluator.evaluate(result["image"], result["true_edges"], result["predicted_edges"])
+
+                stage_names = dict.fromkeys(stage for result in runs for stage in result["stages"])
+                report[config.name] = {
+                    **evaluator.scores(),
+                    "summary": evaluator.summary(),
+                    "image_time": percentiles([sum(result["stages"].values()) for result in runs]),
+                    "stages": {stage: percentiles([result["stages"][stage] for result in runs])
+                               for stage in stage_names},
+                    "llm_calls": sum(len(result["llm_latencies"]) for result in runs),
+                    "llm_latency": percentiles([latency for result in runs for latency in result["llm_latencies"]]),
+                    "bytes_uploaded": sum(result["bytes_uploaded"] for result in runs),
+                    "crops": sum(result["crops"] for result in runs),
+                    "calls_saved": sum(result["calls_saved"] for result in runs),
+                }
+        return report
+
+
+def make_llm_factory(args: argparse.Namespace) -> Callable[[], Any]:
+    if args.llm == "stub":
+        return lambda: StubLLM(args.stub_latency)
+
+    from src.llm_caller import LatencyPolicy, LLMCaller, ResponseCache
+    cache = ResponseCache(args.cache_dir, replay_only=args.llm == "replay") \
+        if args.cache_dir else ResponseCache(replay_only=args.llm == "replay")
+    policy = LatencyPolicy(timeout=args.request_timeout, deadline=args.deadline,
+                           max_retries=args.retries, hedge=args.hedge)
+    api_key = os.getenv("OPENAI_API_KEY") or os.getenv("WX_API_KEY") or ""
+    llm = LLMCaller(api_key=api_key, model_id=args.model, project_id=os.getenv("WX_PROJECT_ID"),
+                    api_url=args.api_url, cache=cache, policy=policy)
+    # LLMCaller holds no per-call state, one instance serves all threads
+    return lambda: llm
+
+
+def make_boxes(args: argparse.Namespace) -> Any:
+    if not args.consolidate_boxes:
+        return None
+    from src.yolo.boxes import BoxConsolidator
+    return BoxConsolidator()
+
+
+def add_run_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--images", default=str(from_root("datasets", "test", "images")))
+    parser.add_argument("--json", default=str(from_root("datasets", "test", "json")))
+    parser.add_argument("--llm", choices=["live", "replay", "stub"], default="replay")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--api-url", default=None)
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--stub-latency", type=float, default=0.0)
+    parser.add_argument("--request-timeout", type=float, default=None, help="seconds per LLM request")
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="seconds per LLM call, retries and hedges included")
+    parser.add_argument("--retries", type=int, default=2, help="retries of failed LLM requests")
+    parser.add_argument("--hedge", action="store_true",
+                        help="duplicate LLM requests slower than the p95 latency")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="images processed in parallel")
+    parser.add_argument("--crop-workers", type=int, default=8,
+                        help="LLM calls in flight per image")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--consolidate-boxes", action="store_true",
+                        help="merge overlapping YOLO boxes before cropping")
+    parser.add_argument("--resolve-entities", action="store_true",
+                        help="merge near-duplicate nodes of overlapping crops")
+    parser.add_argument("--soft-scores", action="store_true",
+                        help="also score with the fuzzy, offline LocalEdgeValidator")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("configs", nargs="*", default=None,
+                        choices=list(CONFIGURATIONS), metavar="CONFIG")
+    add_run_arguments(parser)
+    parser.add_argument("--trace", action="store_true",
+                        help="write per-stage spans next to results.json")
+    args = parser.parse_args(argv)
+    if args.trace:
+        tracer.enable()
+
+    output = Path(args.output) if args.output else from_root(
+        "runs", "benchmarks", datetime.now().strftime("%Y%m%d-%H%M%S"), "results.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    make_llm = make_llm_factory(args)
+    runner = Runner(make_llm, args.crop_workers, make_boxes(args), args.soft_scores, args.resolve_entities)
+    report = runner.run([CONFIGURATIONS[name] for name in args.configs or CONFIGURATIONS],
+                        dataset(Path(args.images), Path(args.json)), args.workers, output.parent)
+    policy = getattr(make_llm(), "policy", None)
+    if policy is not None:
+        report["_run"]["llm_policy"] = policy.stats()
+
+    if tracer.enabled:
+        report["_run"]["stages"] = tracer.summary()
+        tracer.export_jsonl(str(output.parent / "trace.jsonl"))
+        tracer.export_chrome_trace(str(output.parent / "trace.json"))
+
+    with open(output, "w") as f:
+        json.dump(report, f, indent=4)
+
+    for name, result in report.items():
+        if name == "_run":
+            continue
+        summary = result["summary"]["macro"]
+        print(f"{name:<28} f1 {summary['f1_score']:.3f}  p50 image "
+              f"{result['image_time'].get('p50', 0):6.2f}s  calls {result['llm_calls']:4d}  "
+              f"uploaded {result['bytes_uploaded'] / 1e6:7.2f} MB  saved {result['calls_saved']:4d}")
+    print(f"wall time {report['_run']['wall_time']:.2f}s, written to {output}")
+
+
+if __name__ == "__main__":
+    main()
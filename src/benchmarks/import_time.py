@@ -0,0 +1,74 @@
+"""
+Import-time budget for the modules batch workers start with.
+
+Each module is imported in a fresh interpreter with `python -X importtime`;
+the best cumulative time over `--runs` runs is compared with the threshold
+and the heaviest imports are listed. Exits with status 1 when a module is
+over budget, so it can run as a regression check in CI.
+
+    python -m src.benchmarks.import_time --threshold-ms 1000
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+from src.utils.path import ROOT_DIR
+
+DEFAULT_MODULES = ["src.llm_detector", "src.mermaid_detector"]
+LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def import_times(module: str) -> Dict[str, Tuple[int, int]]:
+    """Self and cumulative import time in microseconds, per imported module."""
+    env = {**os.environ, "PYTHONPATH": str(ROOT_DIR)}
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    times = {}
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            times[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return times
+
+
+def heaviest(times: Dict[str, Tuple[int, int]], module: str, count: int) -> List[Tuple[str, int]]:
+    # Top-level third-party packages and our own modules, by cumulative time
+    candidates = [(name, cumulative) for name, (_, cumulative) in times.items()
+                  if name not in (module, "site") and ("." not in name or name.startswith("src."))]
+    return sorted(candidates, key=lambda item: item[1], reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--threshold-ms", type=float, default=1000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.runs)]
+        best = min(runs, key=lambda times: times[module][1])
+        total_ms = best[module][1] / 1000
+        ok = total_ms <= args.threshold_ms
+        failed |= not ok
+
+        print(f"{'ok  ' if ok else 'FAIL'} {module:<28} {total_ms:8.1f} ms "
+              f"(budget {args.threshold_ms:.0f} ms)")
+        for name, cumulative in heaviest(best, module, args.top):
+            print(f"       {name:<36} {cumulative / 1000:8.1f} ms")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
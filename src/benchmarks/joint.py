@@ -0,0 +1,83 @@
+"""
+Compares joint node+edge extraction (one vision call per crop) against the
+two-call flow (nodes, then edges with the nodes as context) on the test set.
+
+Each joint configuration is paired with its `with_nodes` counterpart and
+the table reports macro F1, p50/p90 image latency, LLM calls and bytes
+uploaded for both, plus the change.
+
+    python -m src.benchmarks.joint --llm replay --model gpt-4o
+    python -m src.benchmarks.joint joint_no_crop --llm stub --stub-latency 0.5
+"""
+
+import argparse
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src.benchmarks.configurations import (CONFIGURATIONS, Runner, add_run_arguments,
+                                           dataset, make_boxes, make_llm_factory)
+from src.utils.path import from_root
+
+# Joint configuration -> the two-call configuration it replaces
+PAIRS = {
+    "joint_no_crop": "with_nodes_no_crop",
+    "joint_crop": "with_nodes_crop",
+    "mermaid_joint_no_crop": "mermaid_with_nodes_no_crop",
+    "mermaid_joint_crop": "mermaid_with_nodes_crop",
+}
+
+
+def compare(joint: dict, two_call: dict) -> Dict[str, float]:
+    def metrics(result: dict) -> Dict[str, float]:
+        return {
+            "f1_score": result["summary"]["macro"]["f1_score"],
+            "p50": result["image_time"].get("p50", 0.0),
+            "p90": result["image_time"].get("p90", 0.0),
+            "llm_calls": result["llm_calls"],
+            "bytes_uploaded": result["bytes_uploaded"],
+        }
+
+    joint_metrics, two_call_metrics = metrics(joint), metrics(two_call)
+    return {
+        "joint": joint_metrics,
+        "two_call": two_call_metrics,
+        "delta": {name: joint_metrics[name] - two_call_metrics[name] for name in joint_metrics},
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("configs", nargs="*", default=None,
+                        choices=list(PAIRS), metavar="CONFIG")
+    add_run_arguments(parser)
+    args = parser.parse_args(argv)
+
+    output = Path(args.output) if args.output else from_root(
+        "runs", "benchmarks", datetime.now().strftime("%Y%m%d-%H%M%S"), "joint.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    names = args.configs or list(PAIRS)
+    configs = [CONFIGURATIONS[name] for joint in names for name in (joint, PAIRS[joint])]
+    runner = Runner(make_llm_factory(args), args.crop_workers, make_boxes(args), args.soft_scores,
+                    args.resolve_entities)
+    report = runner.run(configs, dataset(Path(args.images), Path(args.json)),
+                        args.workers, output.parent)
+
+    comparison = {joint: compare(report[joint], report[PAIRS[joint]]) for joint in names}
+    with open(output, "w") as f:
+        json.dump({"comparison": comparison, "results": report}, f, indent=4)
+
+    print(f"{'configuration':<24} {'f1':>13} {'p50 image':>17} {'calls':>11} {'MB uploaded':>15}")
+    for joint, result in comparison.items():
+        a, b = result["joint"], result["two_call"]
+        print(f"{joint:<24} {a['f1_score']:.3f} / {b['f1_score']:.3f}  "
+              f"{a['p50']:6.2f}s / {b['p50']:6.2f}s  {a['llm_calls']:4d} / {b['llm_calls']:4d}  "
+              f"{a['bytes_uploaded'] / 1e6:6.2f} / {b['bytes_uploaded'] / 1e6:6.2f}")
+    print(f"joint / two-call, written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import threading
+import time
+import typing
+from typing import Any, List, Optional, Type
+
+from pydantic import BaseModel
+
+from src.tracing import payload_bytes
+
+STUB_MERMAID = """graph TD
+    A["Owner"]
+    B["Company 1"]
+    C["Company 2"]
+    A --> B
+    A --> C"""
+
+
+class StubLLM:
+    """
+    Offline stand-in for `LLMCaller`: answers every call with a fixed,
+    well-formed response after `latency` seconds, so throughput can be
+    measured without a provider.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def _value(self, annotation: Any) -> Any:
+        origin, args = typing.get_origin(annotation), typing.get_args(annotation)
+        if annotation is str:
+            return STUB_MERMAID
+        if origin in (list, List) and args:
+            item = args[0]
+            if item is str:
+                return ["Owner", "Company 1", "Company 2"]
+            if typing.is_typeddict(item):
+                return [{"source": "Owner", "target": "Company 1"},
+                        {"source": "Owner", "target": "Company 2"}]
+            return []
+        if annotation is float:
+            return 1.0
+        return None
+
+    def invoke(self, messages: List[Any], response_model: Optional[Type[BaseModel]] = None, **kwargs) -> Any:
+        if self.latency:
+            time.sleep(self.latency)
+        if response_model is None:
+            return STUB_MERMAID
+        values = {name: "stub" if name == "reasoning" else self._value(field.annotation)
+                  for name, field in response_model.model_fields.items()}
+        return response_model.model_validate(values)
+
+
+class InstrumentedLLM:
+    """Wraps an LLM caller and records latency and upload size per call."""
+
+    def __init__(self, model: Any):
+        self.model = model
+        self.latencies: List[float] = []
+        self.bytes_uploaded = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.model, name)
+
+    @property
+    def calls(self) -> int:
+        return len(self.latencies)
+
+    def invoke(self, messages: List[Any], *args, **kwargs) -> Any:
+        size = payload_bytes(messages)
+        start = time.perf_counter()
+        try:
+            return self.model.invoke(messages, *args, **kwargs)
+        finally:
+            with self._lock:
+                self.latencies.append(time.perf_counter() - start)
+                self.bytes_uploaded += size
@@ -0,0 +1,68 @@
+"""
+Per-call latency of loading models on every call vs. the shared registry.
+
+    python -m src.benchmarks.model_loading --runs 5
+"""
+import argparse
+import statistics
+import time
+from typing import Callable, List
+
+from src.model_registry import ModelRegistry, _load_clip, _load_yolo, _warm_up_yolo
+from src.utils.path import from_root
+
+
+def measure(fn: Callable[[], None], runs: int) -> List[float]:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings: List[float]) -> None:
+    print(f"{name:<28} first {timings[0] * 1000:8.1f} ms   "
+          f"median {statistics.median(timings) * 1000:8.1f} ms   "
+          f"mean {statistics.mean(timings) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--image", default="datasets/test/images/1.png")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--clip", action="store_true",
+                        help="also benchmark the CLIP classifier")
+    args = parser.parse_args()
+    image = str(from_root(args.image))
+
+    # Before: weights are loaded inside every call
+    report("yolo, load per call", measure(
+        lambda: _load_yolo()(image, verbose=False), args.runs))
+
+    # After: one resident instance, warmed up once
+    registry = ModelRegistry()
+    registry.register("yolo", _load_yolo, _warm_up_yolo)
+    start = time.perf_counter()
+    registry.warm_up(["yolo"])
+    print(f"{'yolo, registry warm-up':<28} {(time.perf_counter() - start) * 1000:8.1f} ms")
+    report("yolo, registry", measure(
+        lambda: registry.get("yolo")(image, verbose=False), args.runs))
+
+    if args.clip:
+        from PIL import Image
+
+        def classify(model, processor):
+            inputs = processor(text=["a diagram", "not a diagram"], images=Image.open(image).convert("RGB"),
+                               return_tensors="pt", padding=True)
+            model(**inputs)
+
+        report("clip, load per call", measure(
+            lambda: classify(*_load_clip()), args.runs))
+        registry.register("clip", _load_clip)
+        report("clip, registry", measure(
+            lambda: classify(*registry.get("clip")), args.runs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Local OpenAI-compatible chat completions server that injects latency and
+errors, to test the LLMCaller's deadlines, retries and hedging without a
+provider.
+
+    python -m src.benchmarks.stub_server --port 8765 --latency 0.2 \\
+        --slow-share 0.05 --slow-latency 5 --error-share 0.1
+
+then point the caller at it:
+
+    LLMCaller(api_key="stub", model_id="openai/stub", api_url="http://127.0.0.1:8765/v1",
+              policy=LatencyPolicy(timeout=2, hedge=True))
+
+By default every answer is the smallest instance of the JSON schema that
+instructor puts in the system prompt (empty lists, "stub" strings), so
+structured calls validate; `{"answer": "stub"}` without a schema.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, List, Optional, Sequence, Tuple, TypedDict, Union
+
+# (delay in seconds, HTTP status) of one answer
+Behaviour = Tuple[float, int]
+
+
+def schema_value(schema: dict, definitions: dict) -> Any:
+    if "$ref" in schema:
+        return schema_value(definitions[schema["$ref"].split("/")[-1]], definitions)
+    if "anyOf" in schema:
+        return schema_value(schema["anyOf"][0], definitions)
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: schema_value(field, definitions) for name, field in schema.get("properties", {}).items()}
+    if kind == "array":
+        return []
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return False
+    if kind == "null":
+        return None
+    return "stub"
+
+
+def schema_answer(body: dict) -> str:
+    """A minimal instance of the JSON schema in the request's messages."""
+    for message in body.get("messages", []):
+        text = message.get("content")
+        if isinstance(text, list):
+            text = "".join(part.get("text", "") for part in text if isinstance(part, dict))
+        if not isinstance(text, str) or "json_schema" not in text:
+            continue
+        start = text.find("{", text.find("json_schema"))
+        try:
+            schema, _ = json.JSONDecoder().raw_decode(text[start:])
+        except ValueError:
+            continue
+        return json.dumps(schema_value(schema, schema.get("$defs", {})))
+    return json.dumps({"answer": "stub"})
+
+
+class StubRequest(TypedDict):
+    number: int
+    # Seconds after the server started
+    received: float
+    delay: float
+    status: int
+
+
+class StubServer:
+    """
+    Answers after `latency` seconds; a `slow_share` of requests take
+    `slow_latency` instead and an `error_share` fail with `error_status`.
+    `script` fixes the behaviour of the first requests, in order, so tests
+    are deterministic. Every request is logged in `requests`.
+
+    Use as a context manager, or `start()` / `stop()`; port 0 picks a free one.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 slow_share: float = 0.0, slow_latency: float = 5.0, error_share: float = 0.0,
+                 error_status: int = 503, script: Sequence[Behaviour] = (),
+                 content: Union[str, Callable[[dict], str]] = schema_answer,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.slow_share = slow_share
+        self.slow_latency = slow_latency
+        self.error_share = error_share
+        self.error_status = error_status
+        self.script = list(script)
+        self.content = content
+        self.requests: List[StubRequest] = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._origin = time.monotonic()
+        self._thread: Optional[threading.Thread] = None
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def behaviour(self) -> StubRequest:
+        with self._lock:
+            number = len(self.requests)
+            if number < len(self.script):
+                delay, status = self.script[number]
+            else:
+                delay = self.slow_latency if self._random.random() < self.slow_share else self.latency
+                status = self.error_status if self._random.random() < self.error_share else 200
+            request: StubRequest = {"number": number, "received": time.monotonic() - self._origin,
+                                    "delay": delay, "status": status}
+            self.requests.append(request)
+        return request
+
+    def answer(self, body: dict, number: int) -> dict:
+        content = self.content(body) if callable(self.content) else self.content
+        prompt = len(json.dumps(body.get("messages", []))) // 4
+        completion = len(content) // 4
+        return {
+            "id": f"stub-{number}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt, "completion_tokens": completion,
+                      "total_tokens": prompt + completion},
+        }
+
+    def _handler(self) -> type:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    return self.reply(404, {"error": {"message": f"unknown path {self.path}"}})
+
+                request = stub.behaviour()
+                time.sleep(request["delay"])
+                if request["status"] != 200:
+                    return self.reply(request["status"], {"error": {
+                        "message": "injected error", "type": "server_error", "code": request["status"]}})
+                self.reply(200, stub.answer(body, request["number"]))
+
+            def reply(self, status: int, payload: dict):
+                data = json.dumps(payload).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client timed out or a hedge won
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--slow-share", type=float, default=0.0)
+    parser.add_argument("--slow-latency", type=float, default=5.0)
+    parser.add_argument("--error-share", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    server = StubServer(args.host, args.port, args.latency, args.slow_share, args.slow_latency,
+                        args.error_share, args.error_status, seed=args.seed)
+    with server:
+        print(f"Serving {server.url}/chat/completions, Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from src.graph import Edge, Graph, Node
+
+
+class LabelInterner:
+    """Maps node labels to dense integer ids, storing every label once."""
+    __slots__ = ("ids", "labels")
+
+    def __init__(self, labels: Iterable[str] = ()):
+        self.ids: Dict[str, int] = {}
+        self.labels: List[str] = []
+        self.intern_many(labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def intern(self, label: str) -> int:
+        node_id = self.ids.get(label)
+        if node_id is None:
+            node_id = self.ids[label] = len(self.labels)
+            self.labels.append(label)
+        return node_id
+
+    def intern_many(self, labels: Iterable[str]) -> np.ndarray:
+        return np.fromiter((self.intern(label) for label in labels), dtype=np.int32)
+
+
+class CompactGraph:
+    """
+    Array-backed graph for merging large diagrams.
+
+    Nodes are interned integer ids, edges are two int32 arrays and are
+    deduplicated on the (source, target) id pair, so labels containing "-"
+    can't collide the way `Edge.id` strings can. Successors are available as
+    CSR arrays (`indptr`, `indices`), built on first use.
+    """
+    __slots__ = ("interner", "sources", "targets", "_indptr", "_indices")
+
+    def __init__(self, interner: Optional[LabelInterner] = None,
+                 sources: Optional[np.ndarray] = None, targets: Optional[np.ndarray] = None):
+        self.interner = interner or LabelInterner()
+        self.sources = sources if sources is not None else np.empty(0, dtype=np.int32)
+        self.targets = targets if targets is not None else np.empty(0, dtype=np.int32)
+        self._dedupe()
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[str, str]], interner: Optional[LabelInterner] = None) -> "CompactGraph":
+        interner = interner or LabelInterner()
+        flat = interner.intern_many(label for pair in pairs for label in pair)
+        return cls(interner, flat[0::2], flat[1::2])
+
+    @classmethod
+    def from_edges(cls, edges: Iterable[Edge], interner: Optional[LabelInterner] = None) -> "CompactGraph":
+        return cls.from_pairs(((edge.source, edge.target) for edge in edges), interner)
+
+    @classmethod
+    def from_graph(cls, graph: Graph) -> "CompactGraph":
+        interner = LabelInterner(node.id for node in graph.nodes)
+        return cls.from_edges(graph.edges, interner)
+
+    def __len__(self):
+        return len(self.sources)
+
+    @property
+    def labels(self) -> List[str]:
+        return self.interner.labels
+
+    @property
+    def node_count(self) -> int:
+        return len(self.interner)
+
+    def _dedupe(self) -> None:
+        keys = (self.sources.astype(np.int64) << 32) | self.targets.astype(np.int64)
+        _, first = np.unique(keys, return_index=True)
+        first.sort()  # keep the order edges were first seen in
+        self.sources = self.sources[first].astype(np.int32)
+        self.targets = self.targets[first].astype(np.int32)
+        self._indptr = None
+        self._indices = None
+
+    def merge(self, *others: "CompactGraph") -> "CompactGraph":
+        """Merge other graphs into this one, deduplicating edges."""
+        sources, targets = [self.sources], [self.targets]
+        for other in others:
+            if other.interner is self.interner:
+                remap = np.arange(self.node_count, dtype=np.int32)
+            else:
+                remap = self.interner.intern_many(other.labels)
+            sources.append(remap[other.sources])
+            targets.append(remap[other.targets])
+        self.sources = np.concatenate(sources)
+        self.targets = np.concatenate(targets)
+        self._dedupe()
+        return self
+
+    def _csr(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._indptr is None:
+            order = np.argsort(self.sources, kind="stable")
+            counts = np.bincount(self.sources, minlength=self.node_count)
+            self._indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+            self._indices = self.targets[order]
+        return self._indptr, self._indices
+
+    @property
+    def indptr(self) -> np.ndarray:
+        return self._csr()[0]
+
+    @property
+    def indices(self) -> np.ndarray:
+        return self._csr()[1]
+
+    def successors(self, label: Union[str, int]) -> List[str]:
+        node_id = self.interner.ids[label] if isinstance(label, str) else label
+        indptr, indices = self._csr()
+        return [self.labels[i] for i in indices[indptr[node_id]:indptr[node_id + 1]]]
+
+    def out_degrees(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def in_degrees(self) -> np.ndarray:
+        return np.bincount(self.targets, minlength=self.node_count)
+
+    def node_dimensions(self, max_width: int = 100) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized `Node.get_node_dimensions` for every node."""
+        char_width, base_padding, line_height = 8, 20, 20
+        lengths = np.fromiter((len(label) for label in self.labels),
+                              dtype=np.int64, count=self.node_count)
+        width = np.minimum(lengths * char_width + base_padding, max_width)
+        chars_per_line = np.maximum(1, np.maximum(1, width - base_padding) // char_width)
+        height = -(-lengths // chars_per_line) * line_height
+        return width, height
+
+    def pairs(self) -> List[Tuple[str, str]]:
+        labels = self.labels
+        return [(labels[s], labels[t]) for s, t in zip(self.sources.tolist(), self.targets.tolist())]
+
+    def to_graph(self) -> Graph:
+        edges = [Edge(source, target) for source, target in self.pairs()]
+        nodes = [Node(label) for label in self.labels]
+        return Graph(edges, nodes)
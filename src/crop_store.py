@@ -0,0 +1,141 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from src.image_encoding import image_digest
+from src.yolo.crop import Crop
+
+StoredImage = Union[Image.Image, Crop]
+
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=-1)
+    return np.unpackbits(words.view(np.uint8), axis=-1).sum(axis=-1)
+
+
+def dhash(image: StoredImage, hash_size: int = 16) -> np.ndarray:
+    """
+    Difference hash: the image shrunk to `hash_size` x `hash_size` grey
+    pixels, one bit per horizontal gradient sign. Returned as uint64 words,
+    so `hash_size` must be a multiple of 8.
+    """
+    if isinstance(image, Crop):
+        image = image.to_image()
+    small = np.asarray(image.convert("L").resize(
+        (hash_size + 1, hash_size), Image.Resampling.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return np.packbits(bits).view(np.uint64)
+
+
+class CropStore:
+    """
+    Detected nodes/edges of previously processed crops, looked up by exact
+    content hash, so re-submitted boards and repeated sub-structures skip the
+    vision call. The store keeps the `max_entries` most recently used crops.
+
+    Matching by perceptual hash (dHash) is opt-in: with `max_distance` set, a
+    crop also matches a stored one when at most `max_distance` of the hash
+    bits differ and both sides are within `size_tolerance` of each other.
+    Only use it for re-encoded copies of the same boards: labels are small
+    next to the crop, so boards with the same boxes and arrows but other
+    entity names are a couple of bits apart and would get each other's labels.
+
+    Values are whatever the detector stores, one store per detector type.
+    """
+
+    def __init__(self, max_entries: int = 10_000, max_distance: Optional[int] = None, hash_size: int = 16,
+                 size_tolerance: float = 0.05):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.size_tolerance = size_tolerance
+        words = max(1, hash_size * hash_size // 64)
+        # Hashes and sizes of every slot, compared against in one vectorized pass
+        self._hashes = np.zeros((max_entries, words), dtype=np.uint64)
+        self._sizes = np.zeros((max_entries, 2), dtype=np.float64)
+        self._used = np.zeros(max_entries, dtype=bool)
+        self._slot_digest: list = [None] * max_entries
+        # digest -> (slot, value), least recently used first
+        self._entries: "OrderedDict[str, Tuple[int, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, image: StoredImage) -> Optional[Any]:
+        digest = image_digest(image)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self._entries.move_to_end(digest)
+                self.exact_hits += 1
+                return entry[1]
+            if not self._entries or not self.max_distance:
+                self.misses += 1
+                return None
+
+        phash = dhash(image, self.hash_size)
+        size = np.asarray(image.size, dtype=np.float64)
+        with self._lock:
+            distances = _popcount(self._hashes ^ phash)
+            relative = np.abs(self._sizes - size) / np.maximum(size, 1)
+            candidates = self._used & (distances <= self.max_distance) & \
+                (relative <= self.size_tolerance).all(axis=1)
+            if not candidates.any():
+                self.misses += 1
+                return None
+            slot = int(np.argmin(np.where(candidates, distances, np.iinfo(np.int64).max)))
+            digest = self._slot_digest[slot]
+            self._entries.move_to_end(digest)
+            self.similar_hits += 1
+            return self._entries[digest][1]
+
+    def put(self, image: StoredImage, value: Any) -> None:
+        digest = image_digest(image)
+        phash = dhash(image, self.hash_size)
+        self._insert(digest, phash, image.size, value)
+
+    def _insert(self, digest: str, phash: np.ndarray, size: Tuple[int, int], value: Any) -> None:
+        with self._lock:
+            if digest in self._entries:
+                slot = self._entries.pop(digest)[0]
+            elif len(self._entries) >= self.max_entries:
+                slot = self._entries.popitem(last=False)[1][0]
+            else:
+                slot = int(np.argmin(self._used))
+            self._hashes[slot] = phash
+            self._sizes[slot] = size
+            self._used[slot] = True
+            self._slot_digest[slot] = digest
+            self._entries[digest] = (slot, value)
+
+    def stats(self) -> Dict[str, int]:
+        """Lookups served from the store, i.e. vision calls saved, and misses."""
+        return {"exact_hits": self.exact_hits, "similar_hits": self.similar_hits,
+                "misses": self.misses, "entries": len(self._entries)}
+
+    def save(self, path: str) -> None:
+        """Write the store as JSON lines, oldest first, so `load` keeps the LRU order."""
+        with self._lock:
+            rows = [{"digest": digest, "hash": self._hashes[slot].tobytes().hex(),
+                     "size": self._sizes[slot].tolist(), "value": value}
+                    for digest, (slot, value) in self._entries.items()]
+        with open(path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+
+    def load(self, path: str) -> "CropStore":
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                phash = np.frombuffer(bytes.fromhex(row["hash"]), dtype=np.uint64)
+                self._insert(row["digest"], phash, tuple(row["size"]), row["value"])
+        return self
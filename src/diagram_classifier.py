@@ -0,0 +1,120 @@
+from typing import TYPE_CHECKING, Iterable, List, Optional, Sequence, Tuple, TypedDict, Union
+
+import numpy as np
+from PIL import Image
+
+from src.model_registry import ModelRegistry, registry
+from src.tracing import span
+
+if TYPE_CHECKING:
+    import torch
+
+ClassifierInput = Union[str, Image.Image]
+
+PROMPTS = ("a diagram", "not a diagram")
+
+
+class Classification(TypedDict):
+    is_diagram: bool
+    confidence: float
+    # "statistics" when the pre-filter decided, "clip" otherwise
+    method: str
+
+
+def image_statistics(image: Image.Image, size: int = 128) -> Tuple[float, float]:
+    """
+    Share of pixels in the most common colour and in the 8 most common
+    colours (4 bits per channel) of a thumbnail. Diagrams are mostly flat
+    background and a few fills; photos spread over many colours.
+    """
+    thumbnail = image.convert("RGB")
+    thumbnail.thumbnail((size, size))
+    pixels = np.asarray(thumbnail, dtype=np.uint16) >> 4
+    bins = (pixels[..., 0] << 8) | (pixels[..., 1] << 4) | pixels[..., 2]
+    counts = np.sort(np.bincount(bins.ravel(), minlength=4096))[::-1]
+    total = counts.sum()
+    return counts[0] / total, counts[:8].sum() / total
+
+
+class DiagramClassifier:
+    """
+    Tells diagrams from other images with CLIP (zero-shot against
+    "a diagram" / "not a diagram"), many images per forward pass.
+
+    The model stays resident in the model registry and the prompt embeddings
+    are computed once. Images that are obviously not diagrams are rejected
+    from their colour statistics without running CLIP: blank images (one
+    colour covers at least `blank_share`) and photo-like images (the 8 most
+    common colours cover less than `min_palette_share`). The pre-filter
+    never accepts an image, so CLIP has the last word on every diagram.
+    """
+
+    def __init__(self, batch_size: int = 32, prefilter: bool = True, blank_share: float = 0.995,
+                 min_palette_share: float = 0.3, models: ModelRegistry = registry):
+        self.batch_size = batch_size
+        self.prefilter = prefilter
+        self.blank_share = blank_share
+        self.min_palette_share = min_palette_share
+        self.models = models
+        self._text_embeddings: Optional["torch.Tensor"] = None
+
+    def reject(self, image: Image.Image) -> Optional[Classification]:
+        """A classification if the statistics alone rule the image out, else None."""
+        top_share, palette_share = image_statistics(image)
+        if top_share >= self.blank_share:
+            return {"is_diagram": False, "confidence": float(top_share), "method": "statistics"}
+        if palette_share < self.min_palette_share:
+            return {"is_diagram": False, "confidence": float(1 - palette_share), "method": "statistics"}
+        return None
+
+    def text_embeddings(self) -> "torch.Tensor":
+        """Normalized embeddings of the prompts, computed on first use."""
+        if self._text_embeddings is None:
+            import torch
+            model, processor = self.models.get("clip")
+            inputs = processor(text=list(PROMPTS), return_tensors="pt", padding=True)
+            with torch.no_grad():
+                embeddings = model.get_text_features(**inputs)
+            self._text_embeddings = embeddings / embeddings.norm(dim=-1, keepdim=True)
+        return self._text_embeddings
+
+    def _classify_with_clip(self, images: Sequence[Image.Image]) -> List[Classification]:
+        import torch
+        model, processor = self.models.get("clip")
+        text = self.text_embeddings()
+
+        with span("classify.clip", images=len(images)):
+            inputs = processor(images=list(images), return_tensors="pt")
+            with torch.no_grad():
+                embeddings = model.get_image_features(**inputs)
+                embeddings = embeddings / embeddings.norm(dim=-1, keepdim=True)
+                # Same logits as CLIPModel's logits_per_image
+                probs = (model.logit_scale.exp() * embeddings @ text.T).softmax(dim=1)
+        return [{"is_diagram": row[0] >= row[1], "confidence": max(row), "method": "clip"}
+                for row in probs.tolist()]
+
+    def _classify_batch(self, images: List[Image.Image]) -> List[Classification]:
+        results: List[Optional[Classification]] = [
+            self.reject(image) if self.prefilter else None for image in images]
+
+        pending = [index for index, result in enumerate(results) if result is None]
+        if pending:
+            for index, result in zip(pending, self._classify_with_clip([images[i] for i in pending])):
+                results[index] = result
+        return results  # type: ignore
+
+    def classify(self, images: Iterable[ClassifierInput]) -> List[Classification]:
+        """Classify many images (paths or PIL images), `batch_size` at a time, in input order."""
+        results: List[Classification] = []
+        batch: List[Image.Image] = []
+        for image in images:
+            batch.append(Image.open(image).convert("RGB") if isinstance(image, str) else image.convert("RGB"))
+            if len(batch) == self.batch_size:
+                results.extend(self._classify_batch(batch))
+                batch = []
+        if batch:
+            results.extend(self._classify_batch(batch))
+        return results
+
+    def classify_one(self, image: ClassifierInput) -> Classification:
+        return self.classify([image])[0]
@@ -1,12 +1,11 @@
 from pydantic import BaseModel, Field
 from src.graph import RawEdge
-from typing import List, TypeVar, Any, Union
-import base64
-import litellm
-from litellm import completion, ChatCompletionImageObject
-from instructor import Mode, from_litellm
+from typing import TYPE_CHECKING, List, TypeVar, Any, Union
 from PIL import Image
-import io
+from src.image_encoding import EncodingPolicy, encode_image
+
+if TYPE_CHECKING:
+    from litellm import ChatCompletionImageObject
 
 
 class EdgeResponse(BaseModel):
@@ -20,29 +19,10 @@ ResponseType = TypeVar('ResponseType', bound=BaseModel)
 
 
 class EdgeDetectorLLM:
-    def prepare_image_content(self, image: Union[str, Image.Image], mime_type: str = "image/png") -> ChatCompletionImageObject:
-        if isinstance(image, str):
-            with open(image, "rb") as f:
-                img_bytes = f.read()
-        elif isinstance(image, Image.Image):
-            buffered = io.BytesIO()
-            image.save(buffered, format=mime_type.split("/")[-1].upper())
-            img_bytes = buffered.getvalue()
-        else:
-            raise ValueError(
-                "Input must be a filepath (str) or PIL.Image.Image object.")
-
-        base64_image = base64.b64encode(img_bytes).decode('utf-8')
-
-        return {
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:{mime_type};base64,{base64_image}",
-                "detail": "high"
-            },
-        }
-
-    def __init__(self, api_key: str, project_id: str, api_url: str, model_id: str, params: dict[str, Any] = {}):
+    def prepare_image_content(self, image: Union[str, Image.Image], mime_type: str = "image/png") -> "ChatCompletionImageObject":
+        return encode_image(image, self.policy, mime_type.split("/")[-1])["content"]
+
+    def __init__(self, api_key: str, project_id: str, api_url: str, model_id: str, params: dict[str, Any] = {}, policy: Union[EncodingPolicy, None] = None):
         """
             Stolen from ma3
         """
@@ -52,6 +32,12 @@ class EdgeDetectorLLM:
         self.api_url = api_url
         self.model_id = model_id
         self.params = params
+        self.policy = policy or EncodingPolicy()
+
+        # Imported here, litellm and instructor take seconds to load
+        import litellm
+        from litellm import completion
+        from instructor import Mode, from_litellm
 
         litellm.drop_params = True
         self.client = from_litellm(completion, mode=Mode.JSON)
@@ -1,8 +1,35 @@
 from src.graph import Edge
-from typing import List, Dict, Any
+from typing import IO, List, Dict, Any, Iterable, Iterator, Optional, Set, Tuple, Union
 import json
 import re
 
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_edge_id(edge: Edge) -> str:
+    """The id edges are compared on: lowercase, without whitespace."""
+    return WHITESPACE.sub('', edge.id).lower()
+
+
+def score_ids(true_ids: Set[str], pred_ids: Set[str]) -> dict:
+    tp_ids = true_ids & pred_ids
+    fp_ids = pred_ids - true_ids
+    fn_ids = true_ids - pred_ids
+
+    precision = len(tp_ids) / len(pred_ids) if pred_ids else 0.0
+    recall = len(tp_ids) / len(true_ids) if true_ids else 0.0
+    f1 = (2 * precision * recall) / (precision +
+                                     recall) if (precision + recall) else 0.0
+
+    return {
+        "true_positives": list(tp_ids),
+        "false_positives": list(fp_ids),
+        "false_negatives": list(fn_ids),
+        "precision": precision,
+        "recall": recall,
+        "f1_score": f1
+    }
+
 
 class EdgeValidator:
     true_edges: List[Edge]
@@ -11,6 +38,8 @@ class EdgeValidator:
     def __init__(self, true_edges: List[Edge], predicted_edges: List[Edge]) -> None:
         self.true_edges = true_edges
         self.predicted_edges = predicted_edges
+        self._true_ids = [normalize_edge_id(edge) for edge in true_edges]
+        self._pred_ids = [normalize_edge_id(edge) for edge in predicted_edges]
 
     @classmethod
     def from_json(cls, true_edges_json: List[Dict[str, Any]], predicted_edges: List[Edge]) -> "EdgeValidator":
@@ -30,42 +59,109 @@ class EdgeValidator:
         return cls.from_json(data, predicted_edges)
 
     def validate(self) -> dict:
-        true_ids = {
-            re.sub(r'\s+', '', edge.id).lower()
-            for edge in self.true_edges
-        }
-        pred_ids = {
-            re.sub(r'\s+', '', edge.id).lower()
-            for edge in self.predicted_edges
-        }
+        return score_ids(set(self._true_ids), set(self._pred_ids))
 
-        tp_ids = true_ids & pred_ids
-        fp_ids = pred_ids - true_ids
-
-        precision = len(tp_ids) / len(pred_ids) if pred_ids else 0.0
-        recall = len(tp_ids) / len(true_ids) if true_ids else 0.0
-        f1 = (2 * precision * recall) / (precision +
-                                         recall) if (precision + recall) else 0.0
-
-        return {
-            "true_positives": list(tp_ids),
-            "false_positives": list(fp_ids),
-            "precision": precision,
-            "recall": recall,
-            "f1_score": f1
-        }
+    def soft_validate(self) -> dict:
+        """
+        Fuzzy scores from `LocalEdgeValidator`, the offline alternative to
+        `LLMEdgeValidator`: labels only need to be similar, not equal.
+        """
+        from src.edge_validator_local import LocalEdgeValidator
+        return LocalEdgeValidator().score(self.true_edges, self.predicted_edges)
 
     def get_true_positive_edges(self) -> List[Edge]:
-        tp_ids = {edge.id.lower() for edge in self.true_edges} & {
-            edge.id.lower() for edge in self.predicted_edges}
-        return [edge for edge in self.predicted_edges if edge.id.lower() in tp_ids]
+        tp_ids = set(self._true_ids) & set(self._pred_ids)
+        return [edge for edge, edge_id in zip(self.predicted_edges, self._pred_ids) if edge_id in tp_ids]
 
     def get_false_positive_edges(self) -> List[Edge]:
-        tp_ids = {edge.id.lower() for edge in self.true_edges} & {
-            edge.id.lower() for edge in self.predicted_edges}
-        return [edge for edge in self.predicted_edges if edge.id.lower() not in tp_ids]
+        tp_ids = set(self._true_ids) & set(self._pred_ids)
+        return [edge for edge, edge_id in zip(self.predicted_edges, self._pred_ids) if edge_id not in tp_ids]
 
     def get_false_negative_edges(self) -> List[Edge]:
-        tp_ids = {edge.id.lower() for edge in self.true_edges} & {
-            edge.id.lower() for edge in self.predicted_edges}
-        return [edge for edge in self.true_edges if edge.id.lower() not in tp_ids]
+        tp_ids = set(self._true_ids) & set(self._pred_ids)
+        return [edge for edge, edge_id in zip(self.true_edges, self._true_ids) if edge_id not in tp_ids]
+
+
+class BatchEdgeEvaluator:
+    """
+    Scores many (ground truth, prediction) pairs in one pass.
+
+    Every edge id is normalized once, per-image results are returned (and
+    written as JSON lines to `output` when given) as soon as an image is
+    scored, and the counts are accumulated for micro averages (over all
+    edges) and macro averages (over images). With `soft`, every image also
+    gets the fuzzy `soft_*` scores of `LocalEdgeValidator`.
+    """
+
+    def __init__(self, name: str = "", output: Optional[Union[str, IO[str]]] = None, soft: bool = False):
+        self.name = name
+        self.soft = soft
+        self.tp = 0
+        self.fp = 0
+        self.fn = 0
+        self.results: List[dict] = []
+        self._owns_output = isinstance(output, str)
+        self._output = open(output, "a", encoding="utf-8") if isinstance(
+            output, str) else output
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        if self._owns_output and self._output:
+            self._output.close()
+        self._output = None
+
+    def evaluate(self, image_id: str, true_edges: List[Edge], predicted_edges: List[Edge]) -> dict:
+        result = score_ids({normalize_edge_id(edge) for edge in true_edges},
+                           {normalize_edge_id(edge) for edge in predicted_edges})
+        result = {"name": self.name, "image": image_id, **result}
+        if self.soft:
+            soft = EdgeValidator(true_edges, predicted_edges).soft_validate()
+            result.update({f"soft_{key}": soft[key] for key in ("precision", "recall", "f1_score")})
+
+        self.tp += len(result["true_positives"])
+        self.fp += len(result["false_positives"])
+        self.fn += len(result["false_negatives"])
+        self.results.append(result)
+
+        if self._output:
+            self._output.write(json.dumps(result) + "\n")
+            self._output.flush()
+        return result
+
+    def evaluate_json_file(self, image_id: str, file_path: str, predicted_edges: List[Edge]) -> dict:
+        return self.evaluate(image_id, EdgeValidator.from_json_file(file_path, predicted_edges).true_edges,
+                             predicted_edges)
+
+    def evaluate_many(self, pairs: Iterable[Tuple[str, List[Edge], List[Edge]]]) -> Iterator[dict]:
+        for image_id, true_edges, predicted_edges in pairs:
+            yield self.evaluate(image_id, true_edges, predicted_edges)
+
+    def summary(self) -> dict:
+        precision = self.tp / (self.tp + self.fp) if self.tp + self.fp else 0.0
+        recall = self.tp / (self.tp + self.fn) if self.tp + self.fn else 0.0
+        f1 = (2 * precision * recall) / (precision +
+                                         recall) if (precision + recall) else 0.0
+        count = len(self.results)
+
+        def mean(key: str) -> float:
+            return sum(result[key] for result in self.results) / count if count else 0.0
+
+        summary = {
+            "name": self.name,
+            "images": count,
+            "micro": {"precision": precision, "recall": recall, "f1_score": f1},
+            "macro": {"precision": mean("precision"), "recall": mean("recall"), "f1_score": mean("f1_score")},
+        }
+        if self.soft:
+            summary["soft"] = {key: mean(f"soft_{key}") for key in ("precision", "recall", "f1_score")}
+        return summary
+
+    def scores(self) -> Dict[str, List[float]]:
+        """Per-image scores in the layout of results.json."""
+        return {key: [result[key] for result in self.results]
+                for key in ("precision", "recall", "f1_score")}
@@ -1,12 +1,6 @@
 from pydantic import BaseModel, Field
 from src.graph import Edge
 from typing import List, Dict, Any
-import base64
-import litellm
-from litellm import completion, ChatCompletionImageObject
-from instructor import Mode, from_litellm
-from PIL import Image
-import io
 import json
 
 
@@ -29,6 +23,11 @@ class LLMEdgeValidator:
         self.model_id = model_id
         self.params = params
 
+        # Imported here, litellm and instructor take seconds to load
+        import litellm
+        from litellm import completion
+        from instructor import Mode, from_litellm
+
         litellm.drop_params = True
         self.client = from_litellm(completion, mode=Mode.JSON)
 
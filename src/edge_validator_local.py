@@ -0,0 +1,113 @@
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+from scipy import sparse
+from scipy.optimize import linear_sum_assignment
+
+from src.edge_validator_llm import ValidationResponse
+from src.entity_resolution import ngrams, normalize_label
+from src.graph import Edge
+
+
+def label_similarity(true_labels: List[str], predicted_labels: List[str], n: int = 3) -> np.ndarray:
+    """
+    Dice similarity of character n-grams between every true and predicted
+    label, as a (true x predicted) matrix. Labels that both carry numbers,
+    but different ones ("Company 1" vs "Company 2"), get half the score.
+    """
+    true_norm = [normalize_label(label) for label in true_labels]
+    pred_norm = [normalize_label(label) for label in predicted_labels]
+
+    vocabulary: Dict[str, int] = {}
+
+    def incidence(labels: List[str]) -> sparse.csr_matrix:
+        rows, cols = [], []
+        for row, label in enumerate(labels):
+            for gram in set(ngrams(label, n)):
+                rows.append(row)
+                cols.append(vocabulary.setdefault(gram, len(vocabulary)))
+        return sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                                 shape=(len(labels), max(len(vocabulary), 1)))
+
+    true_matrix = incidence(true_norm)
+    pred_matrix = incidence(pred_norm)
+    pred_matrix.resize((len(pred_norm), len(vocabulary)))
+    true_matrix.resize((len(true_norm), len(vocabulary)))
+
+    shared = (true_matrix @ pred_matrix.T).toarray()
+    true_sizes = np.asarray(true_matrix.sum(axis=1)).reshape(-1, 1)
+    pred_sizes = np.asarray(pred_matrix.sum(axis=1)).reshape(1, -1)
+    similarity = 2 * shared / np.maximum(true_sizes + pred_sizes, 1)
+
+    true_numbers = [tuple(re.findall(r"\d+", label)) for label in true_norm]
+    pred_numbers = [tuple(re.findall(r"\d+", label)) for label in pred_norm]
+    mismatch = np.array([[bool(a and b and a != b) for b in pred_numbers] for a in true_numbers],
+                        dtype=bool).reshape(similarity.shape)
+    similarity[mismatch] *= 0.5
+    return similarity
+
+
+class LocalEdgeValidator:
+    """
+    Deterministic, local replacement for `LLMEdgeValidator`.
+
+    Predicted node labels are matched one-to-one to true labels with the
+    Hungarian algorithm on their n-gram similarity. Every predicted edge is
+    then mapped onto the true labels and credited with the product of its
+    endpoints' similarities when the mapped edge exists. `precision_score` is
+    the credit over the number of predicted edges; recall is reported too.
+
+    The scores are stricter than the LLM's. On the worked example of the
+    `LLMEdgeValidator` prompt it gives 0.57 where the prompt says 0.67:
+    three of the five predicted edges exist, one of them only up to the
+    "Owner (1)" spelling (0.83 credit), and the reversed "Company 1 ->
+    entity" edge gets no credit. Use it to compare runs with each other,
+    not with scores the LLM gave.
+    """
+
+    def __init__(self, min_similarity: float = 0.5):
+        # Assignments below this similarity are treated as unmatched
+        self.min_similarity = min_similarity
+
+    def score(self, true_edges: List[Edge], predicted_edges: List[Edge]) -> dict:
+        # Spelling variants of one label ("Company 2", "company 2") are one node
+        true_pairs = {(normalize_label(edge.source), normalize_label(edge.target))
+                      for edge in true_edges}
+        pred_pairs = list(dict.fromkeys((normalize_label(edge.source), normalize_label(edge.target))
+                          for edge in predicted_edges))
+        true_labels = list(dict.fromkeys(label for pair in true_pairs for label in pair))
+        pred_labels = list(dict.fromkeys(label for pair in pred_pairs for label in pair))
+
+        mapping: Dict[str, Tuple[str, float]] = {}
+        if true_labels and pred_labels:
+            similarity = label_similarity(true_labels, pred_labels)
+            rows, cols = linear_sum_assignment(similarity, maximize=True)
+            for row, col in zip(rows.tolist(), cols.tolist()):
+                if similarity[row, col] >= self.min_similarity:
+                    mapping[pred_labels[col]] = (true_labels[row], float(similarity[row, col]))
+
+        credit = 0.0
+        for source, target in pred_pairs:
+            if source in mapping and target in mapping:
+                (mapped_source, source_score), (mapped_target, target_score) = mapping[source], mapping[target]
+                if (mapped_source, mapped_target) in true_pairs:
+                    credit += source_score * target_score
+
+        precision = credit / len(pred_pairs) if pred_pairs else 0.0
+        recall = credit / len(true_pairs) if true_pairs else 0.0
+        f1 = (2 * precision * recall) / (precision +
+                                         recall) if (precision + recall) else 0.0
+        return {
+            "precision": precision,
+            "recall": recall,
+            "f1_score": f1,
+            "mapping": {label: mapped for label, (mapped, _) in mapping.items()},
+        }
+
+    def invoke(self, true_edges: List[Edge], predicted_edges: List[Edge], **kwargs) -> ValidationResponse:
+        result = self.score(true_edges, predicted_edges)
+        return ValidationResponse(
+            reasoning=(f"{len(result['mapping'])} predicted nodes matched to true nodes; "
+                       f"soft recall {result['recall']:.2f}, soft F1 {result['f1_score']:.2f}"),
+            precision_score=result["precision"])
@@ -0,0 +1,112 @@
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List
+
+import numpy as np
+from scipy import sparse
+
+
+def normalize_label(label: str) -> str:
+    """Lowercase, strip accents and punctuation, collapse whitespace."""
+    label = unicodedata.normalize("NFKD", label)
+    label = "".join(char for char in label if not unicodedata.combining(char))
+    label = re.sub(r"[^\w]+", " ", label.lower())
+    return re.sub(r"\s+", " ", label).strip()
+
+
+def ngrams(label: str, n: int = 3) -> List[str]:
+    padded = f" {label} "
+    return [padded[i:i + n] for i in range(max(1, len(padded) - n + 1))]
+
+
+class UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> None:
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+
+class EntityResolver:
+    """
+    Merges node labels that refer to the same entity, e.g. "Company A/S" and
+    "company A/S " coming from two overlapping crops.
+
+    Labels are normalized, described by their character n-grams and compared
+    with a sparse n-gram incidence matrix: the product M @ M.T, without the
+    n-grams of more than `max_block_size` labels, only has entries for pairs
+    that share a rarer n-gram (the blocking step). Those candidates are scored
+    by the Dice similarity of all their n-grams, and pairs above `threshold`
+    are clustered with union-find. Labels whose numbers
+    differ ("Company 1" vs "Company 2") are never merged, that was the
+    failure mode of the old pairwise fuzzy matching.
+    """
+
+    def __init__(self, threshold: float = 0.9, n: int = 3, max_block_size: int = 500):
+        self.threshold = threshold
+        self.n = n
+        # n-grams shared by more labels than this are too common to block on
+        self.max_block_size = max_block_size
+
+    def resolve(self, labels: Iterable[str]) -> Dict[str, str]:
+        """Map every label to the canonical label of its cluster."""
+        counts = Counter(labels)
+        originals = list(counts)
+        normalized = [normalize_label(label) for label in originals]
+
+        keys = list(dict.fromkeys(normalized))
+        key_index = {key: i for i, key in enumerate(keys)}
+        clusters = UnionFind(len(keys))
+
+        for i, j in self._similar_pairs(keys):
+            clusters.union(i, j)
+
+        # Canonical label: most frequent original spelling, first seen wins ties
+        best: Dict[int, str] = {}
+        for label, norm in zip(originals, normalized):
+            root = clusters.find(key_index[norm])
+            if root not in best or counts[label] > counts[best[root]]:
+                best[root] = label
+
+        return {label: best[clusters.find(key_index[norm])]
+                for label, norm in zip(originals, normalized)}
+
+    def _similar_pairs(self, keys: List[str]) -> List[tuple]:
+        if len(keys) < 2:
+            return []
+
+        vocabulary: Dict[str, int] = {}
+        rows, cols = [], []
+        for row, key in enumerate(keys):
+            for gram in set(ngrams(key, self.n)):
+                rows.append(row)
+                cols.append(vocabulary.setdefault(gram, len(vocabulary)))
+
+        incidence = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(len(keys), len(vocabulary)))
+        sizes = np.asarray(incidence.sum(axis=1)).ravel()
+
+        block_sizes = np.asarray(incidence.sum(axis=0)).ravel()
+        blocking = incidence[:, block_sizes <= self.max_block_size]
+
+        # Blocking only proposes candidates; frequent trigrams still count
+        # towards the Dice score, so it's computed on the full rows
+        candidates = sparse.triu(blocking @ blocking.T, k=1).tocoo()
+        row, col = candidates.row, candidates.col
+        shared = np.asarray(incidence[row].multiply(incidence[col]).sum(axis=1)).ravel()
+        dice = 2 * shared / (sizes[row] + sizes[col])
+        keep = dice >= self.threshold
+
+        numbers = [tuple(re.findall(r"\d+", key)) for key in keys]
+        return [(i, j) for i, j in zip(row[keep].tolist(), col[keep].tolist())
+                if numbers[i] == numbers[j]]
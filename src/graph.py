@@ -1,9 +1,13 @@
 import json
-from typing import List, TypedDict, Tuple, Union
-import networkx as nx
-import matplotlib.pyplot as plt
-from networkx.drawing.nx_agraph import graphviz_layout
-from thefuzz import fuzz
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, Hashable, Iterable, List, Optional, TypedDict, Tuple, Union
+from src.tracing import span
+
+# networkx, matplotlib, the entity resolver and the compact graph (numpy/scipy)
+# are only imported by the methods that need them, importing the graph stays cheap
+if TYPE_CHECKING:
+    import networkx as nx
+    from src.layout import LayeredLayout
 
 
 class RawEdge(TypedDict):
@@ -12,6 +16,7 @@ class RawEdge(TypedDict):
 
 
 class Edge:
+    __slots__ = ("source", "target", "id")
     source: str
     target: str
     id: str
@@ -22,17 +27,44 @@ class Edge:
         self.target = target
 
     def __repr__(self):
-        return json.dumps({
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_dict(self) -> dict:
+        return {
             "id": self.id,
             "source": self.source,
             "target": self.target
-        }, indent=2)
+        }
 
     def __str__(self):
         return f"{self.source} -> {self.target} (ID: {self.id})"
 
+    @property
+    def key(self) -> Tuple[str, str]:
+        """Identity of the edge, unambiguous even when labels contain "-"."""
+        return (self.source, self.target)
+
+
+@lru_cache(maxsize=1024)
+def node_dimensions(label_length: int, max_width: int = 100) -> Tuple[int, int]:
+    char_width = 8
+    base_padding = 20
+    line_height = 20
+
+    raw_width = label_length * char_width + base_padding
+
+    width = min(raw_width, max_width)
+    usable_width = max(1, width - base_padding)
+    max_chars_per_line = max(1, usable_width // char_width)
+    total_lines = -(-label_length // max_chars_per_line)
+
+    height = total_lines * line_height
+
+    return width, height
+
 
 class Node:
+    __slots__ = ("id", "x", "y", "width", "height")
     id: str
     x: float
     y: float
@@ -45,7 +77,10 @@ class Node:
         self.set_dimensions(*self.get_node_dimensions())
 
     def __repr__(self):
-        return json.dumps({
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_dict(self) -> dict:
+        return {
             "id": self.id,
             "position": {
                 "x": self.x,
@@ -53,7 +88,7 @@ class Node:
             },
             "width": self.width,
             "height": self.height
-        }, indent=2)
+        }
 
     def set_position(self, x: float, y: float) -> None:
         self.x = x
@@ -64,20 +99,12 @@ class Node:
         self.width = width
 
     def get_node_dimensions(self, max_width: int = 100) -> Tuple[int, int]:
-        char_width = 8
-        base_padding = 20
-        line_height = 20
-
-        raw_width = len(self.id) * char_width + base_padding
+        # Only depends on the label length, cached across nodes
+        return node_dimensions(len(self.id), max_width)
 
-        width = min(raw_width, max_width)
-        usable_width = max(1, width - base_padding)
-        max_chars_per_line = max(1, usable_width // char_width)
-        total_lines = -(-len(self.id) // max_chars_per_line)
-
-        height = total_lines * line_height
-
-        return width, height
+    @property
+    def key(self) -> str:
+        return self.id
 
 
 class Graph:
@@ -86,44 +113,79 @@ class Graph:
     fuzzy_threshold = 90
 
     def __init__(self, edges: List[Edge], nodes: List[Node]):
-        self.edges = self.unique(edges)
-        self.nodes = self.unique(nodes)
+        with span("graph.build", edges=len(edges), nodes=len(nodes)):
+            self.edges = self.unique(edges)
+            self.nodes = self.unique(nodes)
+        # One layout per direction, so re-layouts after small changes are incremental
+        self._layouts: Dict[str, "LayeredLayout"] = {}
+
+    @classmethod
+    def merge(cls, edges: Iterable[Edge], nodes: Iterable[Node] = ()) -> "Graph":
+        """
+        Builds one graph from the edges and nodes of many crops. Labels are
+        interned and edges deduplicated on their (source, target) id pair in
+        a `CompactGraph`. Without any `nodes` the nodes come from the edges.
+        """
+        from src.compact_graph import CompactGraph, LabelInterner
+
+        interner = LabelInterner(node.id for node in nodes)
+        detected = len(interner)
+        compact = CompactGraph.from_edges(edges, interner)
+        labels = compact.labels[:detected] if detected else compact.labels
+        return cls([Edge(source, target) for source, target in compact.pairs()],
+                   [Node(label) for label in labels])
 
     def unique(self, elements: Union[List[Edge] | List[Node]]) -> List[Edge]:
-        unique_dict = {}
+        unique_dict: dict[Hashable, Union[Edge, Node]] = {}
         for element in elements:
-            unique_dict[element.id] = element
+            unique_dict[element.key] = element
         return list(unique_dict.values())
 
     def fuzzy_unique(self, edges: List[Edge]) -> List[Edge]:
         """
-        This don't work well, as nodes have very similar labels
+        Rewrites edges to canonical node labels, merging labels that only
+        differ in spelling, and drops the resulting duplicate edges.
         """
+        from src.entity_resolution import EntityResolver
 
-        unique_edges: List[Edge] = []
-        seen_ids: List[str] = []
+        resolver = EntityResolver(threshold=self.fuzzy_threshold / 100)
+        canonical = resolver.resolve(
+            label for edge in edges for label in (edge.source, edge.target))
 
-        for edge in edges:
-            is_duplicate = False
-            for seen_id in seen_ids:
-                ratio = fuzz.ratio(edge.id, seen_id)
-                if ratio > self.fuzzy_threshold:
-                    is_duplicate = True
-                    break
-            if not is_duplicate:
-                unique_edges.append(edge)
-                seen_ids.append(edge.id)
-
-        return unique_edges
+        return self.unique([Edge(canonical[edge.source], canonical[edge.target])
+                            for edge in edges])
+
+    def resolve_entities(self) -> None:
+        """Merges near-duplicate nodes coming from different crops."""
+        from src.entity_resolution import EntityResolver
+
+        resolver = EntityResolver(threshold=self.fuzzy_threshold / 100)
+        with span("graph.resolve_entities", nodes=len(self.nodes)):
+            canonical = resolver.resolve([node.id for node in self.nodes] + [
+                label for edge in self.edges for label in (edge.source, edge.target)])
+
+        self.edges = self.unique([Edge(canonical[edge.source], canonical[edge.target])
+                                  for edge in self.edges])
+        self.nodes = self.unique([Node(canonical[node.id])
+                                  for node in self.nodes])
 
     def create_nodes_from_edges(self, edges: List[Edge]) -> List[Node]:
         nodes = {}
         for edge in edges:
-            nodes[edge.source] = Node(edge.source)
-            nodes[edge.target] = Node(edge.target)
+            for label in (edge.source, edge.target):
+                if label not in nodes:
+                    nodes[label] = Node(label)
         return list(nodes.values())
 
+    def to_dict(self) -> dict:
+        return {
+            "nodes": [node.to_dict() for node in self.nodes],
+            "edges": [edge.to_dict() for edge in self.edges],
+        }
+
     def create_digraph(self, direction: str = "TB"):
+        import networkx as nx
+
         digraph = nx.DiGraph()
         digraph.graph['rankdir'] = direction
 
@@ -135,10 +197,26 @@ class Graph:
 
         return digraph
 
-    def plot_digraph(self, digraph: nx.DiGraph):
-        pos = graphviz_layout(digraph, prog="dot")
-        for node in self.nodes:
-            node.set_position(*pos[node.id])
+    def layout(self, direction: str = "TB", layout: Optional["LayeredLayout"] = None) -> dict:
+        """
+        Positions every node with the built-in layered layout. The graph keeps
+        its layout per direction, pass `layout` to share one across graphs,
+        e.g. the ones `get_graph()` returns while crops are still coming in.
+        """
+        from src.layout import LayeredLayout
+
+        if layout is None:
+            layout = self._layouts.get(direction)
+            if layout is None:
+                layout = self._layouts[direction] = LayeredLayout(direction)
+        with span("graph.layout", nodes=len(self.nodes), edges=len(self.edges)):
+            return layout.layout(self)
+
+    def plot_digraph(self, digraph: "nx.DiGraph"):
+        import matplotlib.pyplot as plt
+        import networkx as nx
+
+        pos = self.layout(digraph.graph.get('rankdir', "TB"))
 
         nx.draw(digraph, pos, with_labels=True, node_size=2000,
                 node_color='lightblue', font_size=12, arrows=True, node_shape="s")
@@ -0,0 +1,266 @@
+import base64
+import hashlib
+import io
+import math
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Iterable, List, Optional, Sequence, Tuple, TypedDict, Union
+
+from PIL import Image
+
+from src.tracing import span
+from src.yolo.crop import Crop
+from src.utils.concurrency import map_ordered
+
+ImageInput = Union[str, Image.Image, Crop]
+
+
+class EncodedImage(TypedDict):
+    content: dict[str, Any]
+    format: str
+    detail: str
+    size: Tuple[int, int]
+    bytes: int
+    tokens: int
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """
+    Vision-token cost of an image, following OpenAI's tiling rules: low detail
+    is a flat 85 tokens, high detail fits the image in 2048x2048, scales the
+    short side down to 768 and charges 170 tokens per 512px tile.
+    """
+    if detail == "low":
+        return 85
+
+    scale = min(1.0, 2048 / max(width, height, 1))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / max(min(width, height), 1))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+class EncodingPolicy:
+    """
+    How an image is encoded for a vision request.
+
+    Without budgets, images are sent as lossless PNG at full resolution with
+    `"detail": "high"`. With `max_tokens` and/or `max_bytes` set, the image is
+    downscaled (never below `min_scale`, so text stays legible) and the
+    formats are tried in order until the payload fits. Images whose longest
+    side is at most `low_detail_max_side` go out with `"detail": "low"`, which
+    costs a flat 85 tokens and loses nothing at that size.
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        formats: Sequence[str] = ("PNG", "WEBP", "JPEG"),
+        quality: int = 85,
+        min_scale: float = 0.5,
+        low_detail_max_side: Optional[int] = None,
+    ):
+        self.max_tokens = max_tokens
+        self.max_bytes = max_bytes
+        self.formats = [f.upper() for f in formats]
+        self.quality = quality
+        self.min_scale = min_scale
+        self.low_detail_max_side = low_detail_max_side
+
+    @classmethod
+    def budget(cls, max_tokens: int = 765, max_bytes: int = 1024 * 1024):
+        """A policy for large crops: at most a 2x2 tile grid and ~1MB upload."""
+        return cls(max_tokens=max_tokens, max_bytes=max_bytes, low_detail_max_side=512)
+
+    @property
+    def key(self) -> tuple:
+        return (self.max_tokens, self.max_bytes, tuple(self.formats), self.quality,
+                self.min_scale, self.low_detail_max_side)
+
+    @property
+    def is_lossless(self) -> bool:
+        return self.max_tokens is None and self.max_bytes is None and self.low_detail_max_side is None
+
+    def detail_for(self, size: Tuple[int, int]) -> str:
+        if self.low_detail_max_side is not None and max(size) <= self.low_detail_max_side:
+            return "low"
+        return "high"
+
+    def scale_for(self, size: Tuple[int, int], detail: str) -> float:
+        """Largest scale >= `min_scale` that fits the token budget."""
+        if self.max_tokens is None:
+            return 1.0
+        scale = 1.0
+        while scale > self.min_scale:
+            width, height = (max(1, int(side * scale)) for side in size)
+            if estimate_image_tokens(width, height, detail) <= self.max_tokens:
+                break
+            scale *= 0.9
+        return max(scale, self.min_scale)
+
+
+def _to_image(image: ImageInput) -> Image.Image:
+    if isinstance(image, Crop):
+        return image.to_image()
+    if isinstance(image, str):
+        return Image.open(image)
+    if isinstance(image, Image.Image):
+        return image
+    raise ValueError(
+        "Input must be a filepath (str), Crop or PIL.Image.Image object.")
+
+
+def _save(image: Image.Image, format: str, quality: int) -> bytes:
+    if format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffered = io.BytesIO()
+    if format in ("JPEG", "WEBP"):
+        image.save(buffered, format=format, quality=quality)
+    else:
+        image.save(buffered, format=format)
+    return buffered.getvalue()
+
+
+def _encoded(img_bytes: bytes, format: str, detail: str, size: Tuple[int, int]) -> EncodedImage:
+    mime_type = f"image/{format.lower()}"
+    base64_image = base64.b64encode(img_bytes).decode("utf-8")
+    return {
+        "content": {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{mime_type};base64,{base64_image}",
+                "detail": detail,
+            },
+        },
+        "format": format,
+        "detail": detail,
+        "size": size,
+        "bytes": len(img_bytes),
+        "tokens": estimate_image_tokens(*size, detail),
+    }
+
+
+def encode_image(image: ImageInput, policy: Optional[EncodingPolicy] = None, format: Optional[str] = None) -> EncodedImage:
+    """
+    Encode an image as an `image_url` message part according to `policy`.
+    `format` is tried before the policy's own formats.
+    """
+    with span("encode_image") as s:
+        encoded = _encode_image(image, policy or EncodingPolicy(), format)
+        s.set(bytes=encoded["bytes"], format=encoded["format"], detail=encoded["detail"],
+              size=encoded["size"], tokens=encoded["tokens"])
+        return encoded
+
+
+def _encode_image(image: ImageInput, policy: EncodingPolicy, format: Optional[str]) -> EncodedImage:
+    formats = ([format.upper()] if format else []) + \
+        [f for f in policy.formats if f != (format or "").upper()]
+
+    if policy.is_lossless:
+        if isinstance(image, str):
+            # Send files as they are, no re-encoding needed
+            with open(image, "rb") as f:
+                img_bytes = f.read()
+            mime_type = mimetypes.guess_type(image)[0] or "image/png"
+            with Image.open(image) as img:
+                size = img.size
+            return _encoded(img_bytes, mime_type.split("/")[-1].upper(), "high", size)
+
+        img = _to_image(image)
+        return _encoded(_save(img, formats[0], policy.quality), formats[0], "high", img.size)
+
+    img = _to_image(image)
+    detail = policy.detail_for(img.size)
+    scale = policy.scale_for(img.size, detail)
+
+    best: Optional[Tuple[bytes, str, Tuple[int, int]]] = None
+    while True:
+        size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+        resized = img if size == img.size else img.resize(
+            size, Image.Resampling.LANCZOS)
+        for candidate in formats:
+            img_bytes = _save(resized, candidate, policy.quality)
+            if best is None or len(img_bytes) < len(best[0]):
+                best = (img_bytes, candidate, size)
+            if policy.max_bytes is None or len(img_bytes) <= policy.max_bytes:
+                return _encoded(img_bytes, candidate, detail, size)
+
+        if scale <= policy.min_scale:
+            # Nothing fits without hurting legibility, send the smallest
+            return _encoded(best[0], best[1], detail, best[2])
+        scale = max(policy.min_scale, scale * 0.8)
+
+
+def image_digest(image: ImageInput) -> str:
+    """Cheap identity of an image's content, used to key encoded payloads."""
+    if isinstance(image, Crop):
+        return image.digest
+    if isinstance(image, str):
+        stat = os.stat(image)
+        return f"{os.path.abspath(image)}:{stat.st_mtime_ns}:{stat.st_size}"
+    if isinstance(image, Image.Image):
+        return hashlib.blake2b(image.tobytes() + f"{image.mode}{image.size}".encode(),
+                               digest_size=16).hexdigest()
+    raise ValueError(
+        "Input must be a filepath (str), Crop or PIL.Image.Image object.")
+
+
+class PayloadCache:
+    """
+    Encoded image payloads keyed by image content and encoding policy.
+
+    One cache is shared by all detectors of a run, so every crop is encoded
+    exactly once no matter how many stages (or retries) send it. Concurrent
+    requests for the same image wait for the first encoding instead of
+    repeating it. At most `max_entries` payloads are kept, least recently
+    used are dropped first.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple, Future] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encode(self, image: ImageInput, policy: Optional[EncodingPolicy] = None, format: Optional[str] = None) -> EncodedImage:
+        policy = policy or EncodingPolicy()
+        key = (image_digest(image), policy.key, (format or "").upper())
+
+        with self._lock:
+            future = self._entries.get(key)
+            if future is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                owner = False
+            else:
+                future = Future()
+                self._entries[key] = future
+                self.misses += 1
+                owner = True
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        if not owner:
+            return future.result()
+
+        try:
+            future.set_result(encode_image(image, policy, format))
+        except BaseException as e:
+            with self._lock:
+                self._entries.pop(key, None)
+            future.set_exception(e)
+            raise
+        return future.result()
+
+    def prefetch(self, images: Iterable[ImageInput], policy: Optional[EncodingPolicy] = None, max_workers: int = 8) -> List[EncodedImage]:
+        """Encode the crops of an image in parallel, ahead of the LLM calls."""
+        return map_ordered(lambda image: self.encode(image, policy), images, max_workers)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,120 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, TypedDict, Union
+
+from src.utils.path import from_root
+
+
+class CropCheckpoint(TypedDict):
+    crop_id: str
+    # Stages completed for the crop, in order, e.g. ["nodes", "mermaid"]
+    stages: List[str]
+    box: Optional[List[float]]
+    state: Dict[str, Any]
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    detections TEXT,
+    status TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS crops (
+    job TEXT NOT NULL,
+    crop_id TEXT NOT NULL,
+    stages TEXT NOT NULL,
+    box TEXT,
+    state TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (job, crop_id)
+);
+"""
+
+
+class JobStore:
+    """
+    SQLite checkpoints of detector runs, so a failed or interrupted run
+    resumes where it stopped instead of paying again for finished calls.
+
+    A job is one image under one detector configuration. It stores the YOLO
+    detections (so a resumed run gets the same crops without re-running
+    YOLO) and, per crop, the stages completed so far with the crop's box and
+    its state after the last stage (nodes, mermaid text, edges). Each
+    checkpoint is committed on its own, WAL mode keeps that cheap.
+    """
+
+    def __init__(self, path: Union[str, Path, None] = None):
+        self.path = Path(path) if path else from_root(".cache", "jobs.sqlite")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # One connection shared by the detector's worker threads
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _execute(self, query: str, parameters: tuple = ()) -> List[tuple]:
+        with self._lock:
+            with self._connection:
+                return self._connection.execute(query, parameters).fetchall()
+
+    def start(self, job: str, file: str) -> None:
+        self._execute(
+            "INSERT INTO jobs (job, file, status, updated) VALUES (?, ?, 'running', ?) "
+            "ON CONFLICT(job) DO UPDATE SET status = 'running', updated = excluded.updated",
+            (job, file, time.time()))
+
+    def save_detections(self, job: str, detections: List[dict]) -> None:
+        self._execute("UPDATE jobs SET detections = ?, updated = ? WHERE job = ?",
+                      (json.dumps(detections), time.time(), job))
+
+    def detections(self, job: str) -> Optional[List[dict]]:
+        rows = self._execute("SELECT detections FROM jobs WHERE job = ?", (job,))
+        if not rows or rows[0][0] is None:
+            return None
+        return json.loads(rows[0][0])
+
+    def checkpoint(self, job: str, crop_id: str, stage: str, state: Dict[str, Any],
+                   box: Optional[List[float]] = None) -> None:
+        """Record that `crop_id` finished `stage`, with its state afterwards."""
+        with self._lock:
+            with self._connection:
+                row = self._connection.execute(
+                    "SELECT stages FROM crops WHERE job = ? AND crop_id = ?", (job, crop_id)).fetchone()
+                stages = json.loads(row[0]) if row else []
+                if stage not in stages:
+                    stages.append(stage)
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO crops (job, crop_id, stages, box, state, updated) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (job, crop_id, json.dumps(stages), json.dumps(box), json.dumps(state), time.time()))
+
+    def crops(self, job: str) -> Dict[str, CropCheckpoint]:
+        rows = self._execute("SELECT crop_id, stages, box, state FROM crops WHERE job = ?", (job,))
+        return {crop_id: {"crop_id": crop_id, "stages": json.loads(stages),
+                          "box": json.loads(box), "state": json.loads(state)}
+                for crop_id, stages, box, state in rows}
+
+    def complete(self, job: str) -> None:
+        self._execute("UPDATE jobs SET status = 'complete', updated = ? WHERE job = ?",
+                      (time.time(), job))
+
+    def status(self, job: str) -> Optional[str]:
+        rows = self._execute("SELECT status FROM jobs WHERE job = ?", (job,))
+        return rows[0][0] if rows else None
+
+    def clear(self, job: Optional[str] = None) -> None:
+        """Forget one job, or every job."""
+        if job is None:
+            self._execute("DELETE FROM crops")
+            self._execute("DELETE FROM jobs")
+        else:
+            self._execute("DELETE FROM crops WHERE job = ?", (job,))
+            self._execute("DELETE FROM jobs WHERE job = ?", (job,))
+
+    def close(self) -> None:
+        self._connection.close()
@@ -0,0 +1,233 @@
+from typing import Dict, List, Sequence, Set, Tuple
+
+import numpy as np
+
+from src.graph import Graph, node_dimensions
+
+
+class LayeredLayout:
+    """
+    Sugiyama-style layered layout, a headless replacement for graphviz `dot`.
+
+    1. Cycle removal: edges closing a cycle in a DFS are reversed.
+    2. Layer assignment: longest path from the sources.
+    3. Long edges are split with dummy nodes, one per layer crossed.
+    4. Crossing minimization: barycenter sweeps down and up the layers.
+    5. Coordinates: nodes are pulled towards the mean of their neighbours in
+       the previous layer while keeping `node_gap` between boxes.
+
+    Node sizes come from `Node.width`/`Node.height`, `rankdir` is one of
+    TB, BT, LR, RL. The layer order of the last run is kept, so calling
+    `layout` again after a few edges changed starts from it and only needs
+    `incremental_sweeps` sweeps.
+    """
+
+    def __init__(self, rankdir: str = "TB", layer_gap: float = 60, node_gap: float = 30,
+                 sweeps: int = 8, incremental_sweeps: int = 2):
+        if rankdir not in ("TB", "BT", "LR", "RL"):
+            raise ValueError(f"Unknown rankdir '{rankdir}'")
+        self.rankdir = rankdir
+        self.layer_gap = layer_gap
+        self.node_gap = node_gap
+        self.sweeps = sweeps
+        self.incremental_sweeps = incremental_sweeps
+        self._order: Dict[str, float] = {}
+        self._edges: Set[Tuple[str, str]] = set()
+        self._positions: Dict[str, Tuple[float, float]] = {}
+
+    def layout(self, graph: Graph) -> Dict[str, Tuple[float, float]]:
+        """Compute positions and write them into the graph's nodes."""
+        labels = list(dict.fromkeys([node.id for node in graph.nodes] + [
+            label for edge in graph.edges for label in (edge.source, edge.target)]))
+        edges = {(edge.source, edge.target) for edge in graph.edges}
+
+        if edges == self._edges and set(labels) == set(self._positions):
+            positions = self._positions
+        else:
+            sizes = {node.id: (node.width, node.height) for node in graph.nodes}
+            sweeps = self.incremental_sweeps if self._order else self.sweeps
+            positions = self._layout(labels, [(e.source, e.target) for e in graph.edges],
+                                     sizes, sweeps)
+            self._edges = edges
+            self._positions = positions
+
+        for node in graph.nodes:
+            node.set_position(*positions[node.id])
+        return positions
+
+    def _layout(self, labels: List[str], edge_list: Sequence[Tuple[str, str]],
+                sizes: Dict[str, Tuple[int, int]], sweeps: int) -> Dict[str, Tuple[float, float]]:
+        n = len(labels)
+        if n == 0:
+            return {}
+        index = {label: i for i, label in enumerate(labels)}
+        pairs = np.array([(index[s], index[t]) for s, t in edge_list if s != t],
+                         dtype=np.int64).reshape(-1, 2)
+        pairs = self._remove_cycles(n, pairs)
+        layers = self._assign_layers(n, pairs)
+
+        # Split long edges with dummy nodes, one per crossed layer
+        node_layer = list(layers)
+        segments = []
+        for s, t in pairs.tolist():
+            previous = s
+            for layer in range(layers[s] + 1, layers[t]):
+                node_layer.append(layer)
+                segments.append((previous, len(node_layer) - 1))
+                previous = len(node_layer) - 1
+            segments.append((previous, t))
+        node_layer = np.array(node_layer, dtype=np.int64)
+        segments = np.array(segments, dtype=np.int64).reshape(-1, 2)
+        total = len(node_layer)
+
+        # Breadth along a layer and thickness across it, per rankdir
+        horizontal = self.rankdir in ("TB", "BT")
+        breadth = np.zeros(total)
+        thickness = np.zeros(total)
+        for i, label in enumerate(labels):
+            width, height = sizes.get(label) or node_dimensions(len(label))
+            breadth[i], thickness[i] = (width, height) if horizontal else (height, width)
+
+        order = self._initial_order(labels, node_layer)
+        order = self._minimize_crossings(node_layer, segments, order, sweeps)
+        cross = self._assign_cross_coordinates(node_layer, segments, order, breadth)
+
+        layer_count = int(node_layer.max()) + 1
+        layer_thickness = np.zeros(layer_count)
+        np.maximum.at(layer_thickness, node_layer, thickness)
+        starts = np.concatenate(([0.0], np.cumsum(layer_thickness + self.layer_gap)[:-1]))
+        along = starts[node_layer] + layer_thickness[node_layer] / 2
+
+        self._order = {label: float(order[i]) for i, label in enumerate(labels)}
+
+        positions = {}
+        for i, label in enumerate(labels):
+            if self.rankdir == "TB":
+                # Same orientation as graphviz: first layer on top (largest y)
+                position = (cross[i], -along[i])
+            elif self.rankdir == "BT":
+                position = (cross[i], along[i])
+            elif self.rankdir == "LR":
+                position = (along[i], -cross[i])
+            else:
+                position = (-along[i], -cross[i])
+            positions[label] = (float(position[0]), float(position[1]))
+        return positions
+
+    def _remove_cycles(self, n: int, pairs: np.ndarray) -> np.ndarray:
+        successors: List[List[int]] = [[] for _ in range(n)]
+        for s, t in pairs.tolist():
+            successors[s].append(t)
+
+        state = np.zeros(n, dtype=np.int8)  # 0 new, 1 on stack, 2 done
+        back_edges = set()
+        for root in range(n):
+            if state[root]:
+                continue
+            stack = [(root, iter(successors[root]))]
+            state[root] = 1
+            while stack:
+                node, children = stack[-1]
+                for child in children:
+                    if state[child] == 1:
+                        back_edges.add((node, child))
+                    elif state[child] == 0:
+                        state[child] = 1
+                        stack.append((child, iter(successors[child])))
+                        break
+                else:
+                    state[node] = 2
+                    stack.pop()
+
+        if not back_edges:
+            return pairs
+        flipped = np.array([(t, s) if (s, t) in back_edges else (s, t)
+                            for s, t in pairs.tolist()], dtype=np.int64)
+        return np.unique(flipped, axis=0) if len(flipped) else flipped
+
+    def _assign_layers(self, n: int, pairs: np.ndarray) -> np.ndarray:
+        layers = np.zeros(n, dtype=np.int64)
+        if len(pairs) == 0:
+            return layers
+        sources, targets = pairs[:, 0], pairs[:, 1]
+        # Relax all edges at once until no layer moves; at most n rounds on a DAG
+        for _ in range(n):
+            updated = layers.copy()
+            np.maximum.at(updated, targets, layers[sources] + 1)
+            if np.array_equal(updated, layers):
+                break
+            layers = updated
+        return layers
+
+    def _initial_order(self, labels: List[str], node_layer: np.ndarray) -> np.ndarray:
+        # Previous positions first (incremental layout), new nodes after them
+        seed = np.arange(len(node_layer), dtype=float) + 1e6
+        for i, label in enumerate(labels):
+            if label in self._order:
+                seed[i] = self._order[label]
+        return self._ranks(node_layer, seed)
+
+    @staticmethod
+    def _ranks(node_layer: np.ndarray, key: np.ndarray) -> np.ndarray:
+        """Position of every node within its layer when sorted by `key`."""
+        order = np.lexsort((key, node_layer))
+        ranks = np.empty(len(node_layer), dtype=float)
+        layer_sorted = node_layer[order]
+        starts = np.searchsorted(layer_sorted, layer_sorted, side="left")
+        ranks[order] = np.arange(len(order)) - starts
+        return ranks
+
+    def _minimize_crossings(self, node_layer: np.ndarray, segments: np.ndarray,
+                            order: np.ndarray, sweeps: int) -> np.ndarray:
+        if len(segments) == 0:
+            return order
+        upper, lower = segments[:, 0], segments[:, 1]
+        total = len(node_layer)
+        for sweep in range(sweeps):
+            # Downward sweeps look at the layer above, upward at the layer below
+            fixed, moving = (upper, lower) if sweep % 2 == 0 else (lower, upper)
+            sums = np.bincount(moving, weights=order[fixed], minlength=total)
+            counts = np.bincount(moving, minlength=total)
+            barycenter = np.where(counts > 0, sums / np.maximum(counts, 1), order)
+            # Ties keep the current order
+            new_order = self._ranks(node_layer, barycenter + order * 1e-6)
+            if np.array_equal(new_order, order):
+                break
+            order = new_order
+        return order
+
+    def _assign_cross_coordinates(self, node_layer: np.ndarray, segments: np.ndarray,
+                                  order: np.ndarray, breadth: np.ndarray) -> np.ndarray:
+        total = len(node_layer)
+        cross = np.zeros(total)
+
+        # Nodes grouped by layer in order, and segments grouped by lower layer
+        by_position = np.lexsort((order, node_layer))
+        layer_starts = np.searchsorted(node_layer[by_position], np.arange(int(node_layer.max()) + 2))
+        segment_layer = node_layer[segments[:, 1]] if len(segments) else np.empty(0, dtype=np.int64)
+        by_layer = np.argsort(segment_layer, kind="stable")
+        segment_starts = np.searchsorted(segment_layer[by_layer], np.arange(int(node_layer.max()) + 2))
+
+        sums = np.zeros(total)
+        counts = np.zeros(total)
+        for layer in range(len(layer_starts) - 1):
+            members = by_position[layer_starts[layer]:layer_starts[layer + 1]]
+            size = breadth[members]
+            # Minimum distance of every box's center from the first one
+            spacing = np.concatenate(([0.0], np.cumsum(
+                (size[:-1] + size[1:]) / 2 + self.node_gap)))
+
+            desired = spacing - spacing[-1] / 2
+            incoming = segments[by_layer[segment_starts[layer]:segment_starts[layer + 1]]]
+            if len(incoming):
+                np.add.at(sums, incoming[:, 1], cross[incoming[:, 0]])
+                np.add.at(counts, incoming[:, 1], 1)
+                has_parents = counts[members] > 0
+                desired = np.where(has_parents, sums[members] / np.maximum(counts[members], 1), desired)
+
+            # Closest positions to `desired` that keep the order and spacing
+            placed = np.maximum.accumulate(desired - spacing) + spacing
+            # Pushing right only drifts the layer, re-center it on `desired`
+            placed += desired.mean() - placed.mean()
+            cross[members] = placed
+        return cross
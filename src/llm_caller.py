@@ -1,15 +1,34 @@
 # built-in libraries
-from typing import TypeVar, Any, List, Optional, Type, Union
+from __future__ import annotations
+import contextlib
+import contextvars
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import lru_cache
+from pathlib import Path
+from typing import (TYPE_CHECKING, TypeVar, Any, Callable, Deque, Dict, List, Optional, Tuple, Type,
+                    TypedDict, Union)
 
-# litellm libraries
-import litellm
-from litellm.types.utils import ModelResponse, Message
-from litellm import completion
-from instructor import from_litellm, Mode
+# litellm libraries, imported on first use as they take seconds to load
+if TYPE_CHECKING:
+    from litellm.types.utils import ModelResponse, Message
+    from instructor import Mode
 
 # misc libraries
 from pydantic import BaseModel, create_model
 
+# local libraries
+from src.prompts import estimate_tokens
+from src.tracing import NOOP_SPAN, payload_bytes, span, tracer
+from src.utils.path import from_root
+
 
 class BaseResponse(BaseModel):
     """A default response model that defines a single
@@ -20,6 +39,400 @@ class BaseResponse(BaseModel):
 # For type-hinting structured responses:
 ResponseType = TypeVar("ResponseType", bound=BaseModel)
 
+
+@lru_cache(maxsize=128)
+def _response_model(title: str, fields: tuple) -> Type[BaseResponse]:
+    return create_model(title, **dict(fields), __base__=BaseResponse)  # type: ignore
+
+
+class CacheMissError(KeyError):
+    """Raised by a replay-only `ResponseCache` when a call was never recorded."""
+
+
+class ResponseCache:
+    """
+    Content-addressed, on-disk cache of LLM responses.
+
+    Every entry is a single JSON file named after the sha256 of the call
+    (model id, normalized messages, response schema and kwargs). Image
+    payloads are replaced by their hash before keying, so the key stays small
+    and identical crops hit the same entry.
+
+    Entries are evicted least-recently-used first once `max_entries` or
+    `max_bytes` is exceeded, and are ignored once older than `max_age`
+    seconds. Writes keep a running count and size, so the directory is only
+    scanned when a limit is passed or every `evict_every` writes. With
+    `replay_only=True` a miss raises `CacheMissError` instead of calling the
+    provider, which lets the pipeline run offline.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path] = from_root(".cache", "llm"),
+        max_entries: Optional[int] = 10_000,
+        max_bytes: Optional[int] = 512 * 1024 * 1024,
+        max_age: Optional[float] = None,
+        replay_only: bool = False,
+        evict_every: int = 256
+    ):
+        self.directory = Path(directory)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.replay_only = replay_only
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Entries and bytes on disk as of the last scan plus later writes;
+        # other processes sharing the directory are caught by the next scan
+        self._count: Optional[int] = None
+        self._bytes = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(value: Any) -> Any:
+        """Turn messages into plain JSON data with image payloads hashed."""
+        if isinstance(value, BaseModel):
+            value = value.model_dump(exclude_none=True)
+        if isinstance(value, dict):
+            return {str(k): ResponseCache.normalize(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [ResponseCache.normalize(v) for v in value]
+        if isinstance(value, str) and value.startswith("data:") and ";base64," in value:
+            digest = hashlib.sha256(value.encode("utf-8")).hexdigest()
+            return f"{value.split(';base64,')[0]};sha256,{digest}"
+        if isinstance(value, (str, int, float, bool)) or value is None:
+            return value
+        return repr(value)
+
+    def key(
+        self,
+        model_id: str,
+        messages: List[Any],
+        response_model: Optional[Type[BaseModel]],
+        kwargs: dict[str, Any],
+        kind: str
+    ) -> str:
+        schema = response_model.model_json_schema() if response_model else None
+        payload = json.dumps({
+            "kind": kind,
+            "model": model_id,
+            "messages": self.normalize(messages),
+            "schema": schema,
+            "kwargs": self.normalize(kwargs),
+        }, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> Any:
+        """Return the stored value, or raise `CacheMissError`."""
+        path = self._path(key)
+        try:
+            stat = path.stat()
+            if self.max_age is not None and time.time() - stat.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+                raise FileNotFoundError(path)
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)["value"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            self.misses += 1
+            raise CacheMissError(key)
+
+        # Touch the entry so eviction is least-recently-used; another process
+        # may have evicted it since the read
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)
+        self.hits += 1
+        return value
+
+    def _over_limit(self) -> bool:
+        return (self.max_entries is not None and self._count is not None and self._count > self.max_entries) or \
+            (self.max_bytes is not None and self._bytes > self.max_bytes)
+
+    def put(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        # A temp file per write: threads may store the same key at once
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"value": value}, f)
+        size = os.path.getsize(tmp)
+        try:
+            replaced = path.stat().st_size
+        except FileNotFoundError:
+            replaced = None
+        os.replace(tmp, path)
+
+        with self._lock:
+            if self._count is not None:
+                self._count += replaced is None
+                self._bytes += size - (replaced or 0)
+            self._writes += 1
+            due = self._count is None or self._writes % self.evict_every == 0 or self._over_limit()
+        if due:
+            self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        for mtime, size, path in entries:
+            expired = self.max_age is not None and now - mtime > self.max_age
+            too_many = self.max_entries is not None and count > self.max_entries
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not (expired or too_many or too_big):
+                break
+            path.unlink(missing_ok=True)
+            count -= 1
+            total -= size
+
+        with self._lock:
+            self._count, self._bytes = count, total
+
+    def clear(self) -> None:
+        for path in self.directory.glob("*.json"):
+            path.unlink(missing_ok=True)
+        with self._lock:
+            self._count, self._bytes = 0, 0
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when an LLM call, retries and hedges included, runs past its deadline."""
+
+
+class Attempt(TypedDict):
+    # 0 for the first request of a call, counting retries and hedges
+    number: int
+    hedge: bool
+    # Seconds after the call started
+    started: float
+    latency: Optional[float]
+    # "ok", "error", or "abandoned" when another request won or the deadline passed
+    outcome: str
+    error: Optional[str]
+
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+def is_retryable(error: Optional[BaseException]) -> bool:
+    """Timeouts, connection errors, rate limits and 5xx answers, also when wrapped."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (TimeoutError, ConnectionError)):
+            return True
+        status = getattr(error, "status_code", None)
+        if isinstance(status, int):
+            return status in RETRYABLE_STATUS or status >= 500
+        error = error.__cause__ or error.__context__
+    return False
+
+
+T = TypeVar("T")
+
+
+class LatencyPolicy:
+    """
+    Deadlines, retries and hedged requests for LLM calls, so one stalled
+    provider call can't stall a whole diagram.
+
+    Every request gets at most `timeout` seconds (passed to the provider
+    client), and a call, retries and hedges included, at most `deadline`
+    seconds before `DeadlineExceeded` is raised. Retryable errors (see
+    `is_retryable`) are retried up to `max_retries` times after a random
+    wait between 0 and `backoff * 2**retry` seconds, capped at `max_backoff`.
+
+    With `hedge=True` a duplicate request is sent once the first one has run
+    longer than the `hedge_quantile` of the recent successful latencies of
+    the same kind of call (`hedge_after` seconds until `min_samples` are
+    known, no hedge if None) and the first success wins. The slower request
+    can't be interrupted, its answer is dropped. The attempts of the last
+    `history` calls are kept in `calls`.
+    """
+
+    def __init__(
+        self,
+        timeout: Optional[float] = None,
+        deadline: Optional[float] = None,
+        max_retries: int = 2,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95,
+        hedge_after: Optional[float] = None,
+        min_samples: int = 20,
+        window: int = 200,
+        max_workers: int = 32,
+        history: int = 1000
+    ):
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_after = hedge_after
+        self.min_samples = min_samples
+        self.window = window
+        self.max_workers = max_workers
+        self.calls: Deque[dict] = deque(maxlen=history)
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def observe(self, kind: str, latency: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(kind, deque(maxlen=self.window)).append(latency)
+
+    def hedge_delay(self, kind: str) -> Optional[float]:
+        """Seconds before a request of this kind gets a duplicate, None for never."""
+        if not self.hedge:
+            return None
+        with self._lock:
+            latencies = sorted(self._latencies.get(kind, ()))
+        if len(latencies) < self.min_samples:
+            return self.hedge_after
+        return latencies[int(self.hedge_quantile * (len(latencies) - 1))]
+
+    def backoff_delay(self, retry: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** retry))
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="llm")
+            return self._executor
+
+    def call(self, request: Callable[[Optional[float]], T], kind: str = "", s: Any = NOOP_SPAN) -> T:
+        """
+        Run `request(timeout)` under the policy and return the first success.
+        The attempts are recorded in `calls` and on the span `s`.
+        """
+        start = time.monotonic()
+        deadline = start + self.deadline if self.deadline is not None else None
+        attempts: List[Attempt] = []
+        outcome = "error"
+        try:
+            for retry in range(self.max_retries + 1):
+                try:
+                    result = self._race(request, kind, start, deadline, attempts)
+                    outcome = "ok"
+                    return result
+                except DeadlineExceeded:
+                    outcome = "deadline"
+                    raise
+                except Exception as e:
+                    if retry == self.max_retries or not is_retryable(e):
+                        raise
+                    delay = self.backoff_delay(retry)
+                    if deadline is not None and time.monotonic() + delay >= deadline:
+                        outcome = "deadline"
+                        raise DeadlineExceeded(f"No answer within {self.deadline}s") from e
+                    time.sleep(delay)
+        finally:
+            self.calls.append({"kind": kind, "outcome": outcome,
+                               "latency": time.monotonic() - start, "attempts": attempts})
+            s.set(attempts=attempts, hedged=any(attempt["hedge"] for attempt in attempts))
+
+    def _race(self, request: Callable[[Optional[float]], T], kind: str, start: float,
+              deadline: Optional[float], attempts: List[Attempt]) -> T:
+        """One request, plus its hedge if it runs long; the first success wins."""
+        if deadline is None and self.hedge_delay(kind) is None:
+            # Nothing to watch for, so the request runs in the calling thread
+            attempt: Attempt = {"number": len(attempts), "hedge": False, "started": time.monotonic() - start,
+                                "latency": None, "outcome": "error", "error": None}
+            attempts.append(attempt)
+            try:
+                result = request(self.timeout)
+            except Exception as e:
+                attempt["error"] = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                attempt["latency"] = time.monotonic() - start - attempt["started"]
+            attempt["outcome"] = "ok"
+            self.observe(kind, attempt["latency"])
+            return result
+
+        executor = self._pool()
+        running: Dict[Future, Attempt] = {}
+
+        def launch(hedge: bool) -> None:
+            now = time.monotonic()
+            timeout = self.timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - now) if timeout is not None else deadline - now
+            attempt: Attempt = {"number": len(attempts), "hedge": hedge, "started": now - start,
+                                "latency": None, "outcome": "running", "error": None}
+            attempts.append(attempt)
+            # The copied context keeps the crop id on spans made by the request
+            running[executor.submit(contextvars.copy_context().run, request, timeout)] = attempt
+
+        def abandon() -> None:
+            for future, attempt in running.items():
+                future.cancel()
+                attempt["outcome"] = "abandoned"
+
+        launch(False)
+        hedge_at = self.hedge_delay(kind)
+        hedge_at = start + attempts[-1]["started"] + hedge_at if hedge_at is not None else None
+        error: Optional[Exception] = None
+        while running:
+            wake = [t for t in (deadline, hedge_at) if t is not None]
+            done, _ = wait(running, timeout=max(0.0, min(wake) - time.monotonic()) if wake else None,
+                           return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for future in done:
+                attempt = running.pop(future)
+                attempt["latency"] = now - start - attempt["started"]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    attempt["outcome"], attempt["error"] = "error", f"{type(e).__name__}: {e}"
+                    error = e
+                    continue
+                attempt["outcome"] = "ok"
+                self.observe(kind, attempt["latency"])
+                abandon()
+                return result
+
+            if deadline is not None and now >= deadline:
+                abandon()
+                raise DeadlineExceeded(f"No answer within {self.deadline}s") from error
+            if hedge_at is not None and running and now >= hedge_at:
+                launch(True)
+                hedge_at = None
+        assert error is not None
+        raise error
+
+    def stats(self) -> Dict[str, int]:
+        """Counts over the recorded calls."""
+        calls = list(self.calls)
+        attempts = [attempt for call in calls for attempt in call["attempts"]]
+        return {
+            "calls": len(calls),
+            "failed": sum(call["outcome"] != "ok" for call in calls),
+            "deadline_exceeded": sum(call["outcome"] == "deadline" for call in calls),
+            "attempts": len(attempts),
+            "errors": sum(attempt["outcome"] == "error" for attempt in attempts),
+            "hedges": sum(attempt["hedge"] for attempt in attempts),
+            "hedge_wins": sum(attempt["hedge"] and attempt["outcome"] == "ok" for attempt in attempts),
+        }
+
+
 # Code taking from MA3 and modified
 
 
@@ -33,22 +446,47 @@ class LLMCaller:
         project_id: Optional[str] = None,
         api_url: Optional[str] = None,
         params: dict[str, Any] = {},
-        mode: Mode = Mode.JSON
+        mode: Optional[Mode] = None,
+        cache: Optional[ResponseCache] = None,
+        policy: Optional[LatencyPolicy] = None
     ):
+        import litellm
+        from litellm import completion
+        from instructor import from_litellm, Mode
+
         self.api_key = api_key
         self.project_id = project_id
         self.api_url = api_url
         self.model_id = model_id
         self.params = params
+        self.cache = cache
+        self.policy = policy
 
         # Boilerplate for Watsonx.ai:
         litellm.drop_params = True
         # Instructor client for Pydantic-based interactions:
-        self.client = from_litellm(completion, mode=mode)
+        self.client = from_litellm(completion, mode=mode or Mode.JSON)
+
+        # Instructor retries failed validations internally; its hooks run in
+        # the calling thread, so attempts are counted per thread
+        self._attempts = threading.local()
+        if hasattr(self.client, "on"):
+            self.client.on("completion:kwargs", self._count_attempt)
+
+    def _count_attempt(self, *args, **kwargs) -> None:
+        self._attempts.count = getattr(self._attempts, "count", 0) + 1
 
     def create_response_model(self, title: str, fields: dict) -> ResponseType:
         """Dynamically create a Pydantic model inheriting from BaseResponse."""
-        return create_model(title, **fields, __base__=BaseResponse)  # type: ignore
+        try:
+            return _response_model(title, tuple(fields.items()))
+        except TypeError:
+            # Unhashable field definitions can't be cached
+            return create_model(title, **fields, __base__=BaseResponse)  # type: ignore
+
+    def estimate_tokens(self, messages: List[Message]) -> int:
+        """Prompt tokens `messages` will cost, estimated locally before sending."""
+        return estimate_tokens(messages, self.model_id)
 
     def invoke(
         self,
@@ -56,6 +494,49 @@ class LLMCaller:
         response_model: Optional[Type[ResponseType]] = BaseResponse,
         **kwargs
     ) -> Union[ResponseType, str]:
+        with span("llm.invoke", model=self.model_id,
+                  response_model=response_model.__name__ if response_model else None) as s:
+            if tracer.enabled:
+                s.set(bytes=payload_bytes(messages),
+                      estimated_tokens=self.estimate_tokens(messages))
+
+            if self.cache is not None:
+                key = self.cache.key(self.model_id, messages,
+                                     response_model, kwargs, "invoke")
+                try:
+                    value = self.cache.get(key)
+                    s.set(cached=True)
+                    if response_model is None:
+                        return value
+                    return response_model.model_validate(value)
+                except CacheMissError:
+                    if self.cache.replay_only:
+                        raise
+
+            result = self._invoke(messages, response_model, s, **kwargs)
+
+            if self.cache is not None:
+                # The raw-text path may return no content, stored as null
+                self.cache.put(key, result if result is None or isinstance(
+                    result, str) else result.model_dump(mode="json"))
+            return result
+
+    def _record_usage(self, s, completion: Any) -> None:
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            s.set(prompt_tokens=getattr(usage, "prompt_tokens", None),
+                  completion_tokens=getattr(usage, "completion_tokens", None),
+                  total_tokens=getattr(usage, "total_tokens", None))
+
+    def _invoke(
+        self,
+        messages: List[Message],
+        response_model: Optional[Type[ResponseType]],
+        s,
+        **kwargs
+    ) -> Union[ResponseType, str]:
+        from litellm import completion
+
         # Prepare call arguments, only include optional fields if provided
         call_args: dict[str, Any] = {
             "model": self.model_id,
@@ -68,18 +549,42 @@ class LLMCaller:
         if self.api_url:
             call_args["api_base"] = self.api_url
 
-        if response_model is None:
-            # Raw-text path
-            resp: ModelResponse = completion(**call_args)  # type: ignore
-            # Extract the first choice's content
-            return resp.choices[0].message.content
+        def request(timeout: Optional[float]) -> Tuple[Any, Any, int]:
+            args = self._policy_args(call_args, timeout)
+            if response_model is None:
+                # Raw-text path
+                resp: ModelResponse = completion(**args)  # type: ignore
+                # Extract the first choice's content
+                return resp.choices[0].message.content, resp, 0
+
+            # Structured path
+            self._attempts.count = 0
+            parsed, raw = self.client.chat.completions.create_with_completion(
+                response_model=response_model,
+                **args  # type: ignore
+            )
+            # already parsed into a BaseModel subclass
+            return parsed, raw, max(0, self._attempts.count - 1)
 
-        # Structured path
-        resp = self.client.chat.completions.create(
-            response_model=response_model,
-            **call_args  # type: ignore
-        )
-        return resp  # already parsed into a BaseModel subclass
+        if self.policy is None:
+            result, raw, retries = request(None)
+        else:
+            kind = response_model.__name__ if response_model else "text"
+            result, raw, retries = self.policy.call(request, kind, s)
+        self._record_usage(s, raw)
+        if response_model is not None:
+            s.set(retries=retries)
+        return result
+
+    def _policy_args(self, call_args: dict[str, Any], timeout: Optional[float]) -> dict[str, Any]:
+        if self.policy is None:
+            return call_args
+        # Retries belong to the policy, so the provider client mustn't retry
+        # on its own (`num_retries` is litellm's name that instructor leaves alone)
+        args = {"num_retries": 0, **call_args}
+        if timeout is not None and "timeout" not in call_args:
+            args["timeout"] = timeout
+        return args
 
     def chat(
         self,
@@ -90,6 +595,29 @@ class LLMCaller:
         Another legacy path: calls the underlying `completion` and returns
         the full ModelResponse object.
         """
+        if self.cache is not None:
+            from litellm.types.utils import ModelResponse
+
+            key = self.cache.key(self.model_id, messages, None, kwargs, "chat")
+            try:
+                return ModelResponse(**self.cache.get(key))
+            except CacheMissError:
+                if self.cache.replay_only:
+                    raise
+
+        response = self._chat(messages, **kwargs)
+
+        if self.cache is not None:
+            self.cache.put(key, response.model_dump(mode="json"))
+        return response
+
+    def _chat(
+        self,
+        messages: List[Union[dict[str, str], Message]],
+        **kwargs
+    ) -> ModelResponse:
+        from litellm import completion
+
         call_args: dict[str, Any] = {
             "model": self.model_id,
             "messages": messages,
@@ -101,4 +629,8 @@ class LLMCaller:
         if self.api_url:
             call_args["api_base"] = self.api_url
 
-        return completion(**call_args)
+        if self.policy is None:
+            return completion(**call_args)
+        with span("llm.chat", model=self.model_id) as s:
+            return self.policy.call(
+                lambda timeout: completion(**self._policy_args(call_args, timeout)), "chat", s)
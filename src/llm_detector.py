@@ -1,19 +1,35 @@
+import hashlib
+from abc import ABC, abstractmethod
+import json
 from pydantic import BaseModel, Field
 from src.graph import RawEdge, Node, Edge
-from typing import List, TypeVar, Any, Union, TypedDict
-import base64
+from typing import TYPE_CHECKING, Callable, Dict, List, Tuple, TypeVar, Any, Union, TypedDict
 from PIL import Image
-import io
-from src.llm_caller import LLMCaller
-from src.yolo.yolo import Yolo
+from src.yolo.crop import Crop
+from src.image_encoding import EncodedImage, EncodingPolicy, PayloadCache, encode_image, image_digest
 from src.graph import Graph
+from src.crop_store import CropStore
+from src.job_store import JobStore
+from src.prompts import PromptTemplate, compiled, describe_response_type
+from src.utils.concurrency import map_ordered, run_stages
+from src.tracing import span
+
+if TYPE_CHECKING:
+    from src.llm_caller import LLMCaller
+    from src.yolo.boxes import BoxConsolidator, BoxReport
+    from src.yolo.yolo import Yolo
 
 
 class GraphImage(TypedDict):
-    image: Image.Image
+    # An EncodedImage when the crop was encoded ahead, e.g. in another process
+    image: Union[Image.Image, Crop, EncodedImage]
     id: str
     nodes: List[Node]
     edges: List[Edge]
+    # Filled from the crop store, no LLM call needed
+    stored: bool
+    # Stages completed, restored from the job store on resume
+    stages: List[str]
 
 
 class NodeResponse(BaseModel):
@@ -30,49 +46,43 @@ class EdgeResponse(BaseModel):
         description="Your answer as a valid JSON array containing only valid edges")
 
 
+class GraphResponse(BaseModel):
+    reasoning: str = Field(
+        description="A short reasoning to why the selected nodes and edges are valid")
+    nodes: List[str] = Field(
+        description="A list of strings of all detected nodes, using the node labels.")
+    edges: List[RawEdge] = Field(
+        description="A valid JSON array containing only valid edges between the detected nodes")
+
+
 ResponseType = TypeVar('ResponseType', bound=BaseModel)
 
 
 class BaseDetector:
-    def __init__(self, model: LLMCaller):
+    def __init__(self, model: "LLMCaller", policy: Union[EncodingPolicy, None] = None, payloads: Union[PayloadCache, None] = None):
         self.model = model
+        self.policy = policy or EncodingPolicy()
+        self.payloads = payloads
 
     def prepare_image_content(
         self,
-        image: Union[str, Image.Image],
-        mime_type: str = "image/png",
+        image: Union[str, Image.Image, Crop, EncodedImage],
+        mime_type: Union[str, None] = None,
     ) -> Any:
-        if isinstance(image, str):
-            with open(image, "rb") as f:
-                img_bytes = f.read()
-        elif isinstance(image, Image.Image):
-            buffered = io.BytesIO()
-            image.save(buffered, format=mime_type.split("/")[-1].upper())
-            img_bytes = buffered.getvalue()
-        else:
-            raise ValueError(
-                "Input must be a filepath (str) or PIL.Image.Image object."
-            )
-
-        base64_image = base64.b64encode(img_bytes).decode("utf-8")
-        return {
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:{mime_type};base64,{base64_image}",
-                "detail": "high",
-            },
-        }
+        if isinstance(image, dict):
+            return image["content"]
+        format = mime_type.split("/")[-1] if mime_type else None
+        if self.payloads is not None:
+            return self.payloads.encode(image, self.policy, format)["content"]
+        return encode_image(image, self.policy, format)["content"]
 
     def prepare_response_type(self, response_type: ResponseType):
-        return "\n".join(
-            f"{name} ({field.annotation.__name__}): {field.description or 'No description'}"
-            for name, field in response_type.model_fields.items()
-        )
+        return describe_response_type(response_type)
 
 
 class NodeDetector(BaseDetector):
-    def prepare_prompt(self):
-        prompt = f"""
+    def build_template(self) -> PromptTemplate:
+        return PromptTemplate(f"""
             Objective:
                 You are a highly intelligent AI specialized in image recognition and data transformation of legal structures. 
                 Your task is to analyze an input image containing flowchart elements and extract all **nodes (legal entities)** from it. 
@@ -87,9 +97,10 @@ class NodeDetector(BaseDetector):
 
             Output:
                 {self.prepare_response_type(NodeResponse)}    
-        """
+        """)
 
-        return {"type": "text", "text": prompt}
+    def prepare_prompt(self):
+        return compiled((type(self), NodeResponse), self.build_template).part()
 
     def invoke(self, image: Image.Image):
         return self.model.invoke(messages=[{
@@ -100,10 +111,13 @@ class NodeDetector(BaseDetector):
 
 
 class EdgeDetector(BaseDetector):
-    def prepare_prompt(self, nodes: List[str]):
-        prompt = ""
-        if len(nodes) == 0:
-            prompt = f"""
+    def build_template(self, with_nodes: bool) -> PromptTemplate:
+        if not with_nodes:
+            #   Instructions:
+            # - For each connection (line/arrow) between nodes in the image:
+            # - Identify the connected nodes using their labels.
+            # - Ensure output is valid JSON and contains only **edge objects** (no nodes).
+            return PromptTemplate(f"""
             Objective:
                 You are a highly intelligent AI specialized in image recognition and data transformation of legal structures. 
                 Your task is to analyze an input image containing flowchart elements and extract all **edges (relationships between nodes)** from it. 
@@ -117,25 +131,20 @@ class EdgeDetector(BaseDetector):
 
             Output:
                 {self.prepare_response_type(EdgeResponse)}
-            """
-
-            #   Instructions:
-            # - For each connection (line/arrow) between nodes in the image:
-            # - Identify the connected nodes using their labels.
-            # - Ensure output is valid JSON and contains only **edge objects** (no nodes).
-        else:
-            prompt = f"""
+            """)
+
+        #         Instructions:
+        # - For each connection (line/arrow) between nodes in the image:
+        # - Identify the connected nodes using their labels.
+        # - Match source and target by their node labels from the input list.
+        # - Ensure output is valid JSON and contains only **edge objects** (no nodes).
+        # The node list changes per crop, so it goes after the static part
+        return PromptTemplate(f"""
             Objective:
                 You are a highly intelligent AI specialized in image recognition and data transformation of legal structures. 
                 Your task is to analyze an input image containing flowchart elements and extract all **edges (relationships between nodes)** from it. 
                 Your output must be a structured JSON array containing only the edges, compatible with the diagramming application format.
                 
-            Input Details:
-                You are provided with all **pre-detected nodes** (entities), listed below:
-                {nodes}
-
-                The nodes' labels has no semantic meaning and therefore the labels do not have a relation to each other. 
-
             Image Content:
                 Edges describe relationships and are represented as lines/arrows between nodes.
                 The image is part of a larger flowchart, which means that partial connections may appear.
@@ -143,15 +152,19 @@ class EdgeDetector(BaseDetector):
 
             Output:
                 {self.prepare_response_type(EdgeResponse)}
-            """
+            """, """
+            Input Details:
+                You are provided with all **pre-detected nodes** (entities), listed below:
+                {nodes}
 
-            #         Instructions:
-            # - For each connection (line/arrow) between nodes in the image:
-            # - Identify the connected nodes using their labels.
-            # - Match source and target by their node labels from the input list.
-            # - Ensure output is valid JSON and contains only **edge objects** (no nodes).
+                The nodes' labels has no semantic meaning and therefore the labels do not have a relation to each other. 
+            """)
 
-        return {"type": "text", "text": prompt}
+    def prepare_prompt(self, nodes: List[str]):
+        with_nodes = len(nodes) > 0
+        template = compiled((type(self), EdgeResponse, with_nodes),
+                            lambda: self.build_template(with_nodes))
+        return template.part(nodes=nodes)
 
     def invoke(self, image: Image.Image, nodes: List[Node]):
         return self.model.invoke(messages=[{
@@ -160,49 +173,286 @@ class EdgeDetector(BaseDetector):
         }], response_model=EdgeResponse)
 
 
-class Detector:
+class GraphDetector(BaseDetector):
+    """Nodes and edges of a crop in one call, so the image is sent once."""
+
+    def build_template(self) -> PromptTemplate:
+        return PromptTemplate(f"""
+            Objective:
+                You are a highly intelligent AI specialized in image recognition and data transformation of legal structures. 
+                Your task is to analyze an input image containing flowchart elements and extract all **nodes (legal entities)** and all **edges (relationships between nodes)** from it. 
+                First list every node, then the edges between them, using exactly the node labels from your list as source and target.
+
+            Image Content:
+                Nodes may include shapes, text, or small illustrations.
+                Edges describe relationships and are represented as lines/arrows between nodes.
+                The image is part of a larger flowchart, which means that partial connections may appear.
+                The nodes' labels has no semantic meaning and therefore the labels do not have a relation to each other. 
+
+            Output:
+                {self.prepare_response_type(GraphResponse)}
+        """)
+
+    def prepare_prompt(self):
+        return compiled((type(self), GraphResponse), self.build_template).part()
+
+    def invoke(self, image: Image.Image):
+        return self.model.invoke(messages=[{
+            "role": "user",
+            "content": [self.prepare_prompt(), self.prepare_image_content(image)]
+        }], response_model=GraphResponse)
+
+
+class ResumableDetector(ABC):
+    """
+    Crop handling shared by `Detector` and `MermaidDetector`: YOLO crops (or
+    the whole image), the crop store, and per-stage checkpoints in the job
+    store, so a rerun resumes every crop after its last finished stage.
+
+    Subclasses list their per-crop `STAGES` in order, the `run()` options
+    with their defaults in `RUN_OPTIONS`, and what a crop's detected state is
+    (`crop_state` / `restore_state`).
+    """
     graph_images: List[GraphImage] = []
+    STAGES: Tuple[str, ...] = ()
+    RUN_OPTIONS: Dict[str, Any] = {}
+    # Bump when a prompt changes, so checkpoints of the old prompts are not resumed
+    PROMPT_VERSION = 1
 
-    def __init__(self, model: LLMCaller, yolo: Yolo):
-        self.edge_detector = EdgeDetector(model)
-        self.node_detector = NodeDetector(model)
+    def __init__(self, model: "LLMCaller", yolo: "Yolo", max_workers: int = 8, timeout: Union[float, None] = None, policy: Union[EncodingPolicy, None] = None, store: Union[CropStore, None] = None, boxes: Union["BoxConsolidator", None] = None, jobs: Union[JobStore, None] = None, resolve_entities: bool = False):
+        self.model = model
+        # The detectors of every stage send the same crops, encode them once
+        self.payloads = PayloadCache()
+        self.policy = policy
         self.yolo = yolo
-
-    def initiate_image(self, file: str, should_crop: bool = True):
+        # Crops of one image are sent concurrently, `timeout` is per call
+        self.max_workers = max_workers
+        self.timeout = timeout
+        # Results of crops seen before skip the LLM
+        self.store = store
+        # Merges overlapping/nested YOLO boxes so they cost one crop
+        self.boxes = boxes
+        self.box_report: Union["BoxReport", None] = None
+        # Checkpoints every crop after every stage, a rerun resumes from them
+        self.jobs = jobs
+        self.job: Union[str, None] = None
+        self.job_options: Dict[str, Any] = {}
+        # Merges near-duplicate nodes of overlapping crops in `get_graph()`
+        self.resolve_entities = resolve_entities
+
+    def initiate_image(self, file: str, should_crop: bool = True, **options):
+        """
+        Crops `file` and restores what earlier runs already detected. With a
+        job store, `options` are the `run()` options the image will be run with.
+        """
         filename = file.split("/")[-1]
+        if self.jobs is not None:
+            self.start_job(file, should_crop, **options)
         if should_crop:
-            self.yolo.predict(file)
-            bboxes = self.yolo.getBBoxes()
-            images = self.yolo.cropImages(bboxes)
-            print(f"totale images: {len(images)}")
+            bboxes = self.jobs.detections(self.job) if self.jobs is not None else None
+            if bboxes is None:
+                self.yolo.predict(file)
+                bboxes = self.yolo.getBBoxes()
+                if self.boxes is not None:
+                    bboxes, self.box_report = self.boxes.consolidate(bboxes)
+                if self.jobs is not None:
+                    self.jobs.save_detections(self.job, bboxes)
+            images = self.yolo.crops(bboxes, file)
             self.graph_images = [{"mermaid": "", "id": filename + str(
-                index), "image": image, "nodes": [], "edges": []} for index, image in enumerate(images)]
+                index), "image": image, "nodes": [], "edges": [], "stored": False, "stages": []} for index, image in enumerate(images)]
         else:
             image = Image.open(file)
             self.graph_images = [
-                {"image": image, "id": filename, "mermaid": "", "nodes": [], "edges": []}]
+                {"image": image, "id": filename, "mermaid": "", "nodes": [], "edges": [], "stored": False, "stages": []}]
 
-    def detect_nodes(self):
+        self.resume()
+        self.restore_stored()
+        self.payloads.prefetch([graph_image["image"] for graph_image in self.graph_images
+                                if not self.done(graph_image, self.STAGES[-1])], self.policy, self.max_workers)
+
+    def run_options(self, **options) -> Dict[str, Any]:
+        unknown = set(options) - set(self.RUN_OPTIONS)
+        if unknown:
+            raise TypeError(f"unknown run options: {sorted(unknown)}")
+        return {**self.RUN_OPTIONS, **options}
+
+    def job_key(self, file: str, should_crop: bool, **options) -> str:
+        """
+        One job per image and run configuration: checkpoints made with another
+        detector, model, prompt version or `run()` options are never reused.
+        """
+        config = json.dumps({
+            "crop": should_crop,
+            "model": getattr(self.model, "model_id", type(self.model).__name__),
+            "prompts": self.PROMPT_VERSION,
+            **self.run_options(**options),
+        }, sort_keys=True)
+        digest = hashlib.sha256(config.encode("utf-8")).hexdigest()[:16]
+        return f"{type(self).__name__}:{digest}:{image_digest(file)}"
+
+    def start_job(self, file: str, should_crop: bool, **options):
+        self.job = self.job_key(file, should_crop, **options)
+        self.job_options = self.run_options(**options)
+        if self.jobs is not None:
+            self.jobs.start(self.job, file)
+
+    def check_job(self, **options):
+        """Refuses to run the current job with other options than it was started with."""
+        if self.job is not None and self.run_options(**options) != self.job_options:
+            raise ValueError(
+                f"run options {self.run_options(**options)} differ from the job's {self.job_options}")
+
+    def complete_job(self):
+        """Marks the job complete once every crop has passed the last stage."""
+        if self.jobs is not None and self.job is not None and \
+                all(self.done(graph_image, self.STAGES[-1]) for graph_image in self.graph_images):
+            self.jobs.complete(self.job)
+
+    def resume(self):
+        """Restores the crops of the current job from their last checkpoint."""
+        if self.jobs is None or self.job is None:
+            return
+        checkpoints = self.jobs.crops(self.job)
         for graph_image in self.graph_images:
+            checkpoint = checkpoints.get(graph_image["id"])
+            if checkpoint is not None:
+                self.restore_state(graph_image, checkpoint["state"])
+                graph_image["stages"] = checkpoint["stages"]
+
+    def done(self, graph_image: GraphImage, stage: str) -> bool:
+        """Whether `stage`, or a later one, already ran for the crop."""
+        if graph_image["stored"]:
+            return True
+        index = self.STAGES.index(stage)
+        return any(self.STAGES.index(done) >= index for done in graph_image["stages"])
+
+    def checkpoint(self, graph_image: GraphImage, stage: str):
+        graph_image["stages"].append(stage)
+        if self.jobs is not None and self.job is not None:
+            box = list(graph_image["image"].box) if isinstance(graph_image["image"], Crop) else None
+            self.jobs.checkpoint(self.job, graph_image["id"], stage, self.crop_state(graph_image), box)
+
+    def restore_stored(self):
+        """Fills the crops the store has seen before; they skip every LLM stage."""
+        if self.store is None:
+            return
+        with span("crop_store.lookup", crops=len(self.graph_images)) as s:
+            for graph_image in self.graph_images:
+                value = self.store.get(graph_image["image"])
+                if value is not None:
+                    self.restore_state(graph_image, value)
+                    graph_image["stored"] = True
+            s.set(hits=sum(graph_image["stored"] for graph_image in self.graph_images))
+
+    def remember(self, graph_image: GraphImage):
+        if self.store is not None:
+            self.store.put(graph_image["image"], self.crop_state(graph_image))
+
+    @abstractmethod
+    def crop_state(self, graph_image: GraphImage) -> dict:
+        """The detected part of a crop as plain JSON, for the crop and job stores."""
+
+    @abstractmethod
+    def restore_state(self, graph_image: GraphImage, state: dict):
+        """Puts a state from `crop_state` back on the crop."""
+
+
+class Detector(ResumableDetector):
+    # Per-crop stages in order; the joint call completes "edges" directly
+    STAGES = ("nodes", "edges")
+    RUN_OPTIONS = {"with_nodes": True, "joint": False}
+
+    def __init__(self, model: "LLMCaller", yolo: "Yolo", max_workers: int = 8, timeout: Union[float, None] = None, policy: Union[EncodingPolicy, None] = None, store: Union[CropStore, None] = None, boxes: Union["BoxConsolidator", None] = None, jobs: Union[JobStore, None] = None, resolve_entities: bool = False):
+        super().__init__(model, yolo, max_workers, timeout, policy, store, boxes, jobs, resolve_entities)
+        self.edge_detector = EdgeDetector(model, policy, self.payloads)
+        self.node_detector = NodeDetector(model, policy, self.payloads)
+        self.graph_detector = GraphDetector(model, policy, self.payloads)
+
+    def crop_state(self, graph_image: GraphImage) -> dict:
+        return {
+            "nodes": [node.id for node in graph_image["nodes"]],
+            "edges": [[edge.source, edge.target] for edge in graph_image["edges"]],
+        }
+
+    def restore_state(self, graph_image: GraphImage, state: dict):
+        graph_image["nodes"] = [Node(label) for label in state["nodes"]]
+        graph_image["edges"] = [Edge(source, target) for source, target in state["edges"]]
+
+    def detect_nodes_for(self, graph_image: GraphImage):
+        if self.done(graph_image, "nodes"):
+            return
+        with span("detect.nodes", crop_id=graph_image["id"]) as s:
             response = self.node_detector.invoke(graph_image["image"])
             graph_image["nodes"] = [Node(label) for label in response.answer]
+            s.set(nodes=len(graph_image["nodes"]))
+        self.checkpoint(graph_image, "nodes")
 
-    def detect_edges(self):
-        for graph_image in self.graph_images:
+    def detect_edges_for(self, graph_image: GraphImage):
+        if self.done(graph_image, "edges"):
+            return
+        with span("detect.edges", crop_id=graph_image["id"]) as s:
             response = self.edge_detector.invoke(
                 graph_image["image"], graph_image["nodes"])
             graph_image["edges"] = [
                 Edge(edge["source"], edge["target"]) for edge in response.answer]
+            s.set(edges=len(graph_image["edges"]))
+        self.checkpoint(graph_image, "edges")
+        self.remember(graph_image)
+
+    def detect_graph_for(self, graph_image: GraphImage):
+        if self.done(graph_image, "edges"):
+            return
+        with span("detect.graph", crop_id=graph_image["id"]) as s:
+            response = self.graph_detector.invoke(graph_image["image"])
+            graph_image["nodes"] = [Node(label) for label in response.nodes]
+            graph_image["edges"] = [
+                Edge(edge["source"], edge["target"]) for edge in response.edges]
+            s.set(nodes=len(graph_image["nodes"]), edges=len(graph_image["edges"]))
+        self.checkpoint(graph_image, "edges")
+        self.remember(graph_image)
 
-    def get_graph(self):
-        all_nodes = []
-        all_edges = []
-        for graph_image in self.graph_images:
-            all_nodes.extend(graph_image["nodes"])
-            all_edges.extend(graph_image["edges"])
-        graph = Graph(all_edges, all_nodes)
+    def detect_nodes(self):
+        map_ordered(self.detect_nodes_for, self.graph_images,
+                    self.max_workers, self.timeout)
+
+    def detect_edges(self):
+        map_ordered(self.detect_edges_for, self.graph_images,
+                    self.max_workers, self.timeout)
+        self.complete_job()
+
+    def detect_graph(self):
+        """Joint mode: nodes and edges of every crop from a single call each."""
+        map_ordered(self.detect_graph_for, self.graph_images,
+                    self.max_workers, self.timeout)
+        self.complete_job()
+
+    def run(self, with_nodes: bool = True, on_crop_done: Union[Callable[[GraphImage], None], None] = None, joint: bool = False):
+        """
+        Run the detection stages per crop instead of stage by stage: a crop
+        moves on to edge detection as soon as its own nodes are back.
+        `on_crop_done` is called with each finished crop, e.g. to assemble
+        `get_graph()` progressively. With `joint`, nodes and edges come from
+        one call per crop and `with_nodes` is ignored.
+        """
+        self.check_job(with_nodes=with_nodes, joint=joint)
+        if joint:
+            stages = [self.detect_graph_for]
+        else:
+            stages = [self.detect_nodes_for] if with_nodes else []
+            stages.append(self.detect_edges_for)
 
-        if (len(graph.nodes) == 0):
-            graph.nodes = graph.create_nodes_from_edges(graph.edges)
+        def on_item_done(index: int, graph_image: GraphImage, results: list):
+            if on_crop_done:
+                on_crop_done(graph_image)
 
+        run_stages(self.graph_images, stages, self.max_workers,
+                   self.timeout, on_item_done)
+        self.complete_job()
+
+    def get_graph(self):
+        graph = Graph.merge(
+            (edge for graph_image in self.graph_images for edge in graph_image["edges"]),
+            (node for graph_image in self.graph_images for node in graph_image["nodes"]))
+        if self.resolve_entities:
+            graph.resolve_entities()
         return graph
@@ -1,21 +1,35 @@
 from pydantic import BaseModel, Field
-from src.graph import RawEdge, Node, Edge
-from typing import List, TypeVar, Any, Union, TypedDict
-import base64
+from src.graph import Edge
+from typing import TYPE_CHECKING, Callable, List, TypeVar, Union, TypedDict
 from PIL import Image
-import io
-from src.llm_caller import LLMCaller
-from src.yolo.yolo import Yolo
+from src.yolo.crop import Crop
+from src.llm_detector import BaseDetector, ResumableDetector
+from src.image_encoding import EncodedImage, EncodingPolicy
 from src.graph import Graph
+from src.crop_store import CropStore
+from src.job_store import JobStore
+from src.prompts import PromptTemplate, compiled
+from src.utils.concurrency import map_ordered, run_stages
+from src.tracing import span
 from src.mermaid_to_json import MermaidToJSON
 
+if TYPE_CHECKING:
+    from src.llm_caller import LLMCaller
+    from src.yolo.boxes import BoxConsolidator
+    from src.yolo.yolo import Yolo
+
 
 class GraphImage(TypedDict):
-    image: Image.Image
+    # An EncodedImage when the crop was encoded ahead, e.g. in another process
+    image: Union[Image.Image, Crop, EncodedImage]
     id: str
     nodes: List[str]
     mermaid: str
     edges: List[Edge]
+    # Filled from the crop store, no LLM call needed
+    stored: bool
+    # Stages completed, restored from the job store on resume
+    stages: List[str]
 
 
 class NodeResponse(BaseModel):
@@ -32,49 +46,34 @@ class EdgeResponse(BaseModel):
         description="Your answer as a mermaid diagram")
 
 
-ResponseType = TypeVar('ResponseType', bound=BaseModel)
+class DiagramResponse(BaseModel):
+    reasoning: str = Field(
+        description="A short reasoning to why the answer is in correct mermaid diagram format")
+    nodes: List[str] = Field(
+        description="A list of strings of detected nodes as mermaid nodes. Example: [Person[\"person\"], CompanyOwner[\"Company Owner\"]]")
+    answer: str = Field(
+        description="Your answer as a mermaid diagram that declares all of the nodes above before the edges")
 
 
-class BaseDetector:
-    def __init__(self, model: LLMCaller):
-        self.model = model
-
-    def prepare_image_content(
-        self,
-        image: Union[str, Image.Image],
-        mime_type: str = "image/png",
-    ) -> Any:
-        if isinstance(image, str):
-            with open(image, "rb") as f:
-                img_bytes = f.read()
-        elif isinstance(image, Image.Image):
-            buffered = io.BytesIO()
-            image.save(buffered, format=mime_type.split("/")[-1].upper())
-            img_bytes = buffered.getvalue()
-        else:
-            raise ValueError(
-                "Input must be a filepath (str) or PIL.Image.Image object."
-            )
+ResponseType = TypeVar('ResponseType', bound=BaseModel)
 
-        base64_image = base64.b64encode(img_bytes).decode("utf-8")
-        return {
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:{mime_type};base64,{base64_image}",
-                "detail": "high",
-            },
-        }
+MERMAID_EXAMPLE = """
+        graph TD
+            A["A"]
+            B["B"]
+            B_sub["B Sub"]
+            C["C"]
+            C_sub["C Sub"]
 
-    def prepare_response_type(self, response_type: ResponseType):
-        return "\n".join(
-            f"{name} ({field.annotation.__name__}): {field.description or 'No description'}"
-            for name, field in response_type.model_fields.items()
-        )
+            A --> B
+            A --> C
+            B --> B_sub
+            C --> C_sub"""
 
 
 class NodeDetector(BaseDetector):
-    def prepare_prompt(self):
-        prompt = f"""
+    def build_template(self) -> PromptTemplate:
+        return PromptTemplate(f"""
             Objective:
                 You are a highly intelligent AI specialized in image recognition and data transformation of legal structures. 
                 Your task is to analyze an input image containing flowchart elements and extract all **nodes (legal entities)** from it. 
@@ -87,9 +86,10 @@ class NodeDetector(BaseDetector):
 
             Output:
                 {self.prepare_response_type(NodeResponse)}    
-        """
+        """)
 
-        return {"type": "text", "text": prompt}
+    def prepare_prompt(self):
+        return compiled((type(self), NodeResponse), self.build_template).part()
 
     def invoke(self, image: Image.Image):
         return self.model.invoke(messages=[{
@@ -101,18 +101,7 @@ class NodeDetector(BaseDetector):
 
 class EdgeDetector(BaseDetector):
     def example(self):
-        return """
-        graph TD
-            A["A"]
-            B["B"]
-            B_sub["B Sub"]
-            C["C"]
-            C_sub["C Sub"]
-
-            A --> B
-            A --> C
-            B --> B_sub
-            C --> C_sub"""
+        return MERMAID_EXAMPLE
 
     def output(self, response_type: Union[EdgeResponse, None]):
         if (response_type == None):
@@ -133,12 +122,9 @@ class EdgeDetector(BaseDetector):
                     {self.example()}
                 """
 
-    def prepare_prompt(self, nodes: List[str], response_model: Union[EdgeResponse, None]):
-
-        prompt = ""
-
-        if len(nodes) == 0:
-            prompt = f"""
+    def build_template(self, with_nodes: bool, response_model: Union[EdgeResponse, None]) -> PromptTemplate:
+        if not with_nodes:
+            return PromptTemplate(f"""
             Objective:
                 You are a highly intelligent AI specialized in image recognition and data transformation of legal structures. 
                 Your task is to analyze an input image containing flowchart elements and cunstruct a mermaid diagram.
@@ -149,28 +135,33 @@ class EdgeDetector(BaseDetector):
                 The nodes' labels has no semantic meaning and therefore the labels do not have a relation to each other. 
 
             {self.output(response_model)}
-            """
-        else:
-            prompt = f"""
+            """)
+
+        # The node list changes per crop, so it goes after the static part
+        return PromptTemplate(f"""
             Objective:
                 You are a highly intelligent AI specialized in image recognition and data transformation of legal structures. 
                 Your task is to analyze an input image containing flowchart elements and create a mermaid diagram.
                 You should use the provided **pre-detected nodes** to build the mermaid diagram. 
                 The mermaid diagram should be one whole diagram (no subgroups).
                 
+            Image Content:
+                Edges describe relationships and are represented as lines/arrows between nodes.
+
+            {self.output(response_model)}
+            """, """
             Input Details:
                 You are provided with all **pre-detected nodes** (entities), listed below:
                 {nodes}
 
                 The nodes' labels has no semantic meaning and therefore the labels do not have a relation to each other. 
+            """)
 
-            Image Content:
-                Edges describe relationships and are represented as lines/arrows between nodes.
-
-            {self.output(response_model)}
-            """
-
-        return {"type": "text", "text": prompt}
+    def prepare_prompt(self, nodes: List[str], response_model: Union[EdgeResponse, None]):
+        with_nodes = len(nodes) > 0
+        template = compiled((type(self), response_model, with_nodes),
+                            lambda: self.build_template(with_nodes, response_model))
+        return template.part(nodes=nodes)
 
     def invoke(self, image: Image.Image, nodes: List[str], use_pydantric: bool):
         if use_pydantric:
@@ -184,55 +175,148 @@ class EdgeDetector(BaseDetector):
         }], response_model=response_model)
 
 
-class MermaidDetector:
-    graph_images: List[GraphImage] = []
+class DiagramDetector(BaseDetector):
+    """Node declarations and the full mermaid diagram in one call, so the image is sent once."""
+
+    def build_template(self) -> PromptTemplate:
+        return PromptTemplate(f"""
+            Objective:
+                You are a highly intelligent AI specialized in image recognition and data transformation of legal structures. 
+                Your task is to analyze an input image containing flowchart elements and create a mermaid diagram.
+                First list every **node (legal entity)** as a mermaid node, then build the diagram from exactly these nodes.
+                The mermaid diagram should be one whole diagram (no subgroups).
+
+            Image Content:
+                Nodes may include shapes, text, or small illustrations.
+                Edges describe relationships and are represented as lines/arrows between nodes.
+                The nodes' labels has no semantic meaning and therefore the labels do not have a relation to each other. 
+
+            Output:
+                {self.prepare_response_type(DiagramResponse)}
+
+            Example:
+                {MERMAID_EXAMPLE}
+        """)
+
+    def prepare_prompt(self):
+        return compiled((type(self), DiagramResponse), self.build_template).part()
+
+    def invoke(self, image: Image.Image):
+        return self.model.invoke(messages=[{
+            "role": "user",
+            "content": [self.prepare_prompt(), self.prepare_image_content(image)]
+        }], response_model=DiagramResponse)
+
+
+class MermaidDetector(ResumableDetector):
+    # Per-crop stages in order; the joint call completes "mermaid" directly
+    STAGES = ("nodes", "mermaid", "edges")
+    RUN_OPTIONS = {"with_nodes": True, "use_pydantric": True, "joint": False}
 
-    def __init__(self, model: LLMCaller, yolo: Yolo, serializer: MermaidToJSON):
-        self.edge_detector = EdgeDetector(model)
-        self.node_detector = NodeDetector(model)
-        self.yolo = yolo
+    def __init__(self, model: "LLMCaller", yolo: "Yolo", serializer: MermaidToJSON, max_workers: int = 8, timeout: Union[float, None] = None, policy: Union[EncodingPolicy, None] = None, store: Union[CropStore, None] = None, boxes: Union["BoxConsolidator", None] = None, jobs: Union[JobStore, None] = None, resolve_entities: bool = False):
+        super().__init__(model, yolo, max_workers, timeout, policy, store, boxes, jobs, resolve_entities)
+        self.edge_detector = EdgeDetector(model, policy, self.payloads)
+        self.node_detector = NodeDetector(model, policy, self.payloads)
+        self.diagram_detector = DiagramDetector(model, policy, self.payloads)
         self.serializer = serializer
 
-    def initiate_image(self, file: str, should_crop: bool = True):
-        filename = file.split("/")[-1]
-        if should_crop:
-            self.yolo.predict(file)
-            bboxes = self.yolo.getBBoxes()
-            images = self.yolo.cropImages(bboxes)
-            print(f"totale images: {len(images)}")
-            self.graph_images = [{"mermaid": "", "id": filename + str(
-                index), "image": image, "nodes": [], "edges": []} for index, image in enumerate(images)]
-        else:
-            image = Image.open(file)
-            self.graph_images = [
-                {"image": image, "id": filename, "mermaid": "", "nodes": [], "edges": []}]
+    def crop_state(self, graph_image: GraphImage) -> dict:
+        return {
+            "nodes": graph_image["nodes"],
+            "mermaid": graph_image["mermaid"],
+            "edges": [[edge.source, edge.target] for edge in graph_image["edges"]],
+        }
 
-    def detect_nodes(self):
-        for graph_image in self.graph_images:
+    def restore_state(self, graph_image: GraphImage, state: dict):
+        graph_image["nodes"] = state["nodes"]
+        graph_image["mermaid"] = state["mermaid"]
+        graph_image["edges"] = [Edge(source, target) for source, target in state["edges"]]
+
+    def detect_nodes_for(self, graph_image: GraphImage):
+        if self.done(graph_image, "nodes"):
+            return
+        with span("detect.nodes", crop_id=graph_image["id"]) as s:
             response = self.node_detector.invoke(graph_image["image"])
             graph_image["nodes"] = response.answer
+            s.set(nodes=len(graph_image["nodes"]))
+        self.checkpoint(graph_image, "nodes")
 
-    def detect_edges(self, use_pydantric=True):
-        for graph_image in self.graph_images:
+    def detect_edges_for(self, graph_image: GraphImage, use_pydantric=True):
+        if self.done(graph_image, "mermaid"):
+            return
+        with span("detect.mermaid", crop_id=graph_image["id"]):
             response = self.edge_detector.invoke(
                 graph_image["image"], graph_image["nodes"], use_pydantric)
             if type(response) == str:
                 graph_image["mermaid"] = response
             else:
                 graph_image["mermaid"] = response.answer
+        self.checkpoint(graph_image, "mermaid")
+
+    def detect_diagram_for(self, graph_image: GraphImage):
+        if self.done(graph_image, "mermaid"):
+            return
+        with span("detect.diagram", crop_id=graph_image["id"]) as s:
+            response = self.diagram_detector.invoke(graph_image["image"])
+            graph_image["nodes"] = response.nodes
+            graph_image["mermaid"] = response.answer
+            s.set(nodes=len(graph_image["nodes"]))
+        self.checkpoint(graph_image, "mermaid")
+
+    def convert_edges_for(self, graph_image: GraphImage):
+        if self.done(graph_image, "edges"):
+            return
+        with span("convert.edges", crop_id=graph_image["id"]):
+            graph_image["edges"] = self.serializer.convert(graph_image["mermaid"])
+        self.checkpoint(graph_image, "edges")
+        self.remember(graph_image)
+
+    def detect_nodes(self):
+        map_ordered(self.detect_nodes_for, self.graph_images,
+                    self.max_workers, self.timeout)
+
+    def detect_edges(self, use_pydantric=True):
+        map_ordered(lambda graph_image: self.detect_edges_for(graph_image, use_pydantric),
+                    self.graph_images, self.max_workers, self.timeout)
+
+    def detect_diagram(self):
+        """Joint mode: nodes and mermaid diagram of every crop from a single call each."""
+        map_ordered(self.detect_diagram_for, self.graph_images,
+                    self.max_workers, self.timeout)
 
     def convert_edges(self):
-        for graph_image in self.graph_images:
-            graph_image["edges"] = self.serializer.convert(
-                graph_image["mermaid"])
+        map_ordered(self.convert_edges_for, self.graph_images,
+                    self.max_workers, self.timeout)
+        self.complete_job()
 
-    def get_graph(self):
+    def run(self, with_nodes: bool = True, use_pydantric=True, on_crop_done: Union[Callable[[GraphImage], None], None] = None, joint: bool = False):
+        """
+        Run the detection stages per crop instead of stage by stage: a crop
+        moves on to the mermaid diagram as soon as its own nodes are back, and
+        is converted as soon as its diagram arrives. `on_crop_done` is called
+        with each finished crop, e.g. to assemble `get_graph()` progressively.
+        With `joint`, nodes and diagram come from one call per crop and
+        `with_nodes`/`use_pydantric` are ignored.
+        """
+        self.check_job(with_nodes=with_nodes, use_pydantric=use_pydantric, joint=joint)
+        if joint:
+            stages = [self.detect_diagram_for]
+        else:
+            stages = [self.detect_nodes_for] if with_nodes else []
+            stages.append(lambda graph_image: self.detect_edges_for(
+                graph_image, use_pydantric))
+        stages.append(self.convert_edges_for)
 
-        all_edges = []
-        for graph_image in self.graph_images:
-            all_edges.extend(graph_image["edges"])
+        def on_item_done(index: int, graph_image: GraphImage, results: list):
+            if on_crop_done:
+                on_crop_done(graph_image)
 
-        graph = Graph(all_edges, [])
-        graph.nodes = graph.unique(graph.create_nodes_from_edges(all_edges))
+        run_stages(self.graph_images, stages, self.max_workers,
+                   self.timeout, on_item_done)
+        self.complete_job()
 
+    def get_graph(self):
+        graph = Graph.merge(edge for graph_image in self.graph_images for edge in graph_image["edges"])
+        if self.resolve_entities:
+            graph.resolve_entities()
         return graph
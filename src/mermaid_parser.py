@@ -0,0 +1,139 @@
+import html
+import re
+from typing import Dict, List, Tuple
+
+from src.graph import Edge
+
+
+class MermaidParseError(ValueError):
+    """Raised when a diagram uses syntax outside the supported flowchart subset."""
+
+
+HEADER = re.compile(r"^(?:graph|flowchart)(?:\s+(?:TD|TB|BT|LR|RL))?\s*;?$", re.IGNORECASE)
+IGNORED = re.compile(
+    r"^(?:%%|subgraph\b|end\b|direction\b|classDef\b|class\b|style\b|linkStyle\b|click\b)")
+NODE_ID = re.compile(r"[\wÀ-￿]+(?:-(?=[\wÀ-￿])[\wÀ-￿]+)*")
+CLASS_SUFFIX = re.compile(r":::[\w-]+")
+# Longest openers first, so "((" wins over "("
+SHAPES = [("(((", ")))"), ("((", "))"), ("([", "])"), ("[[", "]]"), ("[(", ")]"),
+          ("{{", "}}"), ("[/", "/]"), ("[/", "\\]"), ("[\\", "\\]"), ("[\\", "/]"),
+          ("[", "]"), ("(", ")"), ("{", "}"), (">", "]")]
+LINK = re.compile(r"""\s*(?:
+    (?:<|[ox])?(?:--|==|-\.)\s+[^|\s][^|]*?\s+(?:-{2,}>|-{3,}|={2,}>|={3,}|\.-+>|\.-+|-{2,}[ox]|={2,}[ox])
+  | (?:<|[ox])?(?:-{2,}>|-{3,}|={2,}>|={3,}|-\.+->|-\.+-|-{2,}[ox]|={2,}[ox]|~{3,})
+)\s*(?:\|[^|]*\|)?\s*""", re.VERBOSE)
+AMPERSAND = re.compile(r"\s*&\s*")
+
+
+def split_statements(line: str) -> List[str]:
+    """Split on `;` outside of quotes and node shapes."""
+    statements, current, depth, quoted = [], [], 0, False
+    for char in line:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char in "[({":
+            depth += 1
+        elif not quoted and char in "])}":
+            depth = max(0, depth - 1)
+        elif char == ";" and not quoted and depth == 0:
+            statements.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    statements.append("".join(current))
+    return statements
+
+
+def clean_label(label: str) -> str:
+    label = label.strip()
+    if len(label) >= 2 and label[0] == label[-1] and label[0] in "\"'`":
+        label = label[1:-1]
+    label = re.sub(r"<br\s*/?>", " ", label, flags=re.IGNORECASE)
+    label = re.sub(r"#(\w+);", r"&\1;", label)  # mermaid entity codes
+    return re.sub(r"\s+", " ", html.unescape(label)).strip()
+
+
+class MermaidParser:
+    """
+    Line-by-line parser for the flowchart subset our detectors produce:
+    `graph`/`flowchart` headers, node declarations with labels, plain and
+    labelled links (`-->`, `---`, `-.->`, `==>`, `-- text -->`, `-->|text|`),
+    chains (`A --> B --> C`) and `&` groups. Nodes may be declared after they
+    are used, so edges are resolved to labels when `edges` is called.
+    """
+
+    def __init__(self):
+        self.labels: Dict[str, str] = {}
+        self.links: List[Tuple[str, str]] = []
+        self.line_number = 0
+
+    def feed(self, line: str) -> None:
+        self.line_number += 1
+        for statement in split_statements(line):
+            statement = statement.strip()
+            if not statement or statement.startswith("```") or HEADER.match(statement) or IGNORED.match(statement):
+                continue
+            self._statement(statement)
+
+    def _node(self, text: str, pos: int) -> Tuple[str, int]:
+        match = NODE_ID.match(text, pos)
+        if not match:
+            raise MermaidParseError(
+                f"line {self.line_number}: expected a node at '{text[pos:]}'")
+        node_id, pos = match.group(), match.end()
+
+        for opener, closer in SHAPES:
+            if not text.startswith(opener, pos):
+                continue
+            start = pos + len(opener)
+            if text.startswith('"', start):
+                quote_end = text.find('"', start + 1)
+                end = text.find(closer, quote_end + 1) if quote_end != -1 else -1
+            else:
+                end = text.find(closer, start)
+            if end == -1:
+                continue
+            self.labels[node_id] = clean_label(text[start:end])
+            pos = end + len(closer)
+            break
+
+        suffix = CLASS_SUFFIX.match(text, pos)
+        if suffix:
+            pos = suffix.end()
+        return node_id, pos
+
+    def _group(self, text: str, pos: int) -> Tuple[List[str], int]:
+        node_id, pos = self._node(text, pos)
+        group = [node_id]
+        while True:
+            amp = AMPERSAND.match(text, pos)
+            if not amp or amp.end() == pos:
+                return group, pos
+            node_id, pos = self._node(text, amp.end())
+            group.append(node_id)
+
+    def _statement(self, text: str) -> None:
+        sources, pos = self._group(text, 0)
+        while pos < len(text):
+            link = LINK.match(text, pos)
+            if not link or link.end() == pos:
+                raise MermaidParseError(
+                    f"line {self.line_number}: can't parse '{text[pos:]}'")
+            targets, pos = self._group(text, link.end())
+            self.links.extend((s, t) for s in sources for t in targets)
+            sources = targets
+        if text[pos:].strip():
+            raise MermaidParseError(
+                f"line {self.line_number}: trailing '{text[pos:]}'")
+
+    def edges(self) -> List[Edge]:
+        return [Edge(self.labels.get(source, source), self.labels.get(target, target))
+                for source, target in self.links]
+
+
+def parse_mermaid(diagram: str) -> List[Edge]:
+    """Parse a mermaid flowchart into edges between node labels."""
+    parser = MermaidParser()
+    for line in diagram.splitlines():
+        parser.feed(line)
+    return parser.edges()
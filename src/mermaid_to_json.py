@@ -1,17 +1,43 @@
 from src.llm_detector import BaseDetector, EdgeResponse, Edge
-from typing import List
+from src.mermaid_parser import MermaidParseError, parse_mermaid
+from src.prompts import PromptTemplate, compiled
+from src.tracing import span
+from typing import TYPE_CHECKING, List
+
+if TYPE_CHECKING:
+    from src.llm_caller import LLMCaller
 
 
 class MermaidToJSON(BaseDetector):
+    def __init__(self, model: "LLMCaller", local_first: bool = True):
+        super().__init__(model)
+        # Parse locally and only ask the LLM for syntax the parser doesn't know
+        self.local_first = local_first
+
     def convert(self, diagram: str):
+        with span("mermaid.convert", chars=len(diagram)) as s:
+            if self.local_first:
+                try:
+                    edges = parse_mermaid(diagram)
+                    s.set(parser="local", edges=len(edges))
+                    return edges
+                except MermaidParseError:
+                    pass
+
+            edges = self._convert_with_llm(diagram)
+            s.set(parser="llm", edges=len(edges))
+            return edges
+
+    def _convert_with_llm(self, diagram: str) -> List[Edge]:
+        system = compiled((type(self), EdgeResponse), lambda: PromptTemplate(
+            "You are an expert assistant that converts Mermaid diagram definitions "
+            "into a structured JSON representation."
+            f"Repond in the following format: {self.prepare_response_type(EdgeResponse)}"
+        ))
         messages = [
             {
                 "role": "system",
-                "content": (
-                    "You are an expert assistant that converts Mermaid diagram definitions "
-                    "into a structured JSON representation."
-                    f"Repond in the following format: {self.prepare_response_type(EdgeResponse)}"
-                )
+                "content": system.render()
             },
             {
                 "role": "user",
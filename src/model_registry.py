@@ -0,0 +1,91 @@
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from src.utils.path import from_root
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models.
+
+    A model is registered with a loader and an optional warm-up function and
+    is only loaded the first time `get` is called for it. Loading is guarded
+    by a per-model lock, so concurrent callers in one process share a single
+    instance and pay the weight-loading cost once.
+    """
+
+    def __init__(self):
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._warmups: Dict[str, Callable[[Any], None]] = {}
+        self._models: Dict[str, Any] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, loader: Callable[[], Any], warmup: Optional[Callable[[Any], None]] = None) -> None:
+        with self._lock:
+            self._loaders[name] = loader
+            self._locks[name] = threading.Lock()
+            if warmup:
+                self._warmups[name] = warmup
+            # A new loader replaces any instance loaded with the old one
+            self._models.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        if name not in self._loaders:
+            raise KeyError(f"No model registered under '{name}'")
+
+        with self._locks[name]:
+            if name not in self._models:
+                self._models[name] = self._loaders[name]()
+            return self._models[name]
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def warm_up(self, names: Optional[Iterable[str]] = None) -> None:
+        """Load the given models (all by default) and run one dummy inference."""
+        for name in names if names is not None else list(self._loaders):
+            model = self.get(name)
+            if name in self._warmups:
+                self._warmups[name](model)
+
+    def unload(self, name: str) -> None:
+        with self._lock:
+            self._models.pop(name, None)
+
+
+def _load_yolo():
+    from ultralytics import YOLO
+    return YOLO(from_root("models/yolo-trained.pt"))
+
+
+def _warm_up_yolo(model) -> None:
+    import numpy as np
+    model(np.full((640, 640, 3), 255, dtype=np.uint8), verbose=False)
+
+
+def _load_clip():
+    from transformers import CLIPModel, CLIPProcessor
+    model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
+    processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+    model.eval()
+    return model, processor
+
+
+def _warm_up_clip(clip) -> None:
+    import torch
+    from PIL import Image
+    model, processor = clip
+    inputs = processor(text=["a diagram"], images=Image.new("RGB", (224, 224), "white"),
+                       return_tensors="pt", padding=True)
+    with torch.no_grad():
+        model(**inputs)
+
+
+registry = ModelRegistry()
+registry.register("yolo", _load_yolo, _warm_up_yolo)
+registry.register("clip", _load_clip, _warm_up_clip)
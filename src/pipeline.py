@@ -0,0 +1,366 @@
+"""
+Converts a directory of diagram images into one JSON graph per image:
+classify -> YOLO -> crop -> detect -> graph -> export.
+
+The CPU-bound stages (decode, classify, YOLO, crop, encode) run in a process
+pool, `--chunk-size` images per task so CLIP and YOLO see whole batches. The
+LLM stages run from an asyncio loop, `--llm-workers` images at a time with
+up to `--crop-workers` calls each. A bounded queue between the two makes the
+process pool wait when the LLM side falls behind.
+
+    python -m src.pipeline archive/ out/ --model gpt-4o
+    python -m src.pipeline archive/ out/ --mermaid --joint --processes 4
+    python -m src.pipeline archive/ out/ --dry-run   # stub LLM, no provider
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TypedDict, Union
+
+from src.image_encoding import EncodedImage, EncodingPolicy, encode_image
+from src.job_store import JobStore
+from src.tracing import span
+from src.yolo.yolo import IMAGE_SUFFIXES
+
+
+class PipelineOptions:
+    """Settings shared by the parent and the worker processes, must stay picklable."""
+
+    def __init__(self, crop: bool = True, classify: bool = True, consolidate_boxes: bool = True,
+                 mermaid: bool = False, with_nodes: bool = True, joint: bool = False,
+                 chunk_size: int = 8, policy: Optional[EncodingPolicy] = None, resolve_entities: bool = True):
+        self.crop = crop
+        self.classify = classify
+        self.consolidate_boxes = consolidate_boxes
+        self.mermaid = mermaid
+        self.with_nodes = with_nodes
+        self.joint = joint
+        self.chunk_size = chunk_size
+        self.policy = policy
+        self.resolve_entities = resolve_entities
+
+
+class PreparedImage(TypedDict):
+    file: str
+    is_diagram: bool
+    confidence: float
+    crops: List[EncodedImage]
+    crops_removed: int
+    error: Optional[str]
+
+
+# State of a worker process, set up once by `_init_worker`
+_options: PipelineOptions
+_models: Dict[str, Any] = {}
+
+
+def _init_worker(options: PipelineOptions) -> None:
+    global _options
+    _options = options
+
+
+def _model(name: str) -> Any:
+    if name not in _models:
+        if name == "classifier":
+            from src.diagram_classifier import DiagramClassifier
+            _models[name] = DiagramClassifier(batch_size=_options.chunk_size)
+        elif name == "yolo":
+            from src.model_registry import registry
+            from src.yolo.yolo import Yolo
+            _models[name] = Yolo(registry.get("yolo"))
+        elif name == "boxes":
+            from src.yolo.boxes import BoxConsolidator
+            _models[name] = BoxConsolidator()
+    return _models[name]
+
+
+def _prepare(files: List[str]) -> List[PreparedImage]:
+    if _options.classify:
+        classifications = _model("classifier").classify(files)
+    else:
+        classifications = [{"is_diagram": True, "confidence": 1.0}] * len(files)
+
+    prepared: Dict[str, PreparedImage] = {
+        file: {"file": file, "is_diagram": classification["is_diagram"],
+               "confidence": classification["confidence"], "crops": [], "crops_removed": 0, "error": None}
+        for file, classification in zip(files, classifications)}
+    diagrams = [file for file in files if prepared[file]["is_diagram"]]
+
+    if not _options.crop:
+        for file in diagrams:
+            prepared[file]["crops"] = [encode_image(file, _options.policy)]
+        return [prepared[file] for file in files]
+
+    yolo = _model("yolo")
+    for file, detections in yolo.predict_batch(diagrams, batch_size=_options.chunk_size):
+        if _options.consolidate_boxes:
+            detections, report = _model("boxes").consolidate(detections)
+            prepared[file]["crops_removed"] = report["crops_removed"]
+        prepared[file]["crops"] = [encode_image(crop, _options.policy)
+                                   for crop in yolo.crops(detections)]
+    return [prepared[file] for file in files]
+
+
+def _failed(file: str, error: Exception) -> PreparedImage:
+    return {"file": file, "is_diagram": False, "confidence": 0.0, "crops": [],
+            "crops_removed": 0, "error": f"{type(error).__name__}: {error}"}
+
+
+def prepare_chunk(files: List[str]) -> List[PreparedImage]:
+    """
+    Worker task: classify, detect, crop and encode a chunk of images. A
+    failing chunk is retried image by image so one bad file only fails itself.
+    """
+    try:
+        return _prepare(files)
+    except Exception as e:
+        if len(files) == 1:
+            return [_failed(files[0], e)]
+    results = []
+    for file in files:
+        try:
+            results.extend(_prepare([file]))
+        except Exception as e:
+            results.append(_failed(file, e))
+    return results
+
+
+def list_images(inputs: Union[str, Iterable[str]]) -> Iterator[str]:
+    """The image files of a directory (sorted) or an iterable of paths, lazily."""
+    if isinstance(inputs, (str, Path)) and Path(inputs).is_dir():
+        inputs = (str(path) for path in sorted(Path(inputs).iterdir()))
+    for file in inputs:
+        if Path(file).suffix.lower() in IMAGE_SUFFIXES:
+            yield str(file)
+
+
+def chunked(files: Iterable[str], size: int) -> Iterator[List[str]]:
+    chunk: List[str] = []
+    for file in files:
+        chunk.append(file)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class BulkPipeline:
+    """
+    Streams images through the CPU stages in `processes` worker processes and
+    the LLM stages in `llm_workers` concurrent images. At most `queue_size`
+    prepared images wait for the LLM side; beyond that the workers idle.
+
+    With `jobs`, every crop is checkpointed after every LLM stage: a rerun
+    skips images that completed and resumes the others per crop.
+    """
+
+    def __init__(self, llm: Any, options: PipelineOptions, processes: Optional[int] = None,
+                 llm_workers: int = 4, crop_workers: int = 8, queue_size: int = 16,
+                 timeout: Optional[float] = None, jobs: Optional[JobStore] = None):
+        self.llm = llm
+        self.options = options
+        self.processes = processes or os.cpu_count() or 1
+        self.llm_workers = llm_workers
+        self.crop_workers = crop_workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.jobs = jobs
+        self.stats = {"images": 0, "diagrams": 0, "skipped": 0, "failed": 0, "crops_removed": 0,
+                      "already_done": 0}
+        self._stats_lock = threading.Lock()
+
+    def make_detector(self) -> Any:
+        if self.options.mermaid:
+            from src.mermaid_detector import MermaidDetector
+            from src.mermaid_to_json import MermaidToJSON
+            return MermaidDetector(self.llm, None, MermaidToJSON(self.llm), self.crop_workers,
+                                   self.timeout, jobs=self.jobs, resolve_entities=self.options.resolve_entities)
+
+        from src.llm_detector import Detector
+        return Detector(self.llm, None, self.crop_workers, self.timeout, jobs=self.jobs,
+                        resolve_entities=self.options.resolve_entities)
+
+    @property
+    def run_options(self) -> Dict[str, Any]:
+        return {"with_nodes": self.options.with_nodes, "joint": self.options.joint}
+
+    def pending(self, files: Iterable[str], output: Path) -> Iterator[str]:
+        """The files not converted yet by an earlier run with the same job store."""
+        detector = self.make_detector()
+        for file in files:
+            if self.jobs is not None and (output / f"{Path(file).stem}.json").exists() and \
+                    self.jobs.status(detector.job_key(file, self.options.crop, **self.run_options)) == "complete":
+                self.stats["already_done"] += 1
+                continue
+            yield file
+
+    def detect(self, prepared: PreparedImage) -> dict:
+        """LLM stages of one image, from its encoded crops to the exported graph."""
+        name = Path(prepared["file"]).name
+        detector = self.make_detector()
+        detector.graph_images = [
+            {"image": crop, "id": name + str(index), "mermaid": "", "nodes": [], "edges": [], "stored": False,
+             "stages": []}
+            for index, crop in enumerate(prepared["crops"])]
+        if self.jobs is not None:
+            detector.start_job(prepared["file"], self.options.crop, **self.run_options)
+            detector.resume()
+
+        with span("pipeline.detect", file=prepared["file"], crops=len(prepared["crops"])):
+            detector.run(**self.run_options)
+            graph = detector.get_graph()
+            graph.layout()
+        return graph.to_dict()
+
+    def export(self, prepared: PreparedImage, output_dir: Path) -> str:
+        result: Dict[str, Any] = {
+            "image": prepared["file"],
+            "is_diagram": prepared["is_diagram"],
+            "confidence": prepared["confidence"],
+            "crops": len(prepared["crops"]),
+            "crops_removed": prepared["crops_removed"],
+            "error": prepared["error"],
+            "nodes": [],
+            "edges": [],
+        }
+        if prepared["error"] is None and prepared["is_diagram"]:
+            try:
+                result.update(self.detect(prepared))
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+
+        path = output_dir / f"{Path(prepared['file']).stem}.json"
+        # Written atomically so an interrupted run never leaves half a file
+        tmp = path.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=4)
+        os.replace(tmp, path)
+
+        with self._stats_lock:
+            self.stats["images"] += 1
+            self.stats["crops_removed"] += prepared["crops_removed"]
+            if result["error"]:
+                self.stats["failed"] += 1
+            elif prepared["is_diagram"]:
+                self.stats["diagrams"] += 1
+            else:
+                self.stats["skipped"] += 1
+        return str(path)
+
+    def run(self, inputs: Union[str, Iterable[str]], output_dir: str) -> Dict[str, int]:
+        output = Path(output_dir)
+        output.mkdir(parents=True, exist_ok=True)
+        asyncio.run(self._run(self.pending(list_images(inputs), output), output))
+        return self.stats
+
+    async def _run(self, files: Iterator[str], output: Path) -> None:
+        loop = asyncio.get_running_loop()
+        queue: "asyncio.Queue[Optional[PreparedImage]]" = asyncio.Queue(maxsize=self.queue_size)
+        # Spawned workers don't inherit the parent's threads or loaded models
+        context = multiprocessing.get_context("spawn")
+
+        with ProcessPoolExecutor(self.processes, mp_context=context, initializer=_init_worker,
+                                 initargs=(self.options,)) as processes, \
+                ThreadPoolExecutor(self.llm_workers) as threads:
+
+            async def produce():
+                pending = set()
+
+                async def forward(done):
+                    for future in done:
+                        for prepared in future.result():
+                            await queue.put(prepared)
+
+                for chunk in chunked(files, self.options.chunk_size):
+                    # One chunk in flight per process, the queue holds the rest back
+                    while len(pending) >= self.processes:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        await forward(done)
+                    pending.add(loop.run_in_executor(processes, prepare_chunk, chunk))
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    await forward(done)
+                for _ in range(self.llm_workers):
+                    await queue.put(None)
+
+            async def consume():
+                while (prepared := await queue.get()) is not None:
+                    path = await loop.run_in_executor(threads, self.export, prepared, output)
+                    print(f"{self.stats['images']:6d} {path}")
+
+            await asyncio.gather(produce(), *(consume() for _ in range(self.llm_workers)))
+
+
+def make_llm(args: argparse.Namespace) -> Any:
+    if args.dry_run:
+        from src.benchmarks.llm import StubLLM
+        return StubLLM()
+
+    from src.llm_caller import LatencyPolicy, LLMCaller, ResponseCache
+    cache = None if args.no_cache else (ResponseCache(args.cache_dir) if args.cache_dir else ResponseCache())
+    policy = LatencyPolicy(timeout=args.request_timeout, deadline=args.deadline,
+                           max_retries=args.retries, hedge=args.hedge)
+    return LLMCaller(api_key=os.getenv("OPENAI_API_KEY") or os.getenv("WX_API_KEY") or "",
+                     model_id=args.model, project_id=os.getenv("WX_PROJECT_ID"),
+                     api_url=args.api_url, cache=cache, policy=policy)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="directory of images")
+    parser.add_argument("output", help="directory for the JSON graphs")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--api-url", default=None)
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--dry-run", action="store_true", help="stub LLM, no provider calls")
+    parser.add_argument("--mermaid", action="store_true")
+    parser.add_argument("--no-nodes", action="store_true", help="skip the node detection call")
+    parser.add_argument("--joint", action="store_true", help="nodes and edges in one call per crop")
+    parser.add_argument("--no-crop", action="store_true")
+    parser.add_argument("--no-classify", action="store_true")
+    parser.add_argument("--no-consolidate-boxes", action="store_true")
+    parser.add_argument("--no-resolve-entities", action="store_true",
+                        help="keep near-duplicate nodes of overlapping crops apart")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=8)
+    parser.add_argument("--llm-workers", type=int, default=4, help="images in the LLM stages at once")
+    parser.add_argument("--crop-workers", type=int, default=8, help="LLM calls in flight per image")
+    parser.add_argument("--queue-size", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=None, help="seconds per detector stage call")
+    parser.add_argument("--request-timeout", type=float, default=None, help="seconds per LLM request")
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="seconds per LLM call, retries and hedges included")
+    parser.add_argument("--retries", type=int, default=2, help="retries of failed LLM requests")
+    parser.add_argument("--hedge", action="store_true",
+                        help="duplicate LLM requests slower than the p95 latency")
+    parser.add_argument("--jobs", default=None,
+                        help="SQLite job store; rerunning with the same file resumes an interrupted run")
+    args = parser.parse_args(argv)
+
+    options = PipelineOptions(crop=not args.no_crop, classify=not args.no_classify,
+                              consolidate_boxes=not args.no_consolidate_boxes, mermaid=args.mermaid,
+                              with_nodes=not args.no_nodes, joint=args.joint, chunk_size=args.chunk_size,
+                              resolve_entities=not args.no_resolve_entities)
+    pipeline = BulkPipeline(make_llm(args), options, args.processes, args.llm_workers,
+                            args.crop_workers, args.queue_size, args.timeout,
+                            JobStore(args.jobs) if args.jobs else None)
+
+    start = time.perf_counter()
+    stats = pipeline.run(args.input, args.output)
+    print(f"{stats['images']} images in {time.perf_counter() - start:.1f}s: {stats['diagrams']} converted, "
+          f"{stats['skipped']} not diagrams, {stats['failed']} failed, "
+          f"{stats['crops_removed']} crops removed, {stats['already_done']} done in an earlier run")
+
+
+if __name__ == "__main__":
+    main()
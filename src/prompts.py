@@ -0,0 +1,126 @@
+import base64
+import io
+import threading
+from functools import lru_cache
+from typing import Any, Callable, Dict, Hashable, List, Optional, Type
+
+from PIL import Image
+from pydantic import BaseModel
+
+from src.image_encoding import estimate_image_tokens
+
+
+@lru_cache(maxsize=None)
+def describe_response_type(response_type: Type[BaseModel]) -> str:
+    """One line per field of `response_type`, used as the output spec of a prompt."""
+    return "\n".join(
+        f"{name} ({getattr(field.annotation, '__name__', field.annotation)}): "
+        f"{field.description or 'No description'}"
+        for name, field in response_type.model_fields.items()
+    )
+
+
+class PromptTemplate:
+    """
+    A prompt compiled once: `prefix` is fixed text, `suffix` a `str.format`
+    template for the per-call values (e.g. pre-detected nodes).
+
+    The static prefix always comes first, so consecutive requests share the
+    longest possible prefix and provider-side prompt caching can hit.
+    """
+
+    def __init__(self, prefix: str, suffix: str = ""):
+        self.prefix = prefix
+        self.suffix = suffix
+        self._part = {"type": "text", "text": prefix}
+
+    def render(self, **values: Any) -> str:
+        if not self.suffix:
+            return self.prefix
+        return self.prefix + self.suffix.format(**values)
+
+    def part(self, **values: Any) -> Dict[str, str]:
+        """The prompt as a text message part; shared when there is no suffix."""
+        if not self.suffix:
+            return self._part
+        return {"type": "text", "text": self.render(**values)}
+
+
+_templates: Dict[Hashable, PromptTemplate] = {}
+_templates_lock = threading.Lock()
+
+
+def compiled(key: Hashable, build: Callable[[], PromptTemplate]) -> PromptTemplate:
+    """The template stored under `key`, built on first use."""
+    template = _templates.get(key)
+    if template is None:
+        with _templates_lock:
+            template = _templates.get(key)
+            if template is None:
+                template = _templates[key] = build()
+    return template
+
+
+@lru_cache(maxsize=8)
+def _encoding(model_id: Optional[str]):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        name = tiktoken.encoding_name_for_model(model_id or "gpt-4o")
+    except KeyError:
+        name = "o200k_base"
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception:
+        # The encoding files are downloaded on first use, which can fail offline
+        return None
+
+
+def estimate_text_tokens(text: str, model_id: Optional[str] = None) -> int:
+    encoding = _encoding(model_id)
+    if encoding is None:
+        # Roughly four characters per token for English text
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _image_size(url: str) -> Optional[tuple]:
+    """Width and height of a base64 data url, decoding only the header if possible."""
+    if not url.startswith("data:"):
+        return None
+    data = url.split(",", 1)[-1]
+    # Image headers sit at the start of the file; fall back to the whole payload
+    for chunk in (data[:4096], data):
+        try:
+            raw = base64.b64decode(chunk[:len(chunk) // 4 * 4])
+            return Image.open(io.BytesIO(raw)).size
+        except Exception:
+            continue
+    return None
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], model_id: Optional[str] = None) -> int:
+    """
+    Estimated prompt tokens of a chat request before sending it: text through
+    the model's tokenizer (tiktoken, when installed) and images by OpenAI's
+    tile rules. Within a few percent of the usage providers report.
+    """
+    # Per-message framing tokens of the chat format
+    tokens = 3
+    for message in messages:
+        tokens += 3
+        content = message.get("content")
+        parts = [content] if isinstance(content, str) else content or []
+        for part in parts:
+            if isinstance(part, str):
+                tokens += estimate_text_tokens(part, model_id)
+            elif part.get("type") == "text":
+                tokens += estimate_text_tokens(part["text"], model_id)
+            elif part.get("type") == "image_url":
+                image_url = part["image_url"]
+                detail = image_url.get("detail", "high")
+                size = _image_size(image_url["url"]) or (512, 512)
+                tokens += estimate_image_tokens(*size, detail)
+    return tokens
@@ -0,0 +1,164 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# Crop the current thread is working on, inherited by nested spans
+_crop_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("crop_id", default=None)
+
+
+def payload_bytes(value: Any) -> int:
+    """Characters of text and base64 image data in a message list."""
+    if isinstance(value, dict):
+        return sum(payload_bytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(payload_bytes(v) for v in value)
+    if isinstance(value, str):
+        return len(value)
+    return 0
+
+
+class Span:
+    """A timed pipeline step with free-form attributes (bytes, tokens, ...)."""
+    __slots__ = ("tracer", "name", "attributes", "start", "duration", "thread", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.start = 0.0
+        self.duration = 0.0
+        self.thread = threading.get_ident()
+        self._token = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> "Span":
+        crop_id = self.attributes.get("crop_id")
+        if crop_id is not None:
+            self._token = _crop_id.set(crop_id)
+        elif _crop_id.get() is not None:
+            self.attributes["crop_id"] = _crop_id.get()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        if self._token is not None:
+            _crop_id.reset(self._token)
+        self.tracer._record(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "start": self.start - self.tracer.origin,
+            "duration": self.duration,
+            "thread": self.thread,
+            **self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Returned while tracing is disabled, so instrumented code costs nothing."""
+    __slots__ = ()
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    Collects spans from every pipeline stage and exports them as JSON lines
+    or as a Chrome trace (chrome://tracing, Perfetto).
+
+    Disabled by default; `span` then returns a shared no-op object. Set
+    `TRACE=1` in the environment or call `enable()` to record.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def span(self, name: str, **attributes: Any):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def _record(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def clear(self) -> None:
+        with self._lock:
+            self.spans = []
+        self.origin = time.perf_counter()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, total and p50/p95 duration (seconds) per span name."""
+        durations: Dict[str, List[float]] = {}
+        for span in list(self.spans):
+            durations.setdefault(span.name, []).append(span.duration)
+
+        stats = {}
+        for name, values in durations.items():
+            values.sort()
+            stats[name] = {
+                "count": len(values),
+                "total": sum(values),
+                "p50": values[len(values) // 2],
+                "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+            }
+        return stats
+
+    def export_jsonl(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for span in list(self.spans):
+                f.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+    def export_chrome_trace(self, path: str) -> None:
+        events = []
+        for span in list(self.spans):
+            events.append({
+                "name": span.name,
+                "cat": span.name.split(".")[0],
+                "ph": "X",
+                "ts": (span.start - self.origin) * 1e6,
+                "dur": span.duration * 1e6,
+                "pid": os.getpid(),
+                "tid": span.thread,
+                "args": span.attributes,
+            })
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+
+tracer = Tracer(enabled=os.getenv("TRACE", "") not in ("", "0"))
+
+
+def span(name: str, **attributes: Any):
+    """Start a span on the process-wide tracer, use as a context manager."""
+    if not tracer.enabled:
+        return NOOP_SPAN
+    return Span(tracer, name, attributes)
@@ -0,0 +1,93 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def run_stages(
+    items: Iterable[T],
+    stages: Sequence[Callable[[T], Any]],
+    max_workers: int = 8,
+    timeout: Optional[float] = None,
+    on_item_done: Optional[Callable[[int, T, List[Any]], None]] = None
+) -> List[List[Any]]:
+    """
+    Run every item through `stages` in order, with at most `max_workers`
+    calls in flight across all items.
+
+    Items don't wait for each other: as soon as stage k of an item finishes,
+    its stage k + 1 is scheduled, so a slow item never holds up a fast one.
+    Returns, per item and in input order, the list of stage results.
+
+    `timeout` is a per-call limit in seconds, counted from the moment the call
+    starts running. A call that exceeds it raises `TimeoutError`; the first
+    exception raised by any call is re-raised here. `on_item_done` is called
+    from the calling thread with (index, item, results) once an item has
+    passed all stages.
+    """
+    items = list(items)
+    results: List[List[Any]] = [[] for _ in items]
+
+    if max_workers <= 1 and timeout is None:
+        for index, item in enumerate(items):
+            results[index] = [stage(item) for stage in stages]
+            if on_item_done:
+                on_item_done(index, item, results[index])
+        return results
+
+    # Ready calls, as (item index, stage index), oldest first.
+    queue: List[Tuple[int, int]] = [(index, 0) for index in range(len(items))]
+    running: Dict[Future, Tuple[int, int, float]] = {}
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+
+    def fill() -> None:
+        while queue and len(running) < max(1, max_workers):
+            index, stage = queue.pop(0)
+            deadline = time.monotonic() + timeout if timeout is not None else float("inf")
+            future = executor.submit(stages[stage], items[index])
+            running[future] = (index, stage, deadline)
+
+    try:
+        fill()
+        while running:
+            nearest = min(deadline for _, _, deadline in running.values())
+            wait_for = None if nearest == float("inf") else max(
+                0.0, nearest - time.monotonic())
+            done, _ = wait(running, timeout=wait_for,
+                           return_when=FIRST_COMPLETED)
+
+            for future in done:
+                index, stage, _ = running.pop(future)
+                results[index].append(future.result())
+                if stage + 1 < len(stages):
+                    # Next stage of the same item goes ahead of untouched items
+                    queue.insert(0, (index, stage + 1))
+                elif on_item_done:
+                    on_item_done(index, items[index], results[index])
+            fill()
+
+            now = time.monotonic()
+            for index, stage, deadline in running.values():
+                if deadline <= now:
+                    raise TimeoutError(
+                        f"Stage {stage} for item {index} exceeded {timeout}s")
+    finally:
+        # Stalled calls can't be interrupted, but nothing waits on them.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
+
+
+def map_ordered(
+    fn: Callable[[T], R],
+    items: Iterable[T],
+    max_workers: int = 8,
+    timeout: Optional[float] = None
+) -> List[R]:
+    """
+    Call `fn` on every item with at most `max_workers` calls in flight and
+    return the results in the order of `items`. See `run_stages`.
+    """
+    return [result for [result] in run_stages(items, [fn], max_workers, timeout)]
@@ -0,0 +1,139 @@
+from typing import Dict, List, Optional, Tuple, TypedDict, Union
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from src.yolo.yolo import Detection
+
+
+class BoxReport(TypedDict):
+    boxes: int
+    filtered: int
+    merged: int
+    crops: int
+    # Every removed crop saves one vision call per LLM stage
+    crops_removed: int
+
+
+def pairwise_overlap(xyxy: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    IoU and containment (intersection over the smaller box) of every pair of
+    boxes, as two n x n matrices.
+    """
+    left = np.maximum(xyxy[:, None, 0], xyxy[None, :, 0])
+    top = np.maximum(xyxy[:, None, 1], xyxy[None, :, 1])
+    right = np.minimum(xyxy[:, None, 2], xyxy[None, :, 2])
+    bottom = np.minimum(xyxy[:, None, 3], xyxy[None, :, 3])
+    intersection = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+
+    area = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+    union = area[:, None] + area[None, :] - intersection
+    smaller = np.minimum(area[:, None], area[None, :])
+    iou = intersection / np.maximum(union, 1e-9)
+    containment = intersection / np.maximum(smaller, 1e-9)
+    return iou, containment
+
+
+class BoxConsolidator:
+    """
+    Post-processes raw YOLO boxes before they become crops, so overlapping
+    and nested detections of the same sub-flowchart cost one vision call.
+
+    Boxes below `min_confidence` or `min_area` (px²) are dropped, unless that
+    would drop every box: then the most confident one is kept. Boxes that
+    overlap by at least `iou_threshold`, or where one lies at least
+    `containment_threshold` inside the other, are merged into their union
+    until no pair qualifies; the merged box keeps the highest confidence and
+    the class of its most confident member. Finally each box is grown by
+    `padding` (a fraction of its width/height, per class id if a dict) so
+    edges crossing the border aren't cut. Boxes are clipped to `image_size`
+    when given, `Crop` clips them otherwise.
+    """
+
+    def __init__(
+        self,
+        min_confidence: float = 0.25,
+        min_area: float = 32 * 32,
+        iou_threshold: float = 0.5,
+        containment_threshold: float = 0.85,
+        padding: Union[float, Dict[int, float]] = 0.03,
+    ):
+        self.min_confidence = min_confidence
+        self.min_area = min_area
+        self.iou_threshold = iou_threshold
+        self.containment_threshold = containment_threshold
+        self.padding = padding
+
+    def _padding(self, class_ids: np.ndarray) -> np.ndarray:
+        if isinstance(self.padding, dict):
+            return np.array([self.padding.get(int(class_id), 0.0) for class_id in class_ids])
+        return np.full(len(class_ids), float(self.padding))
+
+    def _merge(self, xyxy: np.ndarray, confidence: np.ndarray, class_ids: np.ndarray):
+        # Union boxes can reach new boxes, so repeat until nothing merges
+        while len(xyxy) > 1:
+            iou, containment = pairwise_overlap(xyxy)
+            adjacent = (iou >= self.iou_threshold) | (containment >= self.containment_threshold)
+            count, labels = connected_components(csr_matrix(adjacent), directed=False)
+            if count == len(xyxy):
+                break
+
+            merged = np.empty((count, 4))
+            merged[:, :2] = np.inf
+            merged[:, 2:] = -np.inf
+            np.minimum.at(merged[:, 0], labels, xyxy[:, 0])
+            np.minimum.at(merged[:, 1], labels, xyxy[:, 1])
+            np.maximum.at(merged[:, 2], labels, xyxy[:, 2])
+            np.maximum.at(merged[:, 3], labels, xyxy[:, 3])
+
+            # Most confident member per component, for confidence and class
+            order = np.lexsort((-confidence, labels))
+            first = order[np.r_[True, labels[order][1:] != labels[order][:-1]]]
+            xyxy, confidence, class_ids = merged, confidence[first], class_ids[first]
+        return xyxy, confidence, class_ids
+
+    def consolidate(self, detections: List[Detection],
+                    image_size: Optional[Tuple[int, int]] = None) -> Tuple[List[Detection], BoxReport]:
+        """Consolidated detections, sorted top to bottom, and what was removed."""
+        if not detections:
+            return [], {"boxes": 0, "filtered": 0, "merged": 0, "crops": 0, "crops_removed": 0}
+
+        xyxy = np.array([detection["xyxy"] for detection in detections], dtype=np.float64)
+        confidence = np.array([detection["confidence"] for detection in detections])
+        class_ids = np.array([detection["class_id"] for detection in detections])
+
+        area = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+        keep = (confidence >= self.min_confidence) & (area >= self.min_area)
+        if not keep.any():
+            # Cropping to nothing would lose the diagram, keep the best guess
+            keep[np.argmax(confidence)] = True
+        filtered = len(detections) - int(keep.sum())
+        xyxy, confidence, class_ids = xyxy[keep], confidence[keep], class_ids[keep]
+        before_merge = len(xyxy)
+
+        xyxy, confidence, class_ids = self._merge(xyxy, confidence, class_ids)
+
+        sizes = xyxy[:, 2:] - xyxy[:, :2]
+        pad = self._padding(class_ids)[:, None] * np.hstack([sizes, sizes])
+        xyxy = xyxy + pad * np.array([-1, -1, 1, 1])
+        if image_size is not None:
+            width, height = image_size
+            xyxy = np.clip(xyxy, 0, [width, height, width, height])
+
+        order = np.lexsort((xyxy[:, 0], xyxy[:, 1]))
+        consolidated: List[Detection] = [{
+            "xywh": [float((xyxy[i, 0] + xyxy[i, 2]) / 2), float((xyxy[i, 1] + xyxy[i, 3]) / 2),
+                     float(xyxy[i, 2] - xyxy[i, 0]), float(xyxy[i, 3] - xyxy[i, 1])],
+            "confidence": float(confidence[i]),
+            "class_id": int(class_ids[i]),
+            "xyxy": [float(v) for v in xyxy[i]],
+        } for i in order]
+
+        return consolidated, {
+            "boxes": len(detections),
+            "filtered": filtered,
+            "merged": before_merge - len(consolidated),
+            "crops": len(consolidated),
+            "crops_removed": len(detections) - len(consolidated),
+        }
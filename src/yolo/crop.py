@@ -0,0 +1,64 @@
+import hashlib
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+def decode_image(file: str) -> np.ndarray:
+    """Decode an image file once into an array that crops can share."""
+    with Image.open(file) as img:
+        if img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGB")
+        return np.asarray(img)
+
+
+class Crop:
+    """
+    A rectangular region of a decoded image.
+
+    The crop only holds a view into the shared source array; a PIL image is
+    materialized by `to_image` when the crop is encoded and can be dropped
+    right after.
+    """
+    source: np.ndarray
+    box: Tuple[int, int, int, int]
+    file: str
+    _digest: Optional[str] = None
+
+    def __init__(self, source: np.ndarray, box: Tuple[float, float, float, float], file: str = ""):
+        height, width = source.shape[:2]
+        left, top, right, bottom = (int(round(v)) for v in box)
+        left, right = max(0, min(left, width)), max(0, min(right, width))
+        top, bottom = max(0, min(top, height)), max(0, min(bottom, height))
+        self.source = source
+        self.box = (left, top, max(left, right), max(top, bottom))
+        self.file = file
+
+    def __repr__(self):
+        return f"Crop({self.file!r}, box={self.box})"
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        left, top, right, bottom = self.box
+        return right - left, bottom - top
+
+    @property
+    def key(self) -> Tuple[str, Tuple[int, int, int, int]]:
+        return self.file, self.box
+
+    @property
+    def digest(self) -> str:
+        """Content hash of the crop's pixels, computed once."""
+        if self._digest is None:
+            pixels = np.ascontiguousarray(self.to_array())
+            self._digest = hashlib.blake2b(
+                pixels.tobytes() + str(pixels.shape).encode(), digest_size=16).hexdigest()
+        return self._digest
+
+    def to_array(self) -> np.ndarray:
+        left, top, right, bottom = self.box
+        return self.source[top:bottom, left:right]
+
+    def to_image(self) -> Image.Image:
+        return Image.fromarray(self.to_array())
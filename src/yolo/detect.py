@@ -1,11 +1,11 @@
 # src/yolo/detect.py
 
-from ultralytics import YOLO
+from src.model_registry import registry
 from src.utils.path import from_root
 
 
 def run_custom_yolo(image_path: str):
-    model = YOLO(from_root("models/yolo-trained.pt"))
+    model = registry.get("yolo")
     results = model(from_root(image_path))
 
     boxes_data = []
@@ -1,7 +1,14 @@
-from ultralytics import YOLO
 from PIL import Image
-from typing import List
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Tuple, Union
 from typing_extensions import TypedDict
+from src.yolo.crop import Crop, decode_image
+from src.tracing import span
+
+if TYPE_CHECKING:
+    from ultralytics import YOLO
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".bmp", ".webp", ".tif", ".tiff"}
 
 
 class Detection(TypedDict):
@@ -14,18 +21,53 @@ class Detection(TypedDict):
 class Yolo:
     _file: str
     _results: list
-    _model: YOLO
+    _model: "YOLO"
 
-    def __init__(self, model: YOLO):
+    def __init__(self, model: "YOLO"):
         self._model = model
         self._results = []
         self._file = ""
 
     def predict(self, file: str):
-        self._results = self._model(file)
-        self._file = file
+        with span("yolo.predict", file=file) as s:
+            self._results = self._model(file)
+            self._file = file
+            s.set(boxes=len(self._results[0].boxes) if self._results else 0)
         return self._results
 
+    def predict_batch(self, files: Union[str, Path, Iterable[str]], batch_size: int = 8) -> Iterator[Tuple[str, List[Detection]]]:
+        """
+        Run the model over many images, `batch_size` images per forward pass,
+        and yield (file, detections) per image in input order.
+
+        `files` is a directory, a single image path or an iterable of paths
+        and is consumed lazily.
+        While an image is being yielded it is also the current image, so
+        `getBBoxes` and `cropImages` work on it as after `predict`.
+        """
+        if isinstance(files, (str, Path)) and Path(files).is_dir():
+            files = (str(path) for path in sorted(Path(files).iterdir())
+                     if path.suffix.lower() in IMAGE_SUFFIXES)
+        elif isinstance(files, (str, Path)):
+            files = [str(files)]
+
+        batch: List[str] = []
+        for file in files:
+            batch.append(str(file))
+            if len(batch) == batch_size:
+                yield from self._predict_batch(batch)
+                batch = []
+        if batch:
+            yield from self._predict_batch(batch)
+
+    def _predict_batch(self, batch: List[str]) -> Iterator[Tuple[str, List[Detection]]]:
+        with span("yolo.predict_batch", images=len(batch)):
+            results = self._model(batch, verbose=False)
+        for file, result in zip(batch, results):
+            self._results = [result]
+            self._file = file
+            yield file, self.getBBoxes()
+
     def getBBoxes(self) -> List[Detection]:
         bboxes = []
         result = self._results[0]
@@ -41,12 +83,15 @@ class Yolo:
     def show(self) -> None:
         self._results.show()
 
+    def crops(self, bboxes: List[Detection], file: Union[str, None] = None) -> List[Crop]:
+        """Decode the current image (or `file`) once and return a view per bounding box."""
+        file = file or self._file
+        with span("yolo.crop", file=file, boxes=len(bboxes)):
+            source = decode_image(file)
+            return [Crop(source, bbox["xyxy"], file) for bbox in bboxes]
+
     def cropImages(self, bboxes: List[Detection]):
-        images: List[Image.Image] = []
-        for bbox in bboxes:
-            img = Image.open(self._file)
-            [left, top, right, bottom] = bbox["xyxy"]
-            cropped = img.crop((left, top, right, bottom))
-            images.append(cropped)
+        images: List[Image.Image] = [
+            crop.to_image() for crop in self.crops(bboxes)]
 
         return images
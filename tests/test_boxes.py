@@ -0,0 +1,40 @@
+from typing import List
+
+from src.yolo.boxes import BoxConsolidator
+from src.yolo.yolo import Detection
+
+
+def detection(xyxy: List[float], confidence: float, class_id: int = 0) -> Detection:
+    left, top, right, bottom = xyxy
+    return {"xywh": [(left + right) / 2, (top + bottom) / 2, right - left, bottom - top],
+            "confidence": confidence, "class_id": class_id, "xyxy": xyxy}
+
+
+def test_nested_boxes_merge():
+    boxes = BoxConsolidator(padding=0)
+    consolidated, report = boxes.consolidate([
+        detection([0, 0, 200, 200], 0.9),
+        detection([20, 20, 180, 180], 0.6, class_id=1),
+        detection([0, 400, 200, 600], 0.8),
+    ])
+    assert [box["xyxy"] for box in consolidated] == [[0, 0, 200, 200], [0, 400, 200, 600]]
+    assert [box["class_id"] for box in consolidated] == [0, 0]
+    assert (report["merged"], report["crops_removed"]) == (1, 1)
+
+
+def test_low_confidence_boxes_are_dropped():
+    consolidated, report = BoxConsolidator(padding=0).consolidate([
+        detection([0, 0, 200, 200], 0.9),
+        detection([0, 400, 200, 600], 0.1),
+    ])
+    assert [box["xyxy"] for box in consolidated] == [[0, 0, 200, 200]]
+    assert report["filtered"] == 1
+
+
+def test_most_confident_box_survives_when_all_are_filtered():
+    consolidated, report = BoxConsolidator(padding=0).consolidate([
+        detection([0, 0, 200, 200], 0.1),
+        detection([0, 400, 200, 600], 0.2),
+    ])
+    assert [box["xyxy"] for box in consolidated] == [[0, 400, 200, 600]]
+    assert (report["filtered"], report["crops"]) == (1, 1)
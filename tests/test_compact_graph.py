@@ -0,0 +1,48 @@
+import numpy as np
+
+from src.compact_graph import CompactGraph
+from src.graph import Edge, Graph, Node
+
+
+def pairs(graph: Graph) -> list:
+    return [(edge.source, edge.target) for edge in graph.edges]
+
+
+def test_labels_with_dashes_do_not_collide():
+    # Both edges have the Edge.id "A-B-C"
+    graph = Graph.merge([Edge("A-B", "C"), Edge("A", "B-C")])
+    assert pairs(graph) == [("A-B", "C"), ("A", "B-C")]
+    assert [node.id for node in graph.nodes] == ["A-B", "C", "A", "B-C"]
+
+
+def test_merge_deduplicates_across_crops():
+    crops = [[Edge("Owner", "Company-1"), Edge("Owner", "Company-2")],
+             [Edge("Owner", "Company-2"), Edge("Company-2", "Sub-ApS")]]
+    graph = Graph.merge(edge for edges in crops for edge in edges)
+    assert pairs(graph) == [("Owner", "Company-1"), ("Owner", "Company-2"), ("Company-2", "Sub-ApS")]
+    assert len(graph.nodes) == 4
+
+
+def test_merge_keeps_the_detected_nodes():
+    nodes = [Node("Owner"), Node("Company-1"), Node("Owner"), Node("Lonely")]
+    graph = Graph.merge([Edge("Owner", "Company-1"), Edge("Owner", "Unlisted")], nodes)
+    assert [node.id for node in graph.nodes] == ["Owner", "Company-1", "Lonely"]
+    assert pairs(graph) == [("Owner", "Company-1"), ("Owner", "Unlisted")]
+
+
+def test_compact_graphs_with_other_interners_merge():
+    a = CompactGraph.from_pairs([("A-B", "C"), ("C", "D")])
+    b = CompactGraph.from_pairs([("C", "D"), ("A", "B-C")])
+    a.merge(b)
+    assert a.pairs() == [("A-B", "C"), ("C", "D"), ("A", "B-C")]
+    assert a.successors("C") == ["D"]
+    assert a.out_degrees().tolist() == [1, 1, 0, 1, 0]
+    assert a.in_degrees().tolist() == [0, 1, 1, 0, 1]
+
+
+def test_node_dimensions_match_nodes():
+    graph = CompactGraph.from_pairs([("A", "A much longer company name A/S")])
+    width, height = graph.node_dimensions()
+    nodes = [Node(label) for label in graph.labels]
+    assert np.array_equal(width, [node.width for node in nodes])
+    assert np.array_equal(height, [node.height for node in nodes])
@@ -0,0 +1,70 @@
+from typing import List
+
+from PIL import Image, ImageDraw
+
+from src.crop_store import CropStore, _popcount, dhash
+
+
+def board(names: List[str]) -> Image.Image:
+    """An ownership board: one box per name in a column, arrows in between."""
+    image = Image.new("RGB", (960, 800), "white")
+    draw = ImageDraw.Draw(image)
+    for index, name in enumerate(names):
+        top = 40 + index * 260
+        draw.rectangle((200, top, 760, top + 140), outline="black", width=5)
+        draw.text((220, top + 64), name, fill="black")
+        if index:
+            draw.line((480, top - 120, 480, top), fill="black", width=5)
+            draw.polygon([(464, top - 20), (496, top - 20), (480, top)], fill="black")
+    return image
+
+
+def test_boards_with_other_names_are_not_reused():
+    a = board(["Alpha Holding A/S", "Beta Invest ApS", "Gamma Ejendomme A/S"])
+    b = board(["Omega Capital A/S", "Sigma Partners ApS", "Delta Byg A/S"])
+    # Same boxes and arrows: only a few hash bits tell the boards apart
+    assert _popcount(dhash(a) ^ dhash(b)).sum() <= 3
+
+    store = CropStore()
+    store.put(a, {"nodes": ["Alpha"]})
+    assert store.get(b) is None
+    assert store.stats()["similar_hits"] == 0
+
+
+def test_exact_copies_are_reused():
+    names = ["Alpha Holding A/S", "Beta Invest ApS"]
+    store = CropStore()
+    store.put(board(names), {"nodes": ["Alpha", "Beta"]})
+    assert store.get(board(names)) == {"nodes": ["Alpha", "Beta"]}
+    assert store.stats()["exact_hits"] == 1
+
+
+def test_near_matches_are_opt_in():
+    a = board(["Alpha Holding A/S", "Beta Invest ApS"])
+    store = CropStore(max_distance=3)
+    store.put(a, {"nodes": ["Alpha"]})
+    # A re-encoded copy of the same board
+    copy = a.resize((956, 796)).resize(a.size)
+    assert store.get(copy) == {"nodes": ["Alpha"]}
+    assert store.stats()["similar_hits"] == 1
+
+
+def test_least_recently_used_crops_are_evicted():
+    boards = [board([name]) for name in ("Alpha", "Beta", "Gamma")]
+    store = CropStore(max_entries=2)
+    store.put(boards[0], 0)
+    store.put(boards[1], 1)
+    assert store.get(boards[0]) == 0
+    store.put(boards[2], 2)
+    assert len(store) == 2
+    assert store.get(boards[0]) == 0
+    assert store.stats()["exact_hits"] == 2
+
+
+def test_save_and_load(tmp_path):
+    a = board(["Alpha Holding A/S"])
+    store = CropStore()
+    store.put(a, {"nodes": ["Alpha"]})
+    store.save(str(tmp_path / "crops.jsonl"))
+    loaded = CropStore().load(str(tmp_path / "crops.jsonl"))
+    assert loaded.get(a) == {"nodes": ["Alpha"]}
@@ -0,0 +1,50 @@
+import pytest
+
+from src.edge_validator import BatchEdgeEvaluator, EdgeValidator
+from src.edge_validator_local import LocalEdgeValidator
+from src.graph import Edge
+
+
+def edges(*pairs) -> list:
+    return [Edge(source, target) for source, target in pairs]
+
+
+# The worked example of the LLMEdgeValidator prompt, which expects 0.67
+TRUE = edges(("owner", "company 1"), ("owner", "company 2"), ("company 2", "company 3"),
+             ("company 2", "company 4"), ("entity", "company 1"), ("fund", "company 1"))
+PREDICTED = edges(("Owner (1)", "company 2"), ("company 2", "company 3"), ("Company 2", "company 4"),
+                  ("Company 1", "entity"), ("Fund", "company 3"))
+
+
+def test_prompt_example():
+    result = LocalEdgeValidator().score(TRUE, PREDICTED)
+    # Two exact edges, one up to the "Owner (1)" spelling; the reversed edge gets nothing
+    assert result["precision"] == pytest.approx((2 + 0.833) / 5, abs=1e-3)
+    assert result["mapping"]["owner 1"] == "owner"
+
+    response = LocalEdgeValidator().invoke(TRUE, PREDICTED)
+    assert response.precision_score == result["precision"]
+
+
+def test_identical_edges_score_one():
+    result = LocalEdgeValidator().score(TRUE, TRUE)
+    assert (result["precision"], result["recall"], result["f1_score"]) == (1.0, 1.0, 1.0)
+
+
+def test_numbered_labels_are_not_swapped():
+    result = LocalEdgeValidator().score(edges(("owner", "company 1")), edges(("owner", "company 2")))
+    assert result["precision"] == 0.0
+
+
+def test_empty_predictions():
+    assert LocalEdgeValidator().score(TRUE, [])["precision"] == 0.0
+
+
+def test_soft_scores_next_to_exact_ones():
+    assert EdgeValidator(TRUE, PREDICTED).soft_validate()["precision"] == pytest.approx(0.567, abs=1e-3)
+
+    evaluator = BatchEdgeEvaluator("example", soft=True)
+    result = evaluator.evaluate("1", TRUE, PREDICTED)
+    assert result["precision"] == pytest.approx(2 / 5)
+    assert result["soft_precision"] == pytest.approx(0.567, abs=1e-3)
+    assert evaluator.summary()["soft"]["precision"] == result["soft_precision"]
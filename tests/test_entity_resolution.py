@@ -0,0 +1,48 @@
+from src.entity_resolution import EntityResolver, normalize_label
+from src.graph import Edge, Node
+from src.llm_detector import Detector
+
+
+def test_normalize_label():
+    assert normalize_label("  Ålborg  Holding A/S ") == "alborg holding a s"
+
+
+def test_spelling_variants_merge_to_the_most_frequent():
+    labels = ["Company A/S", "Company A/S", "company A/S ", "COMPANY A/S", "Other ApS"]
+    mapping = EntityResolver().resolve(labels)
+    assert {mapping[label] for label in labels[:4]} == {"Company A/S"}
+    assert mapping["Other ApS"] == "Other ApS"
+
+
+def test_common_ngrams_still_count_towards_similarity():
+    labels = ["Holding Company Alphabet A/S", "Holding Company Alphabet AS"]
+    others = [f"Holding Company {index} ApS" for index in range(700)]
+
+    alone = EntityResolver().resolve(labels)
+    crowded = EntityResolver().resolve(labels + others)
+    assert alone["Holding Company Alphabet AS"] == alone["Holding Company Alphabet A/S"]
+    assert crowded["Holding Company Alphabet AS"] == crowded["Holding Company Alphabet A/S"]
+
+
+def test_numbered_labels_stay_apart():
+    mapping = EntityResolver().resolve(["Company 1", "Company 2", "company 1 "])
+    assert mapping["company 1 "] == "Company 1"
+    assert mapping["Company 2"] == "Company 2"
+
+
+def test_detector_merges_nodes_of_overlapping_crops():
+    crops = [(["Holding A/S", "Company 1"], [("Holding A/S", "Company 1")]),
+             (["holding A/S ", "Company 2"], [("holding A/S ", "Company 2")])]
+    graphs = []
+    for resolve in (False, True):
+        detector = Detector(None, None, resolve_entities=resolve)
+        detector.graph_images = [
+            {"image": None, "id": str(index), "nodes": [Node(label) for label in nodes],
+             "edges": [Edge(*pair) for pair in edges], "stored": False, "stages": []}
+            for index, (nodes, edges) in enumerate(crops)]
+        graphs.append(detector.get_graph())
+
+    assert len(graphs[0].nodes) == 4
+    assert [node.id for node in graphs[1].nodes] == ["Holding A/S", "Company 1", "Company 2"]
+    assert [(edge.source, edge.target) for edge in graphs[1].edges] == [
+        ("Holding A/S", "Company 1"), ("Holding A/S", "Company 2")]
@@ -0,0 +1,99 @@
+from typing import Any, List, Sequence
+
+import pytest
+from PIL import Image
+
+from src.benchmarks.llm import StubLLM
+from src.job_store import JobStore
+from src.llm_detector import Detector, ResumableDetector
+
+
+class CountingLLM(StubLLM):
+    """StubLLM that counts its calls and fails the ones listed in `fail`."""
+
+    def __init__(self, fail: Sequence[int] = ()):
+        super().__init__()
+        self.fail = fail
+        self.calls = 0
+
+    def invoke(self, messages: List[Any], response_model=None, **kwargs) -> Any:
+        self.calls += 1
+        if self.calls in self.fail:
+            raise ConnectionError("provider went away")
+        return super().invoke(messages, response_model, **kwargs)
+
+
+@pytest.fixture
+def image(tmp_path) -> str:
+    path = tmp_path / "board.png"
+    Image.new("RGB", (64, 64), "white").save(path)
+    return str(path)
+
+
+def detector(model: Any, jobs: JobStore) -> Detector:
+    return Detector(model, None, max_workers=1, jobs=jobs)
+
+
+def test_checkpoints_round_trip(tmp_path):
+    jobs = JobStore(tmp_path / "jobs.sqlite")
+    jobs.start("job", "board.png")
+    jobs.save_detections("job", [{"xyxy": [0, 0, 1, 1]}])
+    jobs.checkpoint("job", "crop0", "nodes", {"nodes": ["A"]}, [0, 0, 1, 1])
+    assert jobs.detections("job") == [{"xyxy": [0, 0, 1, 1]}]
+    assert jobs.crops("job")["crop0"]["state"] == {"nodes": ["A"]}
+    assert jobs.status("job") == "running"
+    jobs.complete("job")
+    assert jobs.status("job") == "complete"
+
+
+def test_resume_after_failure(tmp_path, image):
+    jobs = JobStore(tmp_path / "jobs.sqlite")
+    first = detector(CountingLLM(fail=[2]), jobs)
+    first.initiate_image(image, should_crop=False)
+    with pytest.raises(ConnectionError):
+        first.run()
+    assert jobs.status(first.job) == "running"
+    assert [crop["stages"] for crop in jobs.crops(first.job).values()] == [["nodes"]]
+
+    model = CountingLLM()
+    second = detector(model, jobs)
+    second.initiate_image(image, should_crop=False)
+    second.run()
+    assert model.calls == 1
+    assert jobs.status(second.job) == "complete"
+
+
+def test_other_configurations_are_separate_jobs(tmp_path, image):
+    jobs = JobStore(tmp_path / "jobs.sqlite")
+    two_call = detector(CountingLLM(), jobs)
+    two_call.initiate_image(image, should_crop=False)
+    two_call.run()
+
+    model = CountingLLM()
+    joint = detector(model, jobs)
+    joint.initiate_image(image, should_crop=False, joint=True)
+    assert joint.job != two_call.job
+    joint.run(joint=True)
+    assert model.calls == 1
+
+    with pytest.raises(ValueError):
+        joint.run(joint=False)
+
+
+def test_reading_the_graph_mid_run_does_not_complete_the_job(tmp_path, image):
+    jobs = JobStore(tmp_path / "jobs.sqlite")
+    first = detector(CountingLLM(fail=[2]), jobs)
+    first.initiate_image(image, should_crop=False)
+    with pytest.raises(ConnectionError):
+        first.run(on_crop_done=lambda crop: first.get_graph())
+    first.get_graph()
+    assert jobs.status(first.job) == "running"
+
+
+def test_detectors_must_define_their_crop_state():
+    class Incomplete(ResumableDetector):
+        def crop_state(self, graph_image) -> dict:
+            return {}
+
+    with pytest.raises(TypeError, match="restore_state"):
+        Incomplete()
@@ -0,0 +1,68 @@
+import os
+import time
+
+import pytest
+
+from src.benchmarks.stub_server import StubServer
+from src.llm_caller import BaseResponse, DeadlineExceeded, LatencyPolicy, LLMCaller
+
+# litellm fetches its model price list on import unless told not to
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+MESSAGES = [{"role": "user", "content": "Who owns Company 1?"}]
+
+
+def call(script, **policy) -> tuple:
+    """One structured call against a stub server answering as `script` says."""
+    policy = LatencyPolicy(backoff=0.01, **policy)
+    with StubServer(script=script) as server:
+        caller = LLMCaller(api_key="stub", model_id="openai/stub", api_url=server.url, policy=policy)
+        start = time.monotonic()
+        try:
+            result = caller.invoke(MESSAGES, response_model=BaseResponse)
+        except Exception as e:
+            result = e
+        elapsed = time.monotonic() - start
+    return result, server.requests, policy.calls[-1], elapsed
+
+
+def outcomes(record: dict) -> list:
+    return [(attempt["hedge"], attempt["outcome"]) for attempt in record["attempts"]]
+
+
+def test_retryable_error_is_retried():
+    result, requests, record, _ = call([(0, 503), (0, 200)])
+    assert result.answer == "stub"
+    assert [request["status"] for request in requests] == [503, 200]
+    assert outcomes(record) == [(False, "error"), (False, "ok")]
+
+
+def test_bad_request_is_not_retried():
+    result, requests, record, _ = call([(0, 400), (0, 200)])
+    assert isinstance(result, Exception) and not isinstance(result, DeadlineExceeded)
+    assert len(requests) == 1
+    assert record["outcome"] == "error"
+
+
+def test_deadline():
+    result, _, record, elapsed = call([(3, 200)], deadline=0.5)
+    assert isinstance(result, DeadlineExceeded)
+    assert elapsed < 2
+    assert record["outcome"] == "deadline"
+
+
+def test_hedge_wins_over_a_slow_primary():
+    result, requests, record, elapsed = call([(3, 200), (0, 200)], hedge=True, hedge_after=0.2)
+    assert result.answer == "stub"
+    assert elapsed < 2
+    assert len(requests) == 2
+    assert outcomes(record) == [(False, "abandoned"), (True, "ok")]
+
+
+def test_hedge_delay_follows_the_latency_quantile():
+    policy = LatencyPolicy(hedge=True, hedge_after=1.0, min_samples=10)
+    assert policy.hedge_delay("edges") == 1.0
+    for latency in range(1, 21):
+        policy.observe("edges", latency / 10)
+    assert policy.hedge_delay("edges") == pytest.approx(1.9)
+    assert policy.hedge_delay("nodes") == 1.0
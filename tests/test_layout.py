@@ -0,0 +1,51 @@
+from src.graph import Edge, Graph
+from src.layout import LayeredLayout
+
+
+def graph(*pairs) -> Graph:
+    edges = [Edge(source, target) for source, target in pairs]
+    return Graph(edges, Graph(edges, []).create_nodes_from_edges(edges))
+
+
+def sweeps_used(layout: LayeredLayout, monkeypatch) -> list:
+    sweeps = []
+    run = layout._layout
+    monkeypatch.setattr(layout, "_layout", lambda *args: (sweeps.append(args[-1]), run(*args))[1])
+    return sweeps
+
+
+def test_edges_point_down_the_layers():
+    positions = LayeredLayout().layout(graph(("A", "B"), ("A", "C"), ("C", "D")))
+    assert positions["A"][1] > positions["B"][1] == positions["C"][1] > positions["D"][1]
+    assert positions["B"][0] != positions["C"][0]
+
+
+def test_left_to_right():
+    positions = LayeredLayout("LR").layout(graph(("A", "B"), ("B", "C")))
+    assert positions["A"][0] < positions["B"][0] < positions["C"][0]
+
+
+def test_cycles_are_laid_out():
+    positions = graph(("A", "B"), ("B", "A")).layout()
+    assert set(positions) == {"A", "B"}
+    assert positions["A"][1] != positions["B"][1]
+
+
+def test_graph_relayout_is_incremental(monkeypatch):
+    g = graph(("A", "B"), ("A", "C"))
+    g.layout()
+    sweeps = sweeps_used(g._layouts["TB"], monkeypatch)
+
+    g.edges.append(Edge("C", "D"))
+    g.nodes = g.create_nodes_from_edges(g.edges)
+    g.layout()
+    assert sweeps == [LayeredLayout().incremental_sweeps]
+
+
+def test_layout_shared_across_graphs(monkeypatch):
+    layout = LayeredLayout()
+    sweeps = sweeps_used(layout, monkeypatch)
+    graph(("A", "B")).layout(layout=layout)
+    positions = graph(("A", "B"), ("B", "C")).layout(layout=layout)
+    assert sweeps == [layout.sweeps, layout.incremental_sweeps]
+    assert set(positions) == {"A", "B", "C"}
@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+from typing import List, Tuple
+
+import pytest
+
+from src.mermaid_parser import MermaidParseError, parse_mermaid
+from src.mermaid_to_json import MermaidToJSON
+
+# The example diagram of the mermaid detector's prompt
+PROMPT_EXAMPLE = """
+        graph TD
+            A["A"]
+            B["B"]
+            B_sub["B Sub"]
+            C["C"]
+            C_sub["C Sub"]
+
+            A --> B
+            A --> C
+            B --> B_sub
+            C --> C_sub"""
+
+
+class EdgeLLM:
+    """Answers every call with the same two edges."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def invoke(self, messages, response_model=None, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(answer=[{"source": "Owner", "target": "Company 1"},
+                                       {"source": "Owner", "target": "Company 2"}])
+
+
+def pairs(diagram: str) -> List[Tuple[str, str]]:
+    return [(edge.source, edge.target) for edge in parse_mermaid(diagram)]
+
+
+def test_prompt_example():
+    assert pairs(PROMPT_EXAMPLE) == [
+        ("A", "B"), ("A", "C"), ("B", "B Sub"), ("C", "C Sub")]
+
+
+def test_chained_edges():
+    assert pairs("graph TD\n    A --> B --> C") == [("A", "B"), ("B", "C")]
+    assert pairs("flowchart LR\n    A-->B-->C") == [("A", "B"), ("B", "C")]
+
+
+def test_labelled_edges():
+    assert pairs("graph TD\n    A -->|50%| B\n    B -- owns --> C") == [("A", "B"), ("B", "C")]
+
+
+def test_ampersand_groups():
+    assert pairs("graph TD\n    A & B --> C & D") == [
+        ("A", "C"), ("A", "D"), ("B", "C"), ("B", "D")]
+
+
+def test_nodes_declared_after_use():
+    diagram = """graph TD
+    A --> B
+    A["Alpha Holding A/S"]
+    B["Beta ApS"]"""
+    assert pairs(diagram) == [("Alpha Holding A/S", "Beta ApS")]
+
+
+def test_quoted_labels():
+    diagram = 'graph TD\n    A["Owner (51%); [Ltd]"] --> B("Company<br>One")'
+    assert pairs(diagram) == [("Owner (51%); [Ltd]", "Company One")]
+
+
+@pytest.mark.parametrize("diagram", [
+    "sequenceDiagram\n    A->>B: hello",
+    "graph TD\n    A --> ",
+    "graph TD\n    A -> B",
+])
+def test_unsupported_syntax_raises(diagram: str):
+    with pytest.raises(MermaidParseError):
+        parse_mermaid(diagram)
+
+
+def test_converter_parses_locally():
+    model = EdgeLLM()
+    edges = MermaidToJSON(model).convert("graph TD\n    A --> B")
+    assert [(edge.source, edge.target) for edge in edges] == [("A", "B")]
+    assert model.calls == 0
+
+
+def test_converter_falls_back_to_the_llm():
+    model = EdgeLLM()
+    edges = MermaidToJSON(model).convert("sequenceDiagram\n    A->>B: hello")
+    assert [(edge.source, edge.target) for edge in edges] == [
+        ("Owner", "Company 1"), ("Owner", "Company 2")]
+    assert model.calls == 1
@@ -0,0 +1,29 @@
+import json
+
+import pytest
+from PIL import Image
+
+from src.benchmarks.llm import StubLLM
+from src.pipeline import BulkPipeline, PipelineOptions
+
+
+@pytest.fixture
+def images(tmp_path):
+    directory = tmp_path / "images"
+    directory.mkdir()
+    Image.new("RGB", (64, 64), "white").save(directory / "a.png")
+    (directory / "b.png").write_bytes(b"not a png")
+    return directory
+
+
+@pytest.mark.parametrize("chunk_size", [1, 8])
+def test_corrupt_image_fails_alone(tmp_path, images, chunk_size):
+    options = PipelineOptions(crop=False, classify=False, chunk_size=chunk_size)
+    pipeline = BulkPipeline(StubLLM(), options, processes=1)
+    stats = pipeline.run(str(images), str(tmp_path / "out"))
+
+    assert (stats["images"], stats["diagrams"], stats["failed"]) == (2, 1, 1)
+    good = json.loads((tmp_path / "out" / "a.json").read_text())
+    bad = json.loads((tmp_path / "out" / "b.json").read_text())
+    assert good["error"] is None and good["edges"]
+    assert bad["error"].startswith("UnidentifiedImageError")
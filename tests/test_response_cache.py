@@ -0,0 +1,89 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.llm_caller import CacheMissError, LLMCaller, ResponseCache
+
+# litellm fetches its model price list on import unless told not to
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+
+def test_round_trip(tmp_path):
+    cache = ResponseCache(tmp_path)
+    with pytest.raises(CacheMissError):
+        cache.get("key")
+    cache.put("key", {"answer": "A"})
+    assert cache.get("key") == {"answer": "A"}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_image_payloads_are_keyed_by_hash(tmp_path):
+    cache = ResponseCache(tmp_path)
+    image = "data:image/png;base64,iVBORw0KGgo="
+    messages = [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": image}}]}]
+    normalized = cache.normalize(messages)
+    assert "base64" not in str(normalized)
+    assert cache.key("m", messages, None, {}, "chat") == cache.key("m", list(messages), None, {}, "chat")
+    assert cache.key("m", messages, None, {}, "chat") != cache.key("other", messages, None, {}, "chat")
+
+
+def test_expired_entries_miss(tmp_path):
+    cache = ResponseCache(tmp_path, max_age=-1)
+    cache.put("key", {"answer": "A"})
+    with pytest.raises(CacheMissError):
+        cache.get("key")
+
+
+def test_entry_limit(tmp_path):
+    cache = ResponseCache(tmp_path, max_entries=5, evict_every=1000)
+    for index in range(12):
+        cache.put(f"key{index}", {"answer": index})
+    assert len(list(tmp_path.glob("*.json"))) <= 5
+
+
+def test_concurrent_writes_of_one_key(tmp_path):
+    cache = ResponseCache(tmp_path)
+
+    def write(index: int):
+        cache.put("same", {"answer": index})
+
+    with ThreadPoolExecutor(16) as pool:
+        list(pool.map(write, range(400)))
+
+    assert cache.get("same")["answer"] in range(400)
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_writes_do_not_scan_the_directory(tmp_path, monkeypatch):
+    cache = ResponseCache(tmp_path, evict_every=100)
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, "evict", lambda: (scans.append(1), evict()))
+    for index in range(150):
+        cache.put(f"key{index}", {"answer": index})
+    # The first write counts the entries on disk, then every 100th rescans
+    assert len(scans) == 2
+
+
+def test_entry_evicted_after_the_read(tmp_path, monkeypatch):
+    cache = ResponseCache(tmp_path)
+    cache.put("key", {"answer": "A"})
+
+    def utime(path, *args):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr("src.llm_caller.os.utime", utime)
+    assert cache.get("key") == {"answer": "A"}
+    assert cache.hits == 1
+
+
+def test_empty_text_response_is_cached(tmp_path, monkeypatch):
+    cache = ResponseCache(tmp_path)
+    caller = LLMCaller(api_key="stub", model_id="openai/stub", cache=cache)
+    monkeypatch.setattr(caller, "_invoke", lambda *args, **kwargs: None)
+    messages = [{"role": "user", "content": "Hello"}]
+    assert caller.invoke(messages, response_model=None) is None
+    monkeypatch.setattr(caller, "_invoke", lambda *args, **kwargs: pytest.fail("not cached"))
+    assert caller.invoke(messages, response_model=None) is None
+    assert cache.hits == 1
@@ -0,0 +1,49 @@
+from typing import List
+
+from src.yolo.yolo import Yolo
+
+
+class Result:
+    boxes: list = []
+
+
+class FakeModel:
+    """Stands in for ultralytics.YOLO: one empty result per image."""
+
+    def __init__(self):
+        self.batches: List[List[str]] = []
+
+    def __call__(self, files, verbose=True):
+        self.batches.append(list(files))
+        return [Result() for _ in files]
+
+
+def test_predict_batch_keeps_input_order():
+    model = FakeModel()
+    yolo = Yolo(model)
+    files = [f"board{index}.png" for index in range(5)]
+    seen = []
+    for file, detections in yolo.predict_batch(iter(files), batch_size=2):
+        # The yielded image is also the current one
+        assert yolo._file == file
+        seen.append((file, detections))
+    assert seen == [(file, []) for file in files]
+    assert model.batches == [files[:2], files[2:4], files[4:]]
+
+
+def test_predict_batch_accepts_one_image_path(tmp_path):
+    image = tmp_path / "board.png"
+    image.write_bytes(b"")
+    for files in (str(image), image):
+        model = FakeModel()
+        assert list(Yolo(model).predict_batch(files)) == [(str(image), [])]
+        assert model.batches == [[str(image)]]
+
+
+def test_predict_batch_lists_a_directory(tmp_path):
+    for name in ("b.png", "a.jpg", "notes.txt"):
+        (tmp_path / name).write_bytes(b"")
+    model = FakeModel()
+    files = [file for file, _ in Yolo(model).predict_batch(tmp_path, batch_size=1)]
+    assert files == [str(tmp_path / "a.jpg"), str(tmp_path / "b.png")]
+    assert len(model.batches) == 2